@@ -0,0 +1,272 @@
+"""
+Benchmark large synthetic blueprints
+
+Generates a blueprint of each core state type at each size, then measures the
+time to load (define), check and apply the states, and the peak memory of the
+process. States are applied to the in-memory system (see `sermin.system`), so
+this needs no root access or network, and measures Sermin rather than the
+tools it runs.
+
+Each case runs in its own process, so peak memory is not shared between
+cases. Results are written as JSON, for comparison between releases.
+
+Usage::
+
+    python benchmarks/blueprint.py [--sizes=1000,10000] [--types=File,Dir]
+        [--output=results.json] [--verbosity=error]
+
+Half the states in each blueprint already match the system and half need to
+be applied. Every tenth state is a parent of the next nine, and every fifth
+state listens to the state before it.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Benchmark this copy of Sermin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sermin import (  # NOQA
+    Command, Dir, File, Git, Group, Package, Service, User,
+)
+from sermin import system  # NOQA
+from sermin.config import settings  # NOQA
+from sermin.state.base.registry import registry  # NOQA
+from sermin.system.memory import MemorySystem  # NOQA
+
+
+TYPES = [
+    'File', 'Dir', 'Package', 'User', 'Group', 'Service', 'Git', 'Command',
+]
+SIZES = [1000, 10000]
+
+COMMIT = '0' * 40
+REMOTE = 'https://example.com/repo.git'
+
+
+def exists(i):
+    """
+    Return True if the state at this index should already match the system
+    """
+    return i % 2 == 0
+
+
+def make_file(target, i):
+    path = '/files/file-{}'.format(i)
+    if exists(i):
+        target.write(path, 'content {}'.format(i).encode('utf-8'))
+    return File(path, content='content {}'.format(i))
+
+
+def make_dir(target, i):
+    path = '/dirs/dir-{}'.format(i)
+    if exists(i):
+        target.makedirs(path)
+    return Dir(path)
+
+
+def make_package(target, i):
+    name = 'package-{}'.format(i)
+    if exists(i):
+        target.packages.add(name)
+    return Package(name)
+
+
+def make_user(target, i):
+    name = 'user-{}'.format(i)
+    if exists(i):
+        target.users[name] = [10000 + i, 10000 + i, '', '/nonexistent', '']
+    return User(name, home=None)
+
+
+def make_group(target, i):
+    name = 'group-{}'.format(i)
+    if exists(i):
+        target.groups[name] = [10000 + i, []]
+    return Group(name)
+
+
+def make_service(target, i):
+    name = 'service-{}'.format(i)
+    if exists(i):
+        target.start(name)
+    return Service(name)
+
+
+def make_git(target, i):
+    path = '/repos/repo-{}'.format(i)
+    if exists(i):
+        target.add_repo(path, REMOTE)
+    return Git(path, remote=REMOTE, commit=COMMIT)
+
+
+def make_command(target, i):
+    return Command('true {}'.format(i))
+
+
+factories = {
+    'File': make_file,
+    'Dir': make_dir,
+    'Package': make_package,
+    'User': make_user,
+    'Group': make_group,
+    'Service': make_service,
+    'Git': make_git,
+    'Command': make_command,
+}
+
+
+def prepare(target):
+    """
+    Create the directories and remote used by the states
+    """
+    for name in ['/files', '/dirs', '/repos']:
+        target.makedirs(name)
+    target.add_remote(REMOTE, branches={'master': COMMIT})
+
+
+def save(target):
+    """
+    Write the databases of users, groups and packages added by the factories
+    """
+    target.save_users()
+    target.save_groups()
+    target.save_packages()
+
+
+def load(factory, target, size):
+    """
+    Define the states, nesting and connecting them
+    """
+    parent = None
+    previous = None
+    for i in range(size):
+        state = factory(target, i)
+        if i % 10 == 0:
+            parent = state
+        else:
+            parent.children.add(state)
+        if previous is not None and i % 5 == 0:
+            state.listen(previous)
+        previous = state
+
+
+def run_case(type_name, size, verbosity):
+    """
+    Run a single case and return its results
+    """
+    target = system.systems['memory'] = MemorySystem()
+    settings.sermin.system = 'memory'
+    settings.sermin.verbosity = verbosity
+    settings.sermin.dryrun = False
+    prepare(target)
+
+    start = time.time()
+    load(factories[type_name], target, size)
+    loaded = time.time()
+    save(target)
+    del target.commands[:]
+
+    registry.check()
+    checked = time.time()
+    registry.apply()
+    applied = time.time()
+
+    # ru_maxrss is in kilobytes on Linux, but bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+
+    return {
+        'type': type_name,
+        'size': size,
+        'top_level_states': len(registry),
+        'load': loaded - start,
+        'check': checked - loaded,
+        'apply': applied - checked,
+        'shell_commands': len(target.commands),
+        'peak_memory_kb': peak,
+    }
+
+
+def run_isolated(type_name, size, verbosity):
+    """
+    Run a case in a new process, and return its results
+    """
+    handle, path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    try:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(
+                [
+                    sys.executable, os.path.abspath(__file__),
+                    '--case={}:{}'.format(type_name, size),
+                    '--output={}'.format(path),
+                    '--verbosity={}'.format(verbosity),
+                ],
+                stdout=devnull,
+            )
+        with open(path) as file:
+            return json.load(file)
+    finally:
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--sizes', default=','.join(str(size) for size in SIZES),
+        help='Comma-separated list of blueprint sizes',
+    )
+    parser.add_argument(
+        '--types', default=','.join(TYPES),
+        help='Comma-separated list of state types',
+    )
+    parser.add_argument(
+        '--output', help='Path to write results to; default is stdout',
+    )
+    parser.add_argument(
+        '--verbosity', default='error',
+        help='Sermin reporting verbosity while benchmarking',
+    )
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        type_name, size = args.case.split(':')
+        results = run_case(type_name, int(size), args.verbosity)
+    else:
+        cases = []
+        for size in [int(size) for size in args.sizes.split(',')]:
+            for type_name in args.types.split(','):
+                result = run_isolated(type_name, size, args.verbosity)
+                print(
+                    '{type:<8} {size:>7} load {load:7.2f}s  check '
+                    '{check:7.2f}s  apply {apply:7.2f}s  peak '
+                    '{peak_memory_kb:>8}KB'.format(**result),
+                    file=sys.stderr,
+                )
+                cases.append(result)
+        results = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.time(),
+            'results': cases,
+        }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark the memory footprint of state instances
+
+Defines a number of states of each core state type, and measures the memory
+allocated per state using `tracemalloc`. The arguments for the states are
+created before measuring, so only the states themselves and their registry
+entries are counted. Requires Python 3.
+
+Usage::
+
+    python benchmarks/footprint.py [--count=10000] [--types=File,Dir]
+        [--output=results.json]
+"""
+from __future__ import print_function
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# Benchmark this copy of Sermin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sermin import (  # NOQA
+    Command, Dir, File, Git, Group, Package, Service, User,
+)
+from sermin.state.base.registry import registry  # NOQA
+
+
+TYPES = [
+    'File', 'Dir', 'Package', 'User', 'Group', 'Service', 'Git', 'Command',
+]
+COUNT = 10000
+
+REMOTE = 'https://example.com/repo.git'
+
+
+def make_args(type_name, count):
+    """
+    Return a list of the arguments for each state
+    """
+    if type_name == 'Git':
+        return [
+            ('/repos/repo-{}'.format(i), REMOTE) for i in range(count)
+        ]
+    if type_name in ('File', 'Dir'):
+        return [('/files/file-{}'.format(i),) for i in range(count)]
+    return [('{}-{}'.format(type_name.lower(), i),) for i in range(count)]
+
+
+def measure(type_name, count):
+    """
+    Return the number of bytes allocated per state
+    """
+    cls = globals()[type_name]
+    args = make_args(type_name, count)
+    registry.clear()
+    gc.collect()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for arg in args:
+        cls(*arg)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    registry.clear()
+    return (after - before) / float(count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--count', type=int, default=COUNT,
+        help='Number of states of each type to define',
+    )
+    parser.add_argument(
+        '--types', default=','.join(TYPES),
+        help='Comma-separated list of state types',
+    )
+    parser.add_argument(
+        '--output', help='Path to write results to; default is stdout',
+    )
+    args = parser.parse_args()
+
+    cases = []
+    for type_name in args.types.split(','):
+        per_state = measure(type_name, args.count)
+        print(
+            '{:<8} {:>8.0f} bytes per state'.format(type_name, per_state),
+            file=sys.stderr,
+        )
+        cases.append({
+            'type': type_name,
+            'count': args.count,
+            'bytes_per_state': per_state,
+        })
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'results': cases,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
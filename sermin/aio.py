@@ -0,0 +1,207 @@
+"""
+Helpers for running states on an asyncio event loop
+
+Sermin supports Python 2, so this module does not use ``async`` or ``await``
+syntax; results are chained using futures and callbacks. States and ad-hoc
+functions written for Python 3 can still use ``async def``.
+
+On Python 2 ``asyncio`` is not available; the helpers which need a loop will
+raise a ``RunError``.
+"""
+import inspect
+import threading
+
+try:
+    import asyncio
+    import concurrent.futures
+except ImportError:
+    asyncio = None
+
+from . import context
+from .exceptions import RunError
+
+
+__all__ = []
+
+
+# Threads started by `to_thread` know the loop they were started from, so
+# they can hand awaitables back to it
+_local = threading.local()
+
+
+def require():
+    """
+    Raise a RunError if asyncio is not available
+    """
+    if asyncio is None:
+        raise RunError('asyncio is not available in this version of Python')
+
+
+def get_loop():
+    require()
+    return asyncio.get_event_loop()
+
+
+def iscoroutinefunction(fn):
+    """
+    Return True if fn was defined with ``async def``
+    """
+    if asyncio is None:
+        return False
+    return asyncio.iscoroutinefunction(fn)
+
+
+def is_awaitable(value):
+    """
+    Return True if the value is a coroutine, future or other awaitable
+    """
+    if asyncio is None:
+        return False
+    return inspect.isawaitable(value)
+
+
+def done(value):
+    """
+    Return a future which has already resolved to the value
+    """
+    future = get_loop().create_future()
+    future.set_result(value)
+    return future
+
+
+def ensure(value):
+    """
+    Return a future for the value, which may or may not be awaitable
+    """
+    if is_awaitable(value):
+        return asyncio.ensure_future(value)
+    return done(value)
+
+
+def _copy(source, target):
+    """
+    Copy the outcome of the source future to the target future
+    """
+    if target.cancelled():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def then(value, fn):
+    """
+    Call fn with the result of the value once it is available
+
+    Returns a future for the result of fn. If fn returns an awaitable, the
+    future resolves once that does. Exceptions are passed along the chain.
+    """
+    source = ensure(value)
+    target = get_loop().create_future()
+
+    def callback(source):
+        if source.cancelled() or source.exception() is not None:
+            _copy(source, target)
+            return
+
+        try:
+            result = fn(source.result())
+        except Exception as e:
+            target.set_exception(e)
+            return
+
+        if is_awaitable(result):
+            asyncio.ensure_future(result).add_done_callback(
+                lambda inner: _copy(inner, target),
+            )
+        else:
+            target.set_result(result)
+
+    source.add_done_callback(callback)
+    return target
+
+
+def gather(values):
+    """
+    Return a future for a list of the results of the values
+    """
+    return asyncio.gather(*[ensure(value) for value in values])
+
+
+def sequence(items, fn):
+    """
+    Call fn for each item in turn, waiting for each result before calling
+    fn with the next item
+
+    Returns a future for a list of the results
+    """
+    results = []
+
+    def step(index):
+        if index == len(items):
+            return results
+
+        def collect(result):
+            results.append(result)
+            return step(index + 1)
+        return then(fn(items[index]), collect)
+
+    return ensure(step(0))
+
+
+def to_thread(fn, *args):
+    """
+    Call fn in the loop's default executor
+
+    Returns a future for the result. The call sees the caller's context, and
+    any awaitable passed to `resolve` in the thread is run on this loop.
+    """
+    # Local import to avoid circular import
+    from .state.base.parallel import _set_worker
+
+    loop = get_loop()
+
+    def run():
+        # Nested registries run serially during the call. The executor's
+        # threads are shared, so the flag is restored afterwards.
+        worker = _set_worker(True)
+        _local.loop = loop
+        try:
+            return fn(*args)
+        finally:
+            _local.loop = None
+            _set_worker(worker)
+
+    return loop.run_in_executor(None, context.bind(run))
+
+
+def resolve(value):
+    """
+    Return the result of the value, blocking if it is awaitable
+
+    This lets synchronous code call asynchronous checks and applies. In a
+    thread started by `to_thread`, the awaitable is run on the loop which
+    started the thread; otherwise it is run to completion on a new loop.
+    """
+    if not is_awaitable(value):
+        return value
+
+    loop = getattr(_local, 'loop', None)
+    if loop is None:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(value)
+        finally:
+            loop.close()
+
+    result = concurrent.futures.Future()
+
+    def start():
+        asyncio.ensure_future(value).add_done_callback(
+            lambda future: _copy(future, result),
+        )
+    loop.call_soon_threadsafe(start)
+    return result.result()
@@ -0,0 +1,110 @@
+"""
+Local cache of data which persists between runs
+"""
+import io
+import json
+import os
+import tempfile
+import threading
+
+from . import system
+from .config import settings
+
+
+# All stores, so they can be saved at the end of a run
+_stores = []
+
+
+class Store(object):
+    """
+    A dict which is loaded from and saved to a JSON file in the cache dir
+
+    Values must be JSON serialisable. Changes are held in memory until
+    `save()` is called; this is done for all stores by `save()` at the end of
+    each registry run.
+
+    Data about a system other than the local machine is only held in memory,
+    so it is never mixed with the local cache - see `sermin.system`.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._path = None
+        self._system = None
+        self._data = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        _stores.append(self)
+
+    @property
+    def path(self):
+        if not system.get().local:
+            return None
+        return os.path.join(
+            os.path.expanduser(settings.sermin.cache),
+            '{}.json'.format(self.name),
+        )
+
+    @property
+    def data(self):
+        # Reload if the system or cache path setting has changed
+        path = self.path
+        target = system.get()
+        if (
+            self._data is None or
+            path != self._path or
+            target is not self._system
+        ):
+            self._path = path
+            self._system = target
+            self._dirty = False
+            if path is None:
+                self._data = {}
+                return self._data
+            try:
+                with io.open(path, 'r', encoding='utf-8') as file:
+                    self._data = json.load(file)
+            except (IOError, OSError, ValueError):
+                # Missing or corrupt - start again
+                self._data = {}
+        return self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self.data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self.data[key] = value
+            self._dirty = True
+
+    def delete(self, key):
+        with self._lock:
+            if self.data.pop(key, None) is not None:
+                self._dirty = True
+
+    def save(self):
+        """
+        Write changes to disk
+        """
+        with self._lock:
+            if not self._dirty or self._path is None:
+                return
+            path = self._path
+            dirname = os.path.dirname(path)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+
+            # Write to a temporary file and rename so it's never half-written
+            handle, temp_path = tempfile.mkstemp(dir=dirname)
+            with os.fdopen(handle, 'w') as file:
+                json.dump(self._data, file)
+            os.rename(temp_path, path)
+            self._dirty = False
+
+
+def save():
+    """
+    Save changes to all stores
+    """
+    for store in _stores:
+        store.save()
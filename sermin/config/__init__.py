@@ -1,3 +1,3 @@
-from .module import Setting, settings  # NOQA
+from .module import Scope, Setting, settings  # NOQA
 from .utils import parse_args  # NOQA
 from . import defaults  # NOQA
@@ -11,6 +11,65 @@ settings.sermin.confirm = Setting('Confirm actions', default=False)
 settings.sermin.verbosity = Setting(
     'Reporting verbosity', default=VERBOSITY_DEBUG,
 )
+settings.sermin.report_format = Setting(
+    'Reporting format: text or json', default='text',
+)
+settings.sermin.report_log = Setting('Path to a file to log reports to')
+settings.sermin.parallel = Setting(
+    'Number of states to check and apply in parallel', type=int, default=1,
+)
+settings.sermin.batch = Setting(
+    'Batch package, user and group changes into single transactions',
+    default=False,
+)
+
+settings.sermin.system = Setting(
+    'System to apply states to: local or memory', default='local',
+)
+settings.sermin.shell_backend = Setting(
+    'Shell backend for running commands: popen or coprocess',
+    default='popen',
+)
+settings.sermin.shell_tail = Setting(
+    'Lines of streamed command output to keep in memory',
+    type=int, default=100,
+)
+settings.sermin.shell_spool = Setting(
+    'Bytes of streamed command output to keep in memory before writing it '
+    'to a temporary file',
+    type=int, default=1024 * 1024,
+)
+
+settings.sermin.cache = Setting(
+    'Path to the local cache', default='~/.sermin/cache',
+)
+settings.sermin.fact_cache = Setting(
+    'Cache system facts in the local cache between runs', default=True,
+)
+
+settings.sermin.git_fetch = Setting(
+    'When Git states fetch from their remote: always, needed, or a number '
+    'of seconds between fetches of a branch',
+    default='always',
+)
+settings.sermin.git_mirrors = Setting(
+    'Path to keep mirrors of git remotes for Git states to clone from',
+    default='~/.sermin/git-mirrors',
+)
+
+settings.sermin.template_cache_size = Setting(
+    'Number of compiled templates to keep in memory', type=int, default=400,
+)
+settings.sermin.template_cache = Setting(
+    'Path to store compiled templates between runs',
+)
+
+settings.sermin.profile = Setting(
+    'Path to write a profile of the time taken by each state',
+)
+settings.sermin.profile_format = Setting(
+    'Format of the profile: json or trace', default='json',
+)
 
 settings.sermin.source = Setting('Source of the blueprint')
 settings.sermin.host = Setting('Host to apply the blueprint to', list=True)
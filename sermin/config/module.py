@@ -16,7 +16,22 @@ Usage:
 
     # Read a setting's value by setting a value
     print(settings.myapp.mysetting)
+
+    # Call a function with the new value whenever a setting changes globally
+    settings.myapp._watch('mysetting', callback)
+
+    # Override setting values in the current context
+    scope = Scope()
+    with scope.activate():
+        settings.myapp.mysetting = 'scoped'
 """
+from contextlib import contextmanager
+
+from ..context import ContextValue
+
+
+# Scope of setting values for the current context
+_scope = ContextValue('settings')
 
 
 class Registry(object):
@@ -95,6 +110,52 @@ class Namespace(object):
                 )
             self._settings[name] = value
 
+    def _watch(self, name, callback):
+        """
+        Call the callback with the setting's value now, and whenever it
+        changes
+        """
+        self._settings[name].watch(callback)
+
+    def _setting(self, name):
+        """
+        Return the Setting object for the named setting
+        """
+        return self._settings[name]
+
+
+class Scope(object):
+    """
+    Setting values which override the global values in a context
+
+    While a scope is active, settings which are assigned are changed in the
+    scope, and settings which have not been assigned in the scope fall back
+    to their global values. This lets blueprints be run concurrently with
+    different settings - see `sermin.core.Sermin`.
+
+    Namespaces and settings are always defined globally. Watchers are only
+    called when a global value changes, so must not cache values which can
+    be overridden by a scope.
+    """
+    def __init__(self):
+        # {Setting: value}
+        self.values = {}
+
+        # {(Setting, key): value} derived from values in this scope - see
+        # `Setting.derive`
+        self.derived = {}
+
+    @contextmanager
+    def activate(self):
+        """
+        Use this scope in the current context until the block ends
+        """
+        token = _scope.set(self)
+        try:
+            yield self
+        finally:
+            _scope.reset(token)
+
 
 class Setting(object):
     """
@@ -116,26 +177,44 @@ class Setting(object):
         self.type = type
         self.default = default
         self.list = list
+        self.watchers = []
+
+        # {key: value} derived from the global value - see `derive`
+        self.derived = {}
 
         # Set initial value
-        self.set(default)
+        self.value = self.parse(default, None)
 
-    def set(self, value):
+    def parse(self, value, current):
         """
         Parse the value and return it as the specified type
 
-        If the value is None, empties the value
+        If the value is None, empties the value. List settings return a new
+        list with the value appended to the current list.
 
         Raise a ValueError if the value is invalid
         """
         if value is None:
-            self.value = [] if self.list else None
-        else:
-            value = self.cast(value)
-            if self.list:
-                self.value.append(value)
-            else:
-                self.value = value
+            return [] if self.list else None
+        value = self.cast(value)
+        if self.list:
+            return (current or []) + [value]
+        return value
+
+    def set(self, value):
+        """
+        Set the value in the active scope, or globally if there is no scope
+        """
+        scope = _scope.get()
+        if scope is not None:
+            scope.values[self] = self.parse(value, self.get())
+            scope.derived.clear()
+            return
+
+        self.value = self.parse(value, self.value)
+        self.derived = {}
+        for callback in self.watchers:
+            callback(self.value)
 
     def cast(self, value):
         if self.type is None:
@@ -143,7 +222,40 @@ class Setting(object):
         return self.type(value)
 
     def get(self):
+        scope = _scope.get()
+        if scope is not None and self in scope.values:
+            return scope.values[self]
         return self.value
 
+    def derive(self, key, fn):
+        """
+        Return `fn(value)` for the value in the current context, cached
+        under the key until the value is set again
+
+        Use for values computed from the setting which are needed often. The
+        result is cached in the active scope if it has its own value,
+        otherwise with the global value.
+        """
+        scope = _scope.get()
+        if scope is not None and self in scope.values:
+            derived, key = scope.derived, (self, key)
+        else:
+            derived = self.derived
+        try:
+            return derived[key]
+        except KeyError:
+            value = derived[key] = fn(self.get())
+            return value
+
+    def watch(self, callback):
+        """
+        Call the callback with the global value now, and whenever it is set
+        globally
+
+        Values set in a `Scope` are not passed to the callback.
+        """
+        self.watchers.append(callback)
+        callback(self.value)
+
     def __repr__(self):
         return '<Setting {}>'.format(self.value)
@@ -16,6 +16,9 @@ def parse_args(args):
         --no-namespace:arg
         --namespace:arg=value
 
+    Dashes in argument names are converted to underscores, so `--arg-name`
+    sets the setting `arg_name`.
+
     Returns a tuple of (unnamed, named), where:
         unnamed     List of unnamed arguments
         named       Dictionary of namespaces
@@ -52,6 +55,6 @@ def parse_args(args):
             namespace, key = key.split(':', 1)
 
         # Store key and value
-        named[namespace][key] = val
+        named[namespace][key.replace('-', '_')] = val
 
     return unnamed, named
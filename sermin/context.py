@@ -0,0 +1,86 @@
+"""
+Values which are local to the current context
+
+On Python 3.7 and later these use `contextvars`, so each asyncio task sees
+the values set by the code which created it. On earlier versions they are
+local to the current thread.
+
+New threads do not inherit the values; wrap a function with `bind` before
+passing it to a thread so it runs with the caller's values.
+"""
+import threading
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+
+__all__ = []
+
+
+# All values, so `bind` can copy them without contextvars
+_values = []
+
+
+class ContextValue(object):
+    """
+    A value which is local to the current context
+    """
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+        if contextvars is not None:
+            self._var = contextvars.ContextVar(name, default=default)
+        else:
+            self._local = threading.local()
+        _values.append(self)
+
+    def get(self):
+        if contextvars is not None:
+            return self._var.get()
+        return getattr(self._local, 'value', self.default)
+
+    def set(self, value):
+        """
+        Set the value in the current context, and return a token to pass to
+        `reset` to restore the previous value
+        """
+        if contextvars is not None:
+            return self._var.set(value)
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        if contextvars is not None:
+            self._var.reset(token)
+        else:
+            self._local.value = token
+
+
+def bind(fn):
+    """
+    Return a function which calls fn with the current context's values
+
+    The returned function can be called from other threads, including from
+    several threads at once.
+    """
+    if contextvars is not None:
+        context = contextvars.copy_context()
+
+        def bound(*args, **kwargs):
+            # A context can only be entered by one thread at a time
+            return context.copy().run(fn, *args, **kwargs)
+        return bound
+
+    values = [(value, value.get()) for value in _values]
+
+    def bound(*args, **kwargs):
+        tokens = [(value, value.set(current)) for value, current in values]
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            for value, token in reversed(tokens):
+                value.reset(token)
+    return bound
@@ -1,15 +1,29 @@
 """
 Load and run Sermin scripts
 """
-from importlib import import_module
+from contextlib import contextmanager
 import os
+import runpy
 import sys
+import threading
 
-from .state.base.registry import registry
-from .config import settings
+from .state.base.registry import StateRegistry, use as use_registry
+from .config import Scope, settings
+
+
+# Held while a blueprint is loaded, as loading changes `sys.modules`
+_load_lock = threading.Lock()
 
 
 class Sermin(object):
+    """
+    Load and run a blueprint
+
+    Each instance has its own registry of states and its own scope of
+    settings, so several blueprints can be loaded and run concurrently in
+    threads or asyncio tasks. Settings which are not set on the instance
+    fall back to their global values.
+    """
     def __init__(self, blueprint, **settings_namespaces):
         """
         Initialise Sermin with the blueprint and any settings
@@ -21,18 +35,31 @@ class Sermin(object):
         # Store the blueprint
         self.blueprint = blueprint
 
-        # Load settings
-        self.load_settings(settings_namespaces)
+        self.registry = StateRegistry()
+        self.settings = Scope()
 
-        # If the --host argument is set, we're not loading it here
-        if settings.sermin.host:
-            self.remote()
-        else:
-            # Load and initialise the blueprint
-            self.load_blueprint()
+        with self.context():
+            # Load settings
+            self.load_settings(settings_namespaces)
+
+            # If the --host argument is set, we're not loading it here
+            if settings.sermin.host:
+                self.remote()
+            else:
+                # Load and initialise the blueprint
+                self.load_blueprint()
+
+    @contextmanager
+    def context(self):
+        """
+        Use this instance's registry and settings in the current context
+        until the block ends
+        """
+        with use_registry(self.registry), self.settings.activate():
+            yield
 
     def load_settings(self, settings_namespaces):
-        # Set global settings from self.settings
+        # Set settings in the active scope
         for namespace_name, settings_dict in settings_namespaces.items():
             namespace = getattr(settings, namespace_name)
             for key, value in settings_dict.items():
@@ -41,8 +68,13 @@ class Sermin(object):
     def load_blueprint(self):
         """
         Reset the registry and load a blueprint
+
+        The blueprint module is run each time it is loaded, rather than
+        imported once, so each instance defines its own states. Modules it
+        imports from its own dir are removed from `sys.modules` afterwards,
+        so they are run again by the next instance.
         """
-        registry.clear()
+        self.registry.clear()
 
         # Prepare source
         source = settings.sermin.source
@@ -64,7 +96,36 @@ class Sermin(object):
             # http://stackoverflow.com/questions/67631/how-to-import-a-module-given-the-full-path
             raise NotImplementedError('No script support yet')
         else:
-            import_module(self.blueprint)
+            with _load_lock:
+                loaded = set(sys.modules)
+                blueprint = runpy.run_module(self.blueprint)
+                self.unload_modules(
+                    set(sys.modules) - loaded,
+                    os.path.dirname(os.path.abspath(blueprint['__file__'])),
+                )
+
+    def unload_modules(self, names, path):
+        """
+        Remove the named modules from `sys.modules` if their files are in the
+        path
+
+        Modules are also removed from their parent packages, otherwise
+        `from . import name` would find them there.
+        """
+        prefix = os.path.join(path, '')
+        for name in names:
+            module = sys.modules[name]
+            filename = getattr(module, '__file__', None)
+            if not filename:
+                continue
+            if not os.path.abspath(filename).startswith(prefix):
+                continue
+            del sys.modules[name]
+
+            parent_name, _, attr = name.rpartition('.')
+            parent = sys.modules.get(parent_name)
+            if parent is not None and getattr(parent, attr, None) is module:
+                delattr(parent, attr)
 
     def source_http(self, source):
         raise NotImplementedError('No http support yet')
@@ -87,4 +148,14 @@ class Sermin(object):
         # Use fabric to install sermin, push file (if necessary) and run
 
     def run(self):
-        registry.run()
+        with self.context():
+            self.registry.run()
+
+    def arun(self):
+        """
+        Run the blueprint on the asyncio event loop
+
+        Returns a future to await - see `StateRegistry.arun`
+        """
+        with self.context():
+            return self.registry.arun()
@@ -0,0 +1,158 @@
+"""
+System facts which are cached until their source of truth changes
+"""
+import io
+import threading
+
+from . import run, system
+from .cache import Store
+from .config import settings
+
+
+class Fact(object):
+    """
+    Abstract base class for a fact about the system
+
+    A fact is computed from one or more files on the system, such as a
+    database in `/var/lib` or `/etc`. The metadata of those files is used as
+    the fact's fingerprint; while it is unchanged, the value is reused from
+    memory, or from the local cache if it was computed by an earlier run.
+
+    The local cache can be disabled with the `fact_cache` setting.
+
+    Subclasses should set `name` and `paths`, and implement `compute()` to
+    return a JSON serialisable value. If the value is not JSON serialisable,
+    implement `encode()` and `decode()` to convert it.
+
+    Facts which are read very often can set `per_run` to only check the
+    fingerprint once per registry run; states which change the source of
+    truth must then call `invalidate()`.
+    """
+    # Unique name for this fact
+    name = None
+
+    # Paths to the files which are the source of truth for this fact
+    paths = ()
+
+    # If True, the fingerprint is checked once per registry run
+    per_run = False
+
+    # Values of all facts, with their fingerprints
+    store = Store('facts')
+
+    def __init__(self, *paths):
+        if paths:
+            self.paths = paths
+        self.key = '{}:{}'.format(self.name, ':'.join(self.paths))
+        self._fingerprint = None
+        self._value = None
+        self._run = None
+        self._lookups = {}
+        self._lock = threading.Lock()
+
+    def get_fingerprint(self):
+        """
+        Return a list of the metadata of each path, or None if it is missing
+        """
+        fingerprint = []
+        target = system.get()
+        for path in self.paths:
+            try:
+                fingerprint.append(target.stat(path))
+            except OSError:
+                fingerprint.append(None)
+        return fingerprint
+
+    def compute(self):
+        """
+        Return the value of the fact, read from the system
+        """
+        raise NotImplementedError('Subclasses must implement compute')
+
+    def open(self, path):
+        """
+        Open the file at the path on the current system to read as text
+        """
+        return io.TextIOWrapper(system.get().open(path), encoding='utf-8')
+
+    def encode(self, value):
+        """
+        Convert the value to a JSON serialisable value
+        """
+        return value
+
+    def decode(self, value):
+        """
+        Convert a value returned by encode back to the value
+        """
+        return value
+
+    def get(self):
+        """
+        Return the value of the fact
+        """
+        with self._lock:
+            run_id = self.get_run()
+            if (
+                run_id is not None and
+                run_id == self._run and
+                self._fingerprint is not None
+            ):
+                return self._value
+
+            fingerprint = self.get_fingerprint()
+            if fingerprint != self._fingerprint:
+                self._value = self.load(fingerprint)
+                self._fingerprint = fingerprint
+                self._lookups = {}
+            self._run = run_id
+            return self._value
+
+    def get_run(self):
+        """
+        Return the id of the current run if `per_run` is set, otherwise None
+        """
+        if not self.per_run:
+            return None
+        return run.current().id
+
+    def lookup(self, key, fn):
+        """
+        Return `fn(key)`, remembering the result until the fact changes
+
+        Use for values which are related to the fact but not part of it, such
+        as lookups in a name service for names missing from a database.
+        """
+        self.get()
+        with self._lock:
+            if key not in self._lookups:
+                self._lookups[key] = fn(key)
+            return self._lookups[key]
+
+    def load(self, fingerprint):
+        """
+        Return the value from the local cache if the fingerprint matches,
+        otherwise compute it and store it in the local cache
+        """
+        use_cache = settings.sermin.fact_cache
+        if use_cache:
+            record = self.store.get(self.key)
+            if record and record['fingerprint'] == fingerprint:
+                return self.decode(record['value'])
+
+        value = self.compute()
+        if use_cache:
+            self.store.set(self.key, {
+                'fingerprint': fingerprint,
+                'value': self.encode(value),
+            })
+        return value
+
+    def invalidate(self):
+        """
+        Forget the value in memory, so it is checked against the fingerprint
+        next time it is used
+        """
+        with self._lock:
+            self._fingerprint = None
+            self._lookups = {}
@@ -0,0 +1,275 @@
+"""
+Profile where a run spends its time
+
+When the `profile` setting is set, `run_check` and `run_apply` are timed for
+each state, and the number of shell commands each runs is counted. Calls
+which return a result the state already knows are not measured. At the end
+of the run the results are written to the `profile` path, either as a JSON
+summary or as a Chrome trace-event file.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+from . import run
+from .config import settings
+
+
+__all__ = []
+
+
+# Monotonic where available, so the profile is not skewed by clock changes
+clock = getattr(time, 'monotonic', time.time)
+
+
+def enabled():
+    return bool(settings.sermin.profile)
+
+
+class Frame(object):
+    """
+    A state phase being measured in the current thread
+    """
+    def __init__(self):
+        self.start = clock()
+        self.shells = 0
+        self.child_time = 0
+
+
+class NoMeasure(object):
+    """
+    Context manager used in place of a measurement when profiling is
+    disabled
+    """
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+no_measure = NoMeasure()
+
+
+class Profiler(object):
+    """
+    Collect timings for each state phase
+
+    Time is recorded as both the total time of the phase, and the time spent
+    in the state itself, excluding any child states or listeners measured
+    within it. Shell commands are only counted against the innermost state.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+            self.origin = clock()
+
+    @property
+    def stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def measure(self, state, phase):
+        """
+        Context manager to measure a phase of a state
+        """
+        stack = self.stack
+        frame = Frame()
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            duration = clock() - frame.start
+            if stack:
+                stack[-1].child_time += duration
+            self.record(
+                state, phase, frame.start, duration,
+                self_time=duration - frame.child_time,
+                shells=frame.shells,
+            )
+
+    def measure_future(self, state, phase, future):
+        """
+        Measure a phase of a state running on the asyncio event loop
+
+        The phase is recorded when the future resolves. Child states and
+        shell commands cannot be separated from the state on the loop, so are
+        included in its own time.
+        """
+        start = clock()
+        future.add_done_callback(
+            lambda future: self.record(state, phase, start, clock() - start),
+        )
+        return future
+
+    def count_shell(self):
+        """
+        Count a shell command against the state being measured
+        """
+        stack = self.stack
+        if stack:
+            stack[-1].shells += 1
+
+    def record(self, state, phase, start, duration, self_time=None, shells=0):
+        """
+        Record a measurement of a state phase
+
+        The state is kept rather than its name, as finding the name can be
+        slow; names are found when the profile is exported.
+        """
+        event = {
+            'state': state,
+            'phase': phase,
+            'start': start - self.origin,
+            'duration': duration,
+            'self': duration if self_time is None else self_time,
+            'shells': shells,
+            'thread': threading.current_thread().ident,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def summarise(self):
+        """
+        Return the events aggregated by state class and instance
+
+        States are ordered by the time spent in the state itself, slowest
+        first.
+        """
+        classes = defaultdict(lambda: defaultdict(lambda: {
+            'count': 0, 'duration': 0, 'self': 0, 'shells': 0,
+        }))
+        states = {}
+        for event in self.events:
+            state = event['state']
+            if id(state) not in states:
+                states[id(state)] = {
+                    'state': '{}'.format(state),
+                    'class': type(state).__name__,
+                    'duration': 0,
+                    'self': 0,
+                    'shells': 0,
+                }
+            for totals in [
+                classes[type(state).__name__][event['phase']],
+                states[id(state)],
+            ]:
+                totals['duration'] += event['duration']
+                totals['self'] += event['self']
+                totals['shells'] += event['shells']
+                if 'count' in totals:
+                    totals['count'] += 1
+
+        return {
+            'duration': clock() - self.origin,
+            'classes': classes,
+            'states': sorted(
+                states.values(), key=lambda totals: -totals['self'],
+            ),
+        }
+
+    def trace(self):
+        """
+        Return the events in the Chrome trace-event format
+        """
+        pid = os.getpid()
+        names = {}
+        for event in self.events:
+            state = event['state']
+            if id(state) not in names:
+                names[id(state)] = '{}: {}'.format(type(state).__name__, state)
+        return {
+            'traceEvents': [
+                {
+                    'name': names[id(event['state'])],
+                    'cat': event['phase'],
+                    'ph': 'X',
+                    'ts': event['start'] * 1e6,
+                    'dur': event['duration'] * 1e6,
+                    'pid': pid,
+                    'tid': event['thread'],
+                    'args': {'shells': event['shells']},
+                }
+                for event in self.events
+            ],
+            'displayTimeUnit': 'ms',
+        }
+
+    def export(self, path, format='json'):
+        """
+        Write the profile to the path as a JSON summary or Chrome trace
+        """
+        if format == 'trace':
+            data = self.trace()
+        elif format == 'json':
+            data = self.summarise()
+        else:
+            raise ValueError('Unknown profile format {}'.format(format))
+
+        with open(os.path.expanduser(path), 'w') as file:
+            json.dump(data, file, indent=2)
+
+
+def get_profiler():
+    """
+    Return the profiler for the current run
+    """
+    return run.current().get(Profiler, Profiler)
+
+
+def measure(state, phase):
+    """
+    Context manager to measure a phase of a state if profiling is enabled -
+    see `Profiler.measure`
+    """
+    if not enabled():
+        return no_measure
+    return get_profiler().measure(state, phase)
+
+
+def measure_future(state, phase, future):
+    """
+    Measure a phase of a state running on the asyncio event loop if
+    profiling is enabled - see `Profiler.measure_future`
+    """
+    if not enabled():
+        return future
+    return get_profiler().measure_future(state, phase, future)
+
+
+def count_shell():
+    """
+    Count a shell command against the state being measured
+    """
+    if enabled():
+        get_profiler().count_shell()
+
+
+def start():
+    """
+    Start profiling the current run, if enabled
+    """
+    if enabled():
+        get_profiler()
+
+
+def save():
+    """
+    Write the profile of a run, if enabled
+    """
+    if enabled():
+        get_profiler().export(
+            settings.sermin.profile, format=settings.sermin.profile_format,
+        )
@@ -1,6 +1,24 @@
 """
 Sermin reporting
+
+Messages are filtered against the `verbosity` setting, then passed to each
+sink. Message arguments are only formatted if the message will be reported::
+
+    report.debug('Copying from {}', path)
+
+Sinks buffer their output, and write it when the buffer is full, when
+`flush_interval` seconds have passed since the last write, or when `flush()`
+is called - at the end of a run, before prompting for input, and at exit.
+While output is buffered, a background thread checks the sinks every
+`flush_interval` seconds, so messages are written while a long command runs.
 """
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
 from .config import settings
 from .constants import (
     VERBOSITY_LEVEL,
@@ -9,42 +27,306 @@ from .constants import (
 )
 
 
+class Sink(object):
+    """
+    Base class for report sinks
+
+    Records are formatted when they are written, and buffered until flushed.
+    If no stream is given, the sink writes to the current `sys.stdout`.
+    Subclasses must implement `format`.
+    """
+    buffer_size = 100
+    flush_interval = 0.1
+
+    def __init__(self, stream=None):
+        self._stream = stream
+        self.buffer = []
+        self.last_flush = time.time()
+
+    @property
+    def stream(self):
+        return self._stream or sys.stdout
+
+    def write(self, record):
+        self.buffer.append(self.format(record))
+        if (
+            len(self.buffer) >= self.buffer_size or
+            record.time - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def format(self, record):
+        """
+        Return the record as a string to write to the stream
+        """
+        raise NotImplementedError('Subclasses must implement format')
+
+    def flush_if_due(self, now):
+        """
+        Flush if `flush_interval` seconds have passed since the last flush
+        """
+        if self.buffer and now - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.time()
+        if not self.buffer:
+            return
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.stream.write(data)
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+
+class TextSink(Sink):
+    """
+    Write each line of a message prefixed with its label
+    """
+    def format(self, record):
+        label = record.label or '-'
+        return ''.join(
+            '[{}] {}\n'.format(label, line)
+            for line in record.msg.splitlines()
+        )
+
+
+class JsonSink(Sink):
+    """
+    Write each message as a line of JSON
+    """
+    def format(self, record):
+        return '{}\n'.format(json.dumps({
+            'time': record.time,
+            'level': record.level,
+            'label': record.label,
+            'msg': '{}'.format(record.msg),
+        }))
+
+
+class LogSink(TextSink):
+    """
+    Append messages to a log file, with their time and level
+    """
+    def __init__(self, path):
+        super(LogSink, self).__init__(
+            open(os.path.expanduser(path), 'a'),
+        )
+
+    def format(self, record):
+        prefix = '{} {} [{}] '.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.time)),
+            record.level.upper(),
+            record.label or '-',
+        )
+        return ''.join(
+            '{}{}\n'.format(prefix, line)
+            for line in record.msg.splitlines()
+        )
+
+    def close(self):
+        super(LogSink, self).close()
+        self.stream.close()
+
+
+class Record(object):
+    """
+    A reported message
+    """
+    __slots__ = ['time', 'level', 'label', 'msg']
+
+    def __init__(self, level, label, msg):
+        self.time = time.time()
+        self.level = level
+        self.label = label
+        self.msg = msg
+
+
+sinks = {
+    'text': TextSink,
+    'json': JsonSink,
+}
+
+
+class Pipeline(object):
+    """
+    Filter messages and pass them to the sinks
+
+    The threshold and default sinks follow the `verbosity`, `report_format`
+    and `report_log` settings in the current context, so instances running
+    with their own settings report separately. The threshold is cached until
+    the verbosity is set again in its scope. Default sinks are built the
+    first time each combination of settings is used, and closed when the
+    global settings change. Further sinks can be added with `add_sink`.
+    """
+    # Seconds between checks for buffered output by the flush thread
+    flush_interval = Sink.flush_interval
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # {(report_format, report_log): [Sink, ...]}
+        self._default_sinks = {}
+        self.extra_sinks = []
+        self._buffered = threading.Event()
+        self._flush_thread = None
+        self._verbosity = settings.sermin._setting('verbosity')
+
+    @property
+    def threshold(self):
+        return self._verbosity.derive('threshold', VERBOSITY_LEVEL.__getitem__)
+
+    def reset_sinks(self, value=None):
+        with self._lock:
+            for default_sinks in self._default_sinks.values():
+                for sink in default_sinks:
+                    sink.close()
+            self._default_sinks = {}
+
+    @property
+    def sinks(self):
+        """
+        Sinks for the settings in the current context
+        """
+        key = (settings.sermin.report_format, settings.sermin.report_log)
+        with self._lock:
+            if key not in self._default_sinks:
+                report_format, report_log = key
+                default_sinks = [sinks[report_format]()]
+                if report_log:
+                    default_sinks.append(LogSink(report_log))
+                self._default_sinks[key] = default_sinks
+            return self._default_sinks[key] + self.extra_sinks
+
+    @property
+    def all_sinks(self):
+        """
+        Sinks for every combination of settings used so far
+        """
+        with self._lock:
+            return [
+                sink
+                for default_sinks in self._default_sinks.values()
+                for sink in default_sinks
+            ] + self.extra_sinks
+
+    def add_sink(self, sink):
+        with self._lock:
+            self.extra_sinks.append(sink)
+
+    def remove_sink(self, sink):
+        with self._lock:
+            sink.flush()
+            self.extra_sinks.remove(sink)
+
+    def emit(self, level, label, msg):
+        record = Record(level, label, msg)
+        with self._lock:
+            sinks = self.sinks
+            for sink in sinks:
+                sink.write(record)
+            if any(sink.buffer for sink in sinks):
+                self._start_flush_thread()
+                self._buffered.set()
+
+    def _start_flush_thread(self):
+        if self._flush_thread is None:
+            self._flush_thread = threading.Thread(
+                target=self._flush_periodically, name='sermin-report',
+            )
+            self._flush_thread.daemon = True
+            self._flush_thread.start()
+
+    def _flush_periodically(self):
+        """
+        Flush sinks which have had output buffered for their
+        `flush_interval`, until nothing is left buffered
+        """
+        while True:
+            self._buffered.wait()
+            time.sleep(self.flush_interval)
+            with self._lock:
+                now = time.time()
+                sinks = self.all_sinks
+                for sink in sinks:
+                    sink.flush_if_due(now)
+                if not any(sink.buffer for sink in sinks):
+                    self._buffered.clear()
+
+    def flush(self):
+        with self._lock:
+            for sink in self.all_sinks:
+                sink.flush()
+
+
+pipeline = Pipeline()
+settings.sermin._watch('report_format', pipeline.reset_sinks)
+settings.sermin._watch('report_log', pipeline.reset_sinks)
+atexit.register(pipeline.flush)
+
+
 class Report(object):
+    """
+    Report messages with a label
+
+    The label can be a callable, in which case it is called the first time a
+    message is reported.
+    """
     def __init__(self, label=None):
-        self.label = label
+        self._label = label
 
-    def report(self, level, msg, label=None):
-        if level >= VERBOSITY_LEVEL[settings.sermin.verbosity]:
-            for line in msg.splitlines():
-                print('[{}] {}'.format(label or self.label or '-', line))
+    @property
+    def label(self):
+        if callable(self._label):
+            self._label = self._label()
+        return self._label
 
-    def debug(self, msg, label=None):
-        self.report(VERBOSITY_DEBUG, msg, label)
+    def report(self, level, msg, args=None, kwargs=None, label=None):
+        if VERBOSITY_LEVEL[level] < pipeline.threshold:
+            return
+        if args or kwargs:
+            msg = msg.format(*(args or ()), **(kwargs or {}))
+        pipeline.emit(level, label or self.label, msg)
 
-    def info(self, msg, label=None):
-        self.report(VERBOSITY_INFO, msg, label)
+    def debug(self, msg, *args, **kwargs):
+        label = kwargs.pop('label', None)
+        self.report(VERBOSITY_DEBUG, msg, args, kwargs, label)
 
-    def warning(self, msg, label=None):
-        self.report(VERBOSITY_WARNING, msg, label)
+    def info(self, msg, *args, **kwargs):
+        label = kwargs.pop('label', None)
+        self.report(VERBOSITY_INFO, msg, args, kwargs, label)
 
-    def error(self, msg, label=None):
-        self.report(VERBOSITY_ERROR, msg, label)
+    def warning(self, msg, *args, **kwargs):
+        label = kwargs.pop('label', None)
+        self.report(VERBOSITY_WARNING, msg, args, kwargs, label)
+
+    def error(self, msg, *args, **kwargs):
+        label = kwargs.pop('label', None)
+        self.report(VERBOSITY_ERROR, msg, args, kwargs, label)
 
 
 _report = Report()
 
 
-def debug(msg, label=None):
-    _report.debug(msg, label)
+def debug(msg, *args, **kwargs):
+    _report.debug(msg, *args, **kwargs)
+
+
+def info(msg, *args, **kwargs):
+    _report.info(msg, *args, **kwargs)
 
 
-def info(msg, label=None):
-    _report.info(msg, label)
+def warning(msg, *args, **kwargs):
+    _report.warning(msg, *args, **kwargs)
 
 
-def warning(msg, label=None):
-    _report.warning(msg, label)
+def error(msg, *args, **kwargs):
+    _report.error(msg, *args, **kwargs)
 
 
-def error(msg, label=None):
-    _report.error(msg, label)
+def flush():
+    """
+    Write any buffered messages
+    """
+    pipeline.flush()
@@ -0,0 +1,109 @@
+"""
+Values which are shared by everything during one registry run
+
+Caches which last for a run, such as snapshots of the system and batches of
+pending changes, are kept on the current `Run` rather than globally, so
+registries which run at the same time in separate threads or asyncio tasks
+don't share them - see `sermin.core.Sermin`.
+
+Code which is not running in a registry run uses the last run which was
+started, so values checked outside a run last until the next run starts.
+"""
+from contextlib import contextmanager
+import itertools
+import threading
+
+from .context import ContextValue
+
+
+__all__ = []
+
+
+# Run for the current context, set by `start` and `begin`
+_current = ContextValue('run')
+
+# Last run started in any context, and a lock to create the first
+_last = [None]
+_lock = threading.Lock()
+
+
+class Run(object):
+    """
+    A registry run, and the values cached during it
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(self._ids)
+        self.values = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key, factory):
+        """
+        Return the value for the key, calling factory to create it the first
+        time it is needed in this run
+
+        If the value is requested again while the factory is running, the
+        caller waits for the factory to finish rather than calling it again.
+        """
+        with self._lock:
+            if key in self.values:
+                return self.values[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self.values:
+                    return self.values[key]
+            value = factory()
+            with self._lock:
+                self.values[key] = value
+                del self._key_locks[key]
+            return value
+
+    def discard(self, key):
+        """
+        Forget the value for the key, so it is created again when needed
+        """
+        with self._lock:
+            self.values.pop(key, None)
+
+
+def current():
+    """
+    Return the run for the current context, or the last run started
+    """
+    run = _current.get()
+    if run is not None:
+        return run
+    with _lock:
+        if _last[0] is None:
+            _last[0] = Run()
+        return _last[0]
+
+
+def begin():
+    """
+    Start a new run in the current context, and return it
+
+    The run stays current in this context; use `start` to restore the
+    previous run when a block ends.
+    """
+    run = Run()
+    with _lock:
+        _last[0] = run
+    _current.set(run)
+    return run
+
+
+@contextmanager
+def start():
+    """
+    Start a new run in the current context until the block ends
+    """
+    token = _current.set(None)
+    try:
+        yield begin()
+    finally:
+        _current.reset(token)
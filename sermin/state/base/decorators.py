@@ -3,6 +3,7 @@ Decorators for ad-hoc methods
 """
 from future.utils import python_2_unicode_compatible
 
+from ... import aio
 from .state import State
 
 __all__ = ['wrap', 'check', 'apply']
@@ -12,6 +13,9 @@ __all__ = ['wrap', 'check', 'apply']
 class AdHocState(State):
     """
     An ad-hoc state is callable, to mimic the original function definition
+
+    The function may be defined with ``async def``, in which case the state is
+    asynchronous.
     """
     def __init__(self, id):
         self.id = id
@@ -23,6 +27,12 @@ class AdHocState(State):
     def __call__(self):
         return self.wrapped_fn()
 
+    def wrapped_fn(self):
+        return self.fn()
+
+    def is_async(self):
+        return aio.iscoroutinefunction(self.fn)
+
 
 class CheckState(AdHocState):
     """
@@ -58,7 +68,7 @@ def wrap(cls, fn, listen, notify):
         )
 
         new_cls = type(cls_name, (cls,), {})
-        new_cls.wrapped_fn = lambda self: fn()
+        new_cls.fn = staticmethod(fn)
 
         # Instantiate state
         obj = new_cls('{}-{}'.format(fn.__name__, id(new_cls)))
@@ -0,0 +1,70 @@
+"""
+Run state actions on a pool of worker threads
+"""
+from __future__ import unicode_literals
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+from ... import context
+
+
+__all__ = []
+
+
+# Worker threads are flagged so nested calls (eg a state checking its child
+# registry) run serially in the worker rather than starting another pool
+_local = threading.local()
+
+
+def _init_worker():
+    _local.worker = True
+
+
+def _set_worker(flag):
+    """
+    Set whether this thread is a worker, and return the previous value
+    """
+    previous = in_worker()
+    _local.worker = flag
+    return previous
+
+
+def in_worker():
+    """
+    Return True if called from a worker thread
+    """
+    return getattr(_local, 'worker', False)
+
+
+def timed(fn):
+    """
+    Wrap fn so it returns a tuple of (result, seconds taken)
+    """
+    def wrapped(item):
+        start = time.time()
+        result = fn(item)
+        return result, time.time() - start
+    return wrapped
+
+
+def run_parallel(fn, items, workers):
+    """
+    Call fn for each item using up to `workers` threads
+
+    Returns a list of results in the order of items. If any call raises an
+    exception, it is re-raised here.
+
+    If there is only one worker or item, or this is called from a worker
+    thread, the calls are made serially in the current thread. Calls in
+    worker threads see the caller's context - see `sermin.context`.
+    """
+    if workers <= 1 or len(items) <= 1 or in_worker():
+        return [fn(item) for item in items]
+
+    pool = ThreadPool(min(workers, len(items)), initializer=_init_worker)
+    try:
+        return pool.map(context.bind(fn), items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -2,7 +2,17 @@
 State registry
 """
 from __future__ import unicode_literals
+import bisect
+from contextlib import contextmanager
 import itertools
+import time
+import weakref
+
+from ...config import settings
+from ... import aio, cache, profile, report, run
+from ...context import ContextValue
+from .parallel import in_worker, run_parallel, timed
+from .scheduler import build_levels
 
 
 __all__ = []
@@ -33,21 +43,45 @@ class StateRegistry(object):
     manually or using tuples with bisect.insort and zip to de-tuple). Although
     Option 3 sounds like it should be faster, it was 1m slower.
 
-    If this class needs optimising, the best approach may be to add a listener
-    pattern to `extends`, so that `add` can notify interested registries of
-    changes, so they can re-generate their ordered state list.
+    The registry keeps its own states in an index ordered by
+    `creation_counter`, with a parallel list of counters for `bisect`.
+    States are almost always added in creation order, so adding one is
+    normally an append. The full list of states, including those of
+    extended registries, is generated using option 2 and cached until
+    something changes.
+
+    `extend` registers this registry as a listener on the extended registry,
+    so that `add`, `remove` and `clear` can notify interested registries of
+    changes, and they can discard their cached ordered state list.
     '''
     _states = None
+    registries = None
 
     def __init__(self):
+        # Registries which extend this one, notified when it changes. Held
+        # weakly so shared class registries don't keep instances alive.
+        self._listeners = weakref.WeakSet()
         self.clear()
 
     def clear(self):
         if self._states:
             for state in self._states:
                 state.registry = None
+        if self.registries:
+            for registry in self.registries:
+                registry._listeners.discard(self)
         self._states = []
+        self._counters = []
         self.registries = []
+        self._changed()
+
+    def _changed(self):
+        """
+        Discard the cached ordered state list, and notify listeners
+        """
+        self._ordered = None
+        for listener in self._listeners:
+            listener._changed()
 
     def add(self, state):
         """
@@ -55,9 +89,18 @@ class StateRegistry(object):
         """
         if state.registry:
             state.registry.remove(state)
-        self._states.append(state)
-        self._states.sort()
+
+        counter = state.creation_counter
+        if not self._counters or counter > self._counters[-1]:
+            self._states.append(state)
+            self._counters.append(counter)
+        else:
+            index = bisect.bisect_right(self._counters, counter)
+            self._states.insert(index, state)
+            self._counters.insert(index, counter)
+
         state.registry = self
+        self._changed()
 
     def remove(self, state):
         """
@@ -65,24 +108,42 @@ class StateRegistry(object):
         """
         if state.registry != self:
             raise ValueError('Cannot remove this state - not in this registry')
-        self._states.remove(state)
+
+        # Find the state by its counter, then scan in case of duplicates
+        index = bisect.bisect_left(self._counters, state.creation_counter)
+        while self._states[index] is not state:
+            index += 1
+        del self._states[index]
+        del self._counters[index]
+
         state.registry = None
+        self._changed()
 
     def extend(self, registry):
         self.registries.append(registry)
+        registry._listeners.add(self)
+        self._changed()
 
     @property
     def states(self):
         """
         Return a full list of states, in definition order
+
+        The list is cached until this or an extended registry changes, so
+        must not be modified by the caller.
         """
-        return sorted(
-            itertools.chain(
-                self._states,
-                *[registry.states for registry in self.registries]
-            ),
-            key=lambda obj: obj.creation_counter,
-        )
+        if self._ordered is None:
+            if not self.registries:
+                self._ordered = list(self._states)
+            else:
+                self._ordered = sorted(
+                    itertools.chain(
+                        self._states,
+                        *[registry.states for registry in self.registries]
+                    ),
+                    key=lambda obj: obj.creation_counter,
+                )
+        return self._ordered
 
     def __len__(self):
         return len(self.states)
@@ -91,16 +152,62 @@ class StateRegistry(object):
         """
         Check registry states
 
+        If the `parallel` setting is more than 1, the states are checked on a
+        pool of worker threads. Each state still checks its children before
+        itself, but child registries are checked serially within the worker.
+
         Return False if any state fails
         """
-        return all([state.run_check() for state in self.states])
+        states = self.states
+        workers = settings.sermin.parallel
+        if workers <= 1 or len(states) <= 1 or in_worker():
+            return all([state.run_check() for state in states])
+
+        start = time.time()
+        results = run_parallel(
+            timed(lambda state: state.run_check()), states, workers,
+        )
+        elapsed = time.time() - start
+        serial = sum(duration for result, duration in results)
+        report.info(
+            'Checked {count} states in {elapsed:.2f}s using {workers} '
+            'workers, saving {saved:.2f}s',
+            count=len(states),
+            elapsed=elapsed,
+            workers=workers,
+            saved=max(serial - elapsed, 0),
+            label='parallel',
+        )
+        return all([result for result, duration in results])
 
     def apply(self):
         """
         Apply registry states
+
+        If the `parallel` setting is more than 1, a dependency graph of the
+        states is built and split into levels, and the states in each level
+        are applied on a pool of worker threads. This is disabled when asking
+        for confirmation.
         """
-        for state in self.states:
-            state.run_apply()
+        states = self.states
+        workers = settings.sermin.parallel
+        if (
+            workers <= 1 or len(states) <= 1 or in_worker() or
+            settings.sermin.confirm
+        ):
+            for state in states:
+                state.run_apply()
+            return
+
+        levels = build_levels(states)
+        report.info(
+            'Applying {count} states in {levels} levels using {workers} '
+            'workers',
+            count=len(states), levels=len(levels), workers=workers,
+            label='parallel',
+        )
+        for level in levels:
+            run_parallel(lambda state: state.run_apply(), level, workers)
 
     def run(self):
         """
@@ -109,9 +216,134 @@ class StateRegistry(object):
         Although each individual `apply` will perform its `check` before making
         changes, this gives late states the opportunity to throw errors during
         their checks, to block earlier states from making any changes.
+
+        Values cached for the run are kept on a new `sermin.run.Run`.
+        """
+        with run.start():
+            profile.start()
+            self.check()
+            self.apply()
+            cache.save()
+            profile.save()
+        report.flush()
+
+    def acheck(self):
+        """
+        Check registry states on the asyncio event loop
+
+        All states are checked concurrently. Asynchronous states are checked
+        on the loop, and other states are checked in the loop's default
+        executor.
+
+        Returns a future which resolves to False if any state fails
+        """
+        return aio.then(
+            aio.gather([state.arun_check() for state in self.states]),
+            all,
+        )
+
+    def aapply(self):
+        """
+        Apply registry states on the asyncio event loop
+
+        The states are split into levels as for a parallel `apply`, and the
+        states in each level are applied concurrently. When asking for
+        confirmation, the states are applied one at a time.
+
+        Returns a future which resolves once all states have been applied
+        """
+        states = self.states
+        if settings.sermin.confirm:
+            return aio.sequence(states, lambda state: state.arun_apply())
+
+        return aio.sequence(
+            build_levels(states),
+            lambda level: aio.gather([state.arun_apply() for state in level]),
+        )
+
+    def arun(self):
         """
-        self.check()
-        self.apply()
+        Check all states then apply all states on the asyncio event loop
+
+        Must be called while the event loop is running; returns a future to
+        await, eg::
+
+            await registry.arun()
+
+        The new `sermin.run.Run` stays current in the calling context, so
+        callbacks scheduled by the run see it.
+        """
+        run.begin()
+        profile.start()
+
+        def finished(result):
+            cache.save()
+            profile.save()
+            report.flush()
+
+        return aio.then(
+            self.acheck(),
+            lambda result: aio.then(self.aapply(), finished),
+        )
+
+
+class EmptyRegistry(StateRegistry):
+    """
+    A registry which is always empty
+
+    One instance is shared as the children of all states which have none.
+    """
+    def add(self, state):
+        raise ValueError('Cannot add a state to the empty registry')
+
+    def extend(self, registry):
+        raise ValueError('Cannot extend the empty registry')
+
+
+empty_registry = EmptyRegistry()
+
+
+# Registry for the current context, set by `use`
+_current = ContextValue('registry')
+
+
+class RegistryProxy(object):
+    """
+    Proxy to the registry of the current context
+
+    New states are added to the registry set by `use` in the current context,
+    or to the default registry if none has been set. This lets blueprints be
+    loaded and run concurrently in separate threads or asyncio tasks - see
+    `sermin.core.Sermin`.
+    """
+    def __init__(self):
+        self.__dict__['_default'] = StateRegistry()
+
+    def _get(self):
+        current = _current.get()
+        return self._default if current is None else current
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+    def __len__(self):
+        return len(self._get())
+
+
+@contextmanager
+def use(state_registry):
+    """
+    Add new states to the registry in the current context until the block
+    ends
+    """
+    token = _current.set(state_registry)
+    try:
+        yield state_registry
+    finally:
+        _current.reset(token)
 
 
-registry = StateRegistry()
+registry = RegistryProxy()
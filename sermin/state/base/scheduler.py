@@ -0,0 +1,116 @@
+"""
+Dependency graph scheduling for the apply phase
+"""
+from __future__ import unicode_literals
+from collections import defaultdict
+
+
+__all__ = []
+
+
+def get_resources(state):
+    """
+    Return a tuple of (reads, writes) sets of resource keys for a state and
+    all of its children, or None if any of them are unknown
+    """
+    resources = state.get_resources()
+    if resources is None:
+        return None
+    reads, writes = set(resources[0]), set(resources[1])
+
+    for child in state.child_states.states:
+        child_resources = get_resources(child)
+        if child_resources is None:
+            return None
+        reads.update(child_resources[0])
+        writes.update(child_resources[1])
+    return reads, writes
+
+
+def get_owners(states):
+    """
+    Return a dict of {state: set of top-level states} for the states and all
+    their descendants
+
+    Class children are shared by every instance of their parent, so a state
+    can have more than one owner.
+    """
+    owners = defaultdict(set)
+
+    def walk(owner, state):
+        owners[state].add(owner)
+        for child in state.child_states.states:
+            walk(owner, child)
+
+    for state in states:
+        walk(state, state)
+    return owners
+
+
+def build_levels(states):
+    """
+    Build a dependency graph of the states and return it as a list of levels,
+    where each level is a list of states which only depend on states in
+    earlier levels.
+
+    A state depends on an earlier state if:
+
+    * it reads or writes a resource the earlier state writes
+    * it writes a resource the earlier state reads
+    * either state listens to the other (or to one of its children)
+    * either state does not know its resources - it is a barrier, which will
+      be applied after all earlier states and before all later states
+
+    Dependencies only ever point back to earlier states, so states are still
+    applied in definition order when they depend on each other.
+    """
+    # Find which top-level states are linked by listeners
+    owners = get_owners(states)
+    related = defaultdict(set)
+    for state, state_owners in owners.items():
+        for listener in state.listeners:
+            for owner in state_owners:
+                for listener_owner in owners.get(listener, ()):
+                    if listener_owner is owner:
+                        continue
+                    related[owner].add(listener_owner)
+                    related[listener_owner].add(owner)
+
+    levels = {}
+    writers = {}
+    readers = {}
+    barrier = -1
+    deepest = -1
+    for state in states:
+        resources = get_resources(state)
+        if resources is None:
+            level = barrier = deepest + 1
+        else:
+            reads, writes = resources
+            level = barrier + 1
+            for key in reads:
+                level = max(level, writers.get(key, -1) + 1)
+            for key in writes:
+                level = max(
+                    level,
+                    writers.get(key, -1) + 1,
+                    readers.get(key, -1) + 1,
+                )
+
+        for other in related[state]:
+            if other in levels:
+                level = max(level, levels[other] + 1)
+
+        if resources is not None:
+            for key in reads:
+                readers[key] = max(readers.get(key, -1), level)
+            for key in writes:
+                writers[key] = max(writers.get(key, -1), level)
+
+        levels[state] = level
+        deepest = max(deepest, level)
+
+    grouped = [[] for i in range(deepest + 1)]
+    for state in states:
+        grouped[levels[state]].append(state)
+    return grouped
@@ -3,10 +3,17 @@ State registry and base State class
 """
 from __future__ import unicode_literals
 from builtins import input
+import itertools
+import threading
 
+from six import add_metaclass
+
+from ... import aio, profile
 from ...config import settings
+from ... import report
 from ...report import Report
-from .registry import registry, StateRegistry
+from .registry import empty_registry, registry as default_registry
+from .registry import StateRegistry
 
 
 __all__ = ['State']
@@ -27,21 +34,51 @@ class StateType(type):
         Register state class with registry
         """
         super(StateType, self).__init__(name, bases, dct)
+
+        # A registry set on the class is the registry to add instances to;
+        # move it aside so `registry` on an instance is its current registry
+        if 'registry' in dct and not isinstance(dct['registry'], _Registry):
+            if dct['registry'] is not None:
+                self._default_registry = dct['registry']
+            del self.registry
+
         # Don't register abstract state classes
         if 'abstract' in dct and dct['abstract']:
             return
 
-        # Register
-        if not getattr(self, 'registry', None):
-            self.registry = registry
-
         # Move class children to their own registry
-        self._class_children = StateRegistry()
-        for attr in dct.values():
-            if isinstance(attr, State):
+        class_children = [
+            attr for attr in dct.values() if isinstance(attr, State)
+        ]
+        if class_children:
+            self._class_children = StateRegistry()
+            for attr in class_children:
                 self._class_children.add(attr)
+        else:
+            self._class_children = empty_registry
+
+
+class _Registry(object):
+    """
+    Descriptor for `State.registry`
+
+    On an instance it is the registry the instance is registered with. On a
+    class it is the registry new instances will be added to.
+    """
+    def __get__(self, obj, cls):
+        if obj is None:
+            return cls._default_registry
+        return obj._registry
 
+    def __set__(self, obj, value):
+        obj._registry = value
 
+
+# Source of creation counters for State instances
+_counter = itertools.count(1)
+
+
+@add_metaclass(StateType)
 class State(object):
     """
     Base class for state objects
@@ -51,15 +88,18 @@ class State(object):
     * *init* - where the modules are loaded and desired states defined
     * *check* - where the states are checked against the system
     * *apply* - where the states are applied to the system
+
+    Core attributes are held in slots, and the children registry and
+    listener list are only allocated when something is added, so a large
+    blueprint has a small footprint. Subclasses which do not define
+    `__slots__` have an instance `__dict__` as normal.
     """
-    __metaclass__ = StateType
-    abstract = True
+    __slots__ = (
+        'creation_counter', '_registry', '_is', '_lock', '_listeners',
+        '_children', '_report',
+    )
 
-    # Counter allows the State metaclass to detect the order of child states
-    # Class attribute is the value for the next State instance. The __init__
-    # method assigns the current value to the instance attribute, then
-    # increments the class attribute
-    creation_counter = 1
+    abstract = True
 
     # Registry this state is registered with
     #
@@ -69,23 +109,11 @@ class State(object):
     #
     # When accessed on an instance, it refers to the registry that the instance
     # is currently registered with. This may not match the class attribute.
-    registry = None
-
-    # _is indicates this State's current state - it is the value of the last
-    # check() call, either True or False. None means it has not been checked.
-    _is = None
-
-    # Listeners for when this state instance changes from False to True
-    listeners = None
-
-    # Registry of child states to be checked and applied before this state
-    children = None
+    registry = _Registry()
+    _default_registry = default_registry
 
     # Registry of child states on class - merged with `children` on `__init__`
-    _class_children = None
-
-    # Cached Report instance
-    _report = None
+    _class_children = empty_registry
 
     # Confirmation message. Subclasses should override this
     @property
@@ -95,24 +123,68 @@ class State(object):
         )
 
     def __init__(self):
-        # Increment creation counter so we can maintain order
-        self.creation_counter = State.creation_counter
-        State.creation_counter += 1
+        # Creation counter lets registries maintain definition order
+        self.creation_counter = next(_counter)
+
+        # _is indicates this State's current state - it is the value of the
+        # last check() call, either True or False. None means it has not been
+        # checked.
+        self._is = None
+        self._report = None
+
+        # Listeners for when this state instance changes from False to True
+        self._listeners = ()
+
+        # Registry of child states to be checked and applied before this
+        # state; until one is added, this uses the class children
+        self._children = None
+
+        # Guards the check and apply against states shared between parallel
+        # workers, such as class children
+        self._lock = threading.RLock()
 
         # Add to this class's chosen registry
-        # Need to set it to None before registering
-        registry = self.registry
-        self.registry = None
-        registry.add(self)
+        self._registry = None
+        type(self)._default_registry.add(self)
 
-        self.listeners = []
-        self.children = StateRegistry()
-        self.children.extend(self._class_children)
+    @property
+    def children(self):
+        """
+        Registry of child states to be checked and applied before this state
+
+        The registry is allocated the first time this is used; use
+        `child_states` to read the children without allocating it.
+        """
+        if self._children is None:
+            self._children = StateRegistry()
+            if self._class_children is not empty_registry:
+                self._children.extend(self._class_children)
+        return self._children
+
+    @property
+    def child_states(self):
+        """
+        Registry of child states, or the shared empty registry if there are
+        none; must not be modified
+        """
+        if self._children is None:
+            return self._class_children
+        return self._children
+
+    @property
+    def listeners(self):
+        """
+        States listening to this state; use `listen` or `notify` to add one
+        """
+        return self._listeners
 
     @property
     def report(self):
         if not self._report:
-            self._report = Report('{}: {}'.format(type(self).__name__, self))
+            # Label is only generated if something is reported
+            self._report = Report(
+                lambda: '{}: {}'.format(type(self).__name__, self),
+            )
         return self._report
 
     def run_check(self, force=False):
@@ -132,14 +204,41 @@ class State(object):
 
         Child states are checked first.
         """
-        if self._is is not None and not force:
+        with self._lock:
+            if self._is is not None and not force:
+                return self._is
+
+            with profile.measure(self, 'check'):
+                self._is = all([
+                    self.child_states.check(),
+                    aio.resolve(self.check()),
+                ])
             return self._is
 
-        self._is = all([
-            self.children.check(),
-            self.check(),
-        ])
-        return self._is
+    def arun_check(self, force=False):
+        """
+        Check and update the state on the asyncio event loop
+
+        Returns a future for the result of `run_check`.
+
+        If the state is not asynchronous (see `is_async`), `run_check` is
+        called in a worker thread.
+        """
+        if not self.is_async():
+            return aio.to_thread(self.run_check, force)
+
+        if self._is is not None and not force:
+            return aio.done(self._is)
+
+        def checked(children_ok):
+            def update(is_met):
+                self._is = all([children_ok, is_met])
+                return self._is
+            return aio.then(self.check(), update)
+
+        return profile.measure_future(
+            self, 'check', aio.then(self.child_states.acheck(), checked),
+        )
 
     def check(self):
         """
@@ -166,9 +265,19 @@ class State(object):
 
         Child states are applied first.
         """
+        with self._lock:
+            # A state which is already met has nothing to measure
+            if self._is:
+                self._run_apply()
+                return
+
+            with profile.measure(self, 'apply'):
+                self._run_apply()
+
+    def _run_apply(self):
         # Check state, skip if ok
         if self._is is None:
-            self._is = self.check()
+            self._is = aio.resolve(self.check())
 
         # If we're already OK, complete
         if self._is:
@@ -180,8 +289,8 @@ class State(object):
 
         # If we can, apply changes
         if can:
-            self.children.apply()
-            self.apply()
+            self.child_states.apply()
+            aio.resolve(self.apply())
 
         # Stage has changed
         self._is = True
@@ -190,6 +299,67 @@ class State(object):
         self.trigger_changed()
         self.trigger_completed()
 
+    def arun_apply(self):
+        """
+        Check the state, and if it is not met, apply the changes on the
+        asyncio event loop
+
+        Returns a future which resolves once `run_apply` would have returned.
+
+        If the state is not asynchronous (see `is_async`), `run_apply` is
+        called in a worker thread.
+        """
+        if not self.is_async():
+            return aio.to_thread(self.run_apply)
+
+        def applied(result):
+            # Stage has changed
+            self._is = True
+
+            # Trigger any listeners
+            self.trigger_changed()
+            self.trigger_completed()
+
+        def checked(is_met):
+            self._is = is_met
+
+            # If we're already OK, complete
+            if self._is:
+                self.trigger_completed()
+                return
+
+            # If we can, apply changes
+            if not self.can_apply():
+                return applied(None)
+            return aio.then(
+                self.child_states.aapply(),
+                lambda result: aio.then(self.apply(), applied),
+            )
+
+        # Check state, skip if ok. A state which is already met has nothing
+        # to measure.
+        if self._is:
+            return aio.ensure(checked(self._is))
+        if self._is is None:
+            future = aio.then(self.check(), checked)
+        else:
+            future = aio.ensure(checked(self._is))
+        return profile.measure_future(self, 'apply', future)
+
+    def is_async(self):
+        """
+        Return True if this state's check or apply are coroutine functions
+
+        Asynchronous states are run on the asyncio event loop by `arun_check`
+        and `arun_apply`; other states are run in worker threads. Subclasses
+        whose methods return awaitables without being defined with
+        ``async def`` should override this to return True.
+        """
+        return (
+            aio.iscoroutinefunction(self.check) or
+            aio.iscoroutinefunction(self.apply)
+        )
+
     def can_apply(self):
         """
         Can perform the action
@@ -204,6 +374,7 @@ class State(object):
         if not settings.sermin.confirm:
             return True
 
+        report.flush()
         answer = input("{} (Y/n)".format(self.msg_can_apply_confirm)).lower()
         if not answer or answer.startswith('y'):
             return True
@@ -218,13 +389,31 @@ class State(object):
         """
         raise NotImplementedError('Subclasses must implement apply')
 
+    def get_resources(self):
+        """
+        Return the system resources this state uses, so the apply phase can
+        tell which states can be applied in parallel
+
+        Returns a tuple of `(reads, writes)`, where each is a set of hashable
+        keys, eg `('path', '/etc/hosts')`. A state will be applied after any
+        earlier state which writes a resource it reads or writes, or reads a
+        resource it writes.
+
+        Returns None if the resources are not known, in which case the state
+        will be applied after all earlier states and before all later states.
+
+        Resources of child states are added automatically. Subclasses should
+        override this method if they can be applied in parallel.
+        """
+        return None
+
     def listen(self, source):
         """
         Tell this instance to listen for a source State's state change
         """
         if not isinstance(source, State):
             raise ValueError('Cannot listen to a non-state source')
-        source.listeners.append(self)
+        source._add_listener(self)
 
     def notify(self, target):
         """
@@ -232,21 +421,28 @@ class State(object):
         """
         if not isinstance(target, State):
             raise ValueError('Cannot notify a non-state target')
-        self.listeners.append(target)
+        self._add_listener(target)
+
+    def _add_listener(self, listener):
+        if not self._listeners:
+            self._listeners = []
+        self._listeners.append(listener)
 
     def trigger_changed(self):
         """
         Alert listeners to this State that the state has changed
         """
-        for listener in self.listeners:
-            listener.handle_changed(self)
+        for listener in self._listeners:
+            with listener._lock:
+                listener.handle_changed(self)
 
     def trigger_completed(self):
         """
         Alert listeners to this State that the state is complete
         """
-        for listener in self.listeners:
-            listener.handle_completed(self)
+        for listener in self._listeners:
+            with listener._lock:
+                listener.handle_completed(self)
 
     def handle_changed(self, source):
         """
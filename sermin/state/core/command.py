@@ -9,9 +9,20 @@ from ..base import State
 
 @python_2_unicode_compatible
 class Command(State):
-    def __init__(self, command, cwd=None, **kwargs):
+    __slots__ = ('command', 'cwd', 'env')
+
+    def __init__(self, command, cwd=None, env=None, **kwargs):
+        """
+        Define the command
+
+        Arguments:
+            command     The shell command to run
+            cwd         Optional working directory for the command
+            env         Optional dict of environment variables for the command
+        """
         self.command = command
         self.cwd = cwd
+        self.env = env
         super(Command, self).__init__(**kwargs)
 
     def __str__(self):
@@ -23,7 +34,7 @@ class Command(State):
     def apply(self):
         if self.cwd:
             self.report.info('Changing dir and running command')
-            shell(self.command, cd=self.cwd)
+            shell(self.command, cd=self.cwd, env=self.env)
         else:
             self.report.info('Running command')
-            shell(self.command)
+            shell(self.command, env=self.env)
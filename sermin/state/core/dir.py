@@ -4,11 +4,14 @@ Directory management
 from future.utils import python_2_unicode_compatible
 import os
 
+from ... import system
 from ..base import State
 
 
 @python_2_unicode_compatible
 class Dir(State):
+    __slots__ = ('path', 'state')
+
     # States
     EXISTS = 'exist'
     ABSENT = 'absent'
@@ -24,9 +27,14 @@ class Dir(State):
     def __str__(self):
         return self.path
 
+    def get_resources(self):
+        path = os.path.abspath(self.path)
+        return {('path', os.path.dirname(path))}, {('path', path)}
+
     def exists(self):
-        if os.path.exists(self.path):
-            if os.path.isdir(self.path):
+        target = system.get()
+        if target.exists(self.path):
+            if target.isdir(self.path):
                 return True
             else:
                 raise ValueError('Expected directory is not a directory')
@@ -50,8 +58,8 @@ class Dir(State):
         if self.exists():
             if self.state == self.ABSENT:
                 self.report.info('Removing')
-                os.rmdir(self.path)
+                system.get().rmdir(self.path)
         else:
             if self.state == self.EXISTS:
                 self.report.info('Creating')
-                os.makedirs(self.path)
+                system.get().makedirs(self.path)
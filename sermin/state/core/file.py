@@ -2,16 +2,16 @@
 File management
 """
 from builtins import str
-import io
+import hashlib
 import os
-from shutil import copyfile
 
 import configparser
 from future.utils import python_2_unicode_compatible
-from jinja2 import Template
 from six import string_types, StringIO
 
+from ...cache import Store
 from ...constants import Undefined
+from ... import system, templates
 from ..base import State
 
 
@@ -190,15 +190,31 @@ class IniParser(FileParser):
         return file.getvalue()
 
 
+def stat_key(path):
+    """
+    Return a list of the metadata used to detect changes to a file
+    """
+    return system.get().stat(path)
+
+
 @python_2_unicode_compatible
 class File(State):
     """
     Create or modify a file
     """
+    __slots__ = (
+        'path', 'state', 'content', 'source', 'parser', 'set', 'delete',
+        'context', 'state_exists', '_rendered',
+    )
+
     # States
     EXISTS = 'exist'
     ABSENT = 'absent'
 
+    # Digests of files at the end of the last check or apply, by path:
+    #   {path: {'input': .., 'stat': [size, mtime, inode], 'digest': ..}}
+    digests = Store('file-digests')
+
     def __init__(
         self, path, state=EXISTS, content=None, source=None,
         parser=None, set=None, delete=None, context=None,
@@ -268,6 +284,10 @@ class File(State):
         self.set = set
         self.delete = delete
         self.context = context
+        self.state_exists = None
+
+        # Tuple of (raw, rendered) from the last call to render()
+        self._rendered = None
 
         # TODO: Accept relative source path
         # TODO: Ownership
@@ -276,16 +296,79 @@ class File(State):
     def __str__(self):
         return self.path
 
+    def get_resources(self):
+        path = os.path.abspath(self.path)
+        reads = {('path', os.path.dirname(path))}
+        if self.source:
+            reads.add(('path', os.path.abspath(self.source)))
+        return reads, {('path', path)}
+
     def read(self, path):
-        with io.open(path, 'r', encoding='utf-8') as file:
-            content = file.read()
-        return content
+        return system.get().read(path).decode('utf-8')
+
+    def get_input_key(self):
+        """
+        Return a digest of the arguments which define the desired content
+
+        If a source file is used, its metadata is included, so changes to it
+        will change the key.
+        """
+        def normalise(value):
+            if isinstance(value, dict):
+                return sorted(value.items())
+            return value
+
+        parts = [
+            self.state,
+            self.content,
+            self.parser and '{}.{}'.format(
+                self.parser.__module__, self.parser.__name__,
+            ),
+            normalise(self.set),
+            normalise(self.delete),
+            normalise(self.context),
+        ]
+        if self.source:
+            parts.append([os.path.abspath(self.source), stat_key(self.source)])
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def is_unchanged(self):
+        """
+        Return True if the file and this definition are unchanged since the
+        file last matched this definition, using the recorded digest
+
+        If the file's metadata is unchanged this only needs a `stat`; if it
+        has changed, the file's content is hashed and compared.
+        """
+        record = self.digests.get(os.path.abspath(self.path))
+        if not record or record['input'] != self.get_input_key():
+            return False
+
+        stat = stat_key(self.path)
+        if stat == record['stat']:
+            return True
+
+        if system.get().hash(self.path) == record['digest']:
+            record['stat'] = stat
+            self.digests.set(os.path.abspath(self.path), record)
+            return True
+        return False
+
+    def remember(self):
+        """
+        Record the digest of the file, now it matches this definition
+        """
+        self.digests.set(os.path.abspath(self.path), {
+            'input': self.get_input_key(),
+            'stat': stat_key(self.path),
+            'digest': system.get().hash(self.path),
+        })
 
     def check(self):
         """
         Check fails if either the file doesn't exist, or it needs to be changed
         """
-        self.state_exists = os.path.exists(self.path)
+        self.state_exists = system.get().exists(self.path)
 
         # Trying to remove the file is simple - if it exists we need to change,
         # otherwise no change needed
@@ -301,6 +384,11 @@ class File(State):
             self.report.debug('Does not exist')
             return False
 
+        # Skip reading and rendering if nothing has changed since last time
+        if self.is_unchanged():
+            self.report.debug('Unchanged since last run')
+            return True
+
         # Find the current content of the file
         original = self.read(self.path)
 
@@ -326,32 +414,43 @@ class File(State):
                 self.report.debug('Requires rendering')
                 return False
 
+        self.remember()
         return True
 
     def apply(self):
+        target = system.get()
+
         # See if we need to remove the file
         if self.state == self.ABSENT:
             if self.state_exists:
                 self.report.info('Removing file')
-                os.remove(self.path)
+                target.remove(self.path)
             return
 
-        # Copy the file, or ensure it exists
-        if self.source:
-            self.report.info('Copying from {}'.format(self.source))
-            copyfile(self.source, self.path)
-        elif not self.state_exists:
-            self.report.info('Creating empty file')
-            open(self.path, 'a').close()
+        # Another state may have changed the file since the check
+        exists = target.exists(self.path)
 
-        # Can finish now if there are no changes to make
+        # Copy the file, or ensure it exists, if there are no changes to make
         if (
             self.content is None and
             not self.set and
             not self.delete and
             self.context is None
         ):
-            self.report.info('No content write required')
+            if self.source:
+                if exists and (
+                    target.hash(self.source) == target.hash(self.path)
+                ):
+                    self.report.info('Already matches {}', self.source)
+                else:
+                    self.report.info('Copying from {}', self.source)
+                    target.copy(self.source, self.path)
+            elif not exists:
+                self.report.info('Creating empty file')
+                target.write(self.path, b'')
+            else:
+                self.report.info('No content write required')
+            self.remember()
             return
 
         # Find the content
@@ -359,8 +458,10 @@ class File(State):
             content = self.content
         elif self.source:
             content = self.read(self.source)
-        else:
+        elif exists:
             content = self.read(self.path)
+        else:
+            content = str('')
 
         # Apply changes
         if self.set or self.delete:
@@ -371,11 +472,23 @@ class File(State):
         if self.context:
             content = self.render(content)
 
-        # Write content
-        self.report.info('Writing content')
-        with io.open(self.path, 'w') as file:
-            file.write(str(content))
+        # Write content, unless the file already has it
+        data = str(content).encode('utf-8')
+        if exists and (
+            hashlib.sha1(data).hexdigest() == target.hash(self.path)
+        ):
+            self.report.info('Content already matches')
+        else:
+            self.report.info('Writing content')
+            target.write(self.path, data)
+        self.remember()
 
     def render(self, raw):
-        template = Template(raw)
-        return template.render(**self.context)
+        """
+        Render the raw content as a template using the context
+
+        The last result is kept, so the apply can reuse the check's render.
+        """
+        if self._rendered is None or self._rendered[0] != raw:
+            self._rendered = (raw, templates.render(raw, self.context))
+        return self._rendered[1]
@@ -3,14 +3,161 @@ Execute command
 """
 from collections import defaultdict
 from future.utils import python_2_unicode_compatible
+import hashlib
 import os
 import re
+import threading
+import time
+import zlib
 
+from ... import report, run, system
+from ...config import settings
+from ...exceptions import ShellError
 from ...utils import shell
 from ..base import State
 from .dir import Dir
 
 
+# Number of symbolic refs or tag objects to follow before giving up
+MAX_DEPTH = 10
+
+# Fetch policies
+FETCH_ALWAYS = 'always'
+FETCH_NEEDED = 'needed'
+
+CONFIG_SECTION = re.compile(r'^\[\s*([^\s"\]]+)(?:\s+"(.*)")?\s*\]')
+
+
+def parse_config(content):
+    """
+    Parse a git config file into a dict of
+    `{(section, subsection): {key: value}}`
+
+    Section and key names are lowercase. Only the last value of a key is
+    kept, and includes are not followed.
+    """
+    config = defaultdict(dict)
+    section = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        match = CONFIG_SECTION.match(line)
+        if match:
+            section = (match.group(1).lower(), match.group(2))
+            continue
+        if section is None:
+            continue
+        key, _, value = line.partition('=')
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        config[section][key.strip().lower()] = value
+    return config
+
+
+def parse_fetch_policy(policy):
+    """
+    Return a fetch policy - `always`, `needed` or a number of seconds
+
+    Raises a ValueError if the policy is not valid
+    """
+    if policy in (FETCH_ALWAYS, FETCH_NEEDED):
+        return policy
+    if str(policy).isdigit():
+        return int(policy)
+    raise ValueError(
+        'Git fetch policy must be {}, {} or a number of seconds, not {}'
+        .format(FETCH_ALWAYS, FETCH_NEEDED, policy)
+    )
+
+
+class Mirrors(object):
+    """
+    Bare mirrors of remote repositories, which new clones copy objects from
+
+    Mirrors are kept in the dir in the `git_mirrors` setting, named by a hash
+    of their remote URL. Each mirror is cloned or updated at most once per
+    run, however many Git states use its remote.
+
+    Clones are made with `--dissociate`, so they copy any objects they take
+    from the mirror and don't depend on it once cloned.
+    """
+    def __init__(self):
+        # {path: (run id, path or None)} of the last run to update each
+        # mirror, and the result
+        self.updated = {}
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def get_path(self, remote):
+        """
+        Return the path of the mirror for the remote, or None if mirrors are
+        disabled
+        """
+        root = settings.sermin.git_mirrors
+        if not root:
+            return None
+        return os.path.join(
+            os.path.expanduser(root),
+            '{}.git'.format(hashlib.sha1(remote.encode('utf-8')).hexdigest()),
+        )
+
+    def update(self, remote):
+        """
+        Clone or update the mirror of the remote if it hasn't been during
+        this run, and return its path; or None if mirrors are disabled, or
+        the mirror could not be cloned or updated
+        """
+        path = self.get_path(remote)
+        if path is None:
+            return None
+
+        # Hold a lock for each mirror, so states cloning the same remote in
+        # parallel wait for one update. Mirrors are shared on disk, so runs
+        # of separate instances wait for each other too.
+        with self._lock:
+            lock = self._locks.setdefault(path, threading.Lock())
+
+        run_id = run.current().id
+        with lock:
+            updated = self.updated.get(path)
+            if updated and updated[0] == run_id:
+                return updated[1]
+
+            try:
+                self.fetch(remote, path)
+            except ShellError as e:
+                report.warning(
+                    'Could not update mirror of {}, cloning directly: {}',
+                    remote, e, label='git',
+                )
+                self.updated[path] = (run_id, None)
+                return None
+
+            self.updated[path] = (run_id, path)
+        return path
+
+    def fetch(self, remote, path):
+        """
+        Clone the mirror of the remote, or update it if it exists
+        """
+        target = system.get()
+        if target.isdir(path):
+            shell(
+                ['git', 'remote', 'update', '--prune'], cd=path, stream=True,
+            )
+            return
+
+        if not target.isdir(os.path.dirname(path)):
+            target.makedirs(os.path.dirname(path))
+        shell(['git', 'clone', '--mirror', remote, path], stream=True)
+
+
+# Shared by all Git states
+mirrors = Mirrors()
+
+
 class Repository(object):
     """
     Class to manage a git repository for the Git state
@@ -21,8 +168,12 @@ class Repository(object):
         tags        List    The names of all tags
         changed     Bool    Whether or not the working directory has
                             uncommitted changes
+
+    Refs and remotes are read from the files in the `.git` dir, so checking a
+    repository doesn't run git. If a ref can't be resolved from the files,
+    for example because its tag object is packed, the git command is used.
     """
-    path = None
+    __slots__ = ('path', 'remote')
 
     def __init__(self, path, remote):
         self.path = os.path.normpath(path)
@@ -31,19 +182,132 @@ class Repository(object):
     def __str__(self):
         return self.path
 
-    def git(self, cmd):
-        return shell('git {cmd}'.format(cmd=cmd), cd=self.path)
+    def git(self, cmd, stream=False):
+        return shell('git {cmd}'.format(cmd=cmd), cd=self.path, stream=stream)
+
+    def read_git_file(self, *parts):
+        """
+        Return the content of a file in the `.git` dir as bytes, or None if
+        it doesn't exist
+        """
+        try:
+            return system.get().read(os.path.join(self.path, '.git', *parts))
+        except (IOError, OSError):
+            return None
+
+    def read_packed_refs(self):
+        """
+        Return a tuple of dicts `({ref: object}, {ref: peeled commit})` from
+        the `packed-refs` file
+
+        Peeled commits are only listed if git recorded them in the file - it
+        marks which refs it has peeled in the header.
+        """
+        refs = {}
+        peeled = {}
+        content = self.read_git_file('packed-refs')
+        if content is None:
+            return refs, peeled
+
+        traits = []
+        ref = None
+        for line in content.decode('utf-8').splitlines():
+            if line.startswith('# pack-refs with:'):
+                traits = line.split(':', 1)[1].split()
+                continue
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('^'):
+                if ref:
+                    peeled[ref] = line[1:].strip()
+                continue
+            sha, ref = line.split(' ', 1)
+            refs[ref] = sha
+
+        # Peeled refs without a peeled line are not annotated tags
+        for ref, sha in refs.items():
+            if 'fully-peeled' in traits or (
+                'peeled' in traits and ref.startswith('refs/tags/')
+            ):
+                peeled.setdefault(ref, sha)
+        return refs, peeled
+
+    def resolve_ref(self, ref):
+        """
+        Return the object name of a ref, such as `HEAD` or `refs/heads/master`,
+        following symbolic refs; or None if it can't be resolved
+
+        Loose refs in `.git/refs` take precedence over `packed-refs`.
+        """
+        for depth in range(MAX_DEPTH):
+            content = self.read_git_file(*ref.split('/'))
+            if content is None:
+                return self.read_packed_refs()[0].get(ref)
+
+            content = content.decode('utf-8').strip()
+            if not content.startswith('ref:'):
+                return content or None
+            ref = content[4:].strip()
+        return None
+
+    def read_object(self, sha):
+        """
+        Return a tuple of `(type, body)` for a loose object, or None if it is
+        not a loose object
+        """
+        content = self.read_git_file('objects', sha[:2], sha[2:])
+        if content is None:
+            return None
+        header, _, body = zlib.decompress(content).partition(b'\0')
+        return header.split(b' ')[0].decode('utf-8'), body
+
+    def peel(self, sha):
+        """
+        Return the commit which an object points to, dereferencing annotated
+        tags; or None if it can't be found without git
+        """
+        for depth in range(MAX_DEPTH):
+            obj = self.read_object(sha)
+            if obj is None:
+                return None
+            kind, body = obj
+            if kind != 'tag':
+                return sha
+            # The first line of a tag object is "object <sha>"
+            sha = body.split(b'\n', 1)[0].split(b' ')[1].decode('utf-8')
+        return None
+
+    def resolve_commit(self, ref):
+        """
+        Return the commit of the ref, or use git to find it if it can't be
+        resolved from the files
+        """
+        sha = self.resolve_ref(ref)
+        if sha:
+            return sha
+        return self.git('rev-parse --verify {ref}'.format(ref=ref))
 
     def clone(self):
         """
         Clone the specified repository
+
+        If mirrors are enabled, the clone takes objects from the mirror of
+        the remote, so only objects which are not in the mirror are
+        downloaded. The clone is dissociated from the mirror, so it doesn't
+        depend on it afterwards.
         """
+        mirror = mirrors.update(self.remote)
         response = shell(
-            'git clone {remote} {dir}'.format(
+            'git clone {reference}{remote} {dir}'.format(
+                reference=(
+                    '--reference {} --dissociate '.format(mirror)
+                    if mirror else ''
+                ),
                 remote=self.remote,
                 dir=os.path.basename(self.path),
             ),
             cd=os.path.dirname(self.path),
+            stream=True,
         )
         if 'done.' not in response:
             raise ValueError('Unexpected response from git clone: {}'.format(
@@ -74,8 +338,25 @@ class Repository(object):
         """
         Ensure the repository is using the specified remote as origin and fetch
         """
-        self.git('remote set-url origin {remote}'.format(remote=self.remote))
-        return self.git('fetch --tags origin'.format(remote=self.remote))
+        if self.remotes.get('origin', {}).get('fetch') != self.remote:
+            self.git('remote set-url origin {remote}'.format(
+                remote=self.remote,
+            ))
+        return self.git(
+            'fetch --tags origin'.format(remote=self.remote), stream=True,
+        )
+
+    def last_fetched(self):
+        """
+        Return the time of the last fetch, from the mtime of `FETCH_HEAD`, or
+        None if the repository has not been fetched since it was cloned
+        """
+        try:
+            return system.get().stat(
+                os.path.join(self.path, '.git', 'FETCH_HEAD'),
+            )[1]
+        except (IOError, OSError):
+            return None
 
     def pull(self):
         """
@@ -106,54 +387,66 @@ class Repository(object):
         """
         Return the current commit that the repo is on
         """
-        return self.git('rev-parse --verify HEAD')
+        return self.resolve_commit('HEAD')
 
     def branch_head(self, branch):
         """
         Return the current commit of the specified local branch
         """
-        return self.git(
-            'show-ref --hash --verify refs/heads/{branch}'.format(
-                branch=branch
-            )
-        )
+        return self.resolve_commit('refs/heads/{branch}'.format(
+            branch=branch,
+        ))
 
     def origin_branch_head(self, branch):
         """
         Return the current commit of the specified branch on remote origin
         """
-        return self.git(
-            'show-ref --hash --verify refs/remotes/origin/{branch}'.format(
-                branch=branch
-            )
-        )
+        return self.resolve_commit('refs/remotes/origin/{branch}'.format(
+            branch=branch,
+        ))
 
     def tag_commit(self, tag):
         """
         Return the commit of the specified tag (dereferenced if it's annotated)
         """
-        return self.git('rev-list -1 refs/tags/{tag}'.format(tag=tag))
+        ref = 'refs/tags/{tag}'.format(tag=tag)
+        sha = self.resolve_ref(ref)
+        if sha:
+            packed, peeled = self.read_packed_refs()
+            if packed.get(ref) == sha and ref in peeled:
+                return peeled[ref]
+            commit = self.peel(sha)
+            if commit:
+                return commit
+        return self.git('rev-list -1 {ref}'.format(ref=ref))
 
     @property
     def remotes(self):
         """
         Return dict of remotes as {fetch: .., push:.. } dicts
         """
-        raw_remotes = self.git('remote --verbose')
+        content = self.read_git_file('config')
+        config = parse_config(content.decode('utf-8') if content else '')
         remotes = defaultdict(dict)
-        for raw_remote in raw_remotes.splitlines():
-            name, rest = raw_remote.split('\t', 1)
-            remote, action = rest.rsplit(' ', 1)
-            action = action[1:-1]
-            remotes[name][action] = remote
+        for (section, name), values in config.items():
+            if section != 'remote' or 'url' not in values:
+                continue
+            remotes[name]['fetch'] = values['url']
+            remotes[name]['push'] = values.get('pushurl', values['url'])
         return remotes
 
     @property
     def current_branch(self):
         """
-        Current branch
+        Current branch, or an empty string if HEAD is detached
         """
-        return self.status['branch']
+        content = self.read_git_file('HEAD')
+        if content is None:
+            return self.status['branch']
+        content = content.decode('utf-8').strip()
+        if content.startswith('ref: refs/heads/'):
+            return content[len('ref: refs/heads/'):]
+        return ''
 
     @property
     def branches(self):
@@ -174,7 +467,7 @@ class Repository(object):
         """
         Return a list of tags from `git tag --list`
         """
-        raw_tags = self.git('tags --list')
+        raw_tags = self.git('tag --list')
         tags = raw_tags.splitlines()
         return tags
 
@@ -187,10 +480,13 @@ class Repository(object):
 
 @python_2_unicode_compatible
 class Git(State):
+    __slots__ = ('path', 'remote', 'commit', 'tag', 'branch', 'fetch', 'repo')
+
     default_branch = 'master'
 
     def __init__(
-        self, path, remote=None, commit=None, tag=None, branch=None, **kwargs
+        self, path, remote=None, commit=None, tag=None, branch=None,
+        fetch=None, **kwargs
     ):
         """
         Arguments
@@ -199,6 +495,14 @@ class Git(State):
             commit      The commit this repository should be on
             tag         The tag this repository should be on
             branch      The branch this repository should be at the HEAD of
+            fetch       When to fetch from the remote during the check:
+                            always      Every check
+                            needed      Only when the commit or tag is not
+                                        already in the repository; branches
+                                        are always fetched
+                            <seconds>   As needed, and fetch branches if the
+                                        last fetch was this long ago
+                        Default: the `git_fetch` setting
 
         Only specify one of commit, tag or branch.
         If none are specified, defaults to branch=self.default_branch
@@ -214,6 +518,7 @@ class Git(State):
         self.commit = commit
         self.tag = tag
         self.branch = branch
+        self.fetch = None if fetch is None else parse_fetch_policy(fetch)
         super(Git, self).__init__(**kwargs)
 
         self.repo = Repository(self.path, self.remote)
@@ -226,15 +531,20 @@ class Git(State):
     def __str__(self):
         return self.path
 
+    def get_resources(self):
+        path = os.path.abspath(self.path)
+        return {('path', os.path.dirname(path))}, {('path', path)}
+
     def check(self):
         # Path exists as a repo?
-        if not os.path.exists(self.path):
+        target = system.get()
+        if not target.exists(self.path):
             self.report.debug('Path does not exist')
             return False
 
         if (
-            not os.path.isdir(self.path) or
-            not os.path.isdir(os.path.join(self.path, '.git'))
+            not target.isdir(self.path) or
+            not target.isdir(os.path.join(self.path, '.git'))
         ):
             raise ValueError('Git path exists but is not a git repository')
 
@@ -248,9 +558,12 @@ class Git(State):
             return False
 
         # Repo is at revision/head?
-        self.report.info('Fetching remote')
-        self.repo.fetch()
         current_commit = self.repo.current_commit
+        if self.needs_fetch(current_commit):
+            self.report.info('Fetching remote')
+            self.repo.fetch()
+        else:
+            self.report.debug('Not fetching remote')
         if (
             self.commit and
             current_commit != self.commit
@@ -280,20 +593,45 @@ class Git(State):
         self.report.debug('Repository in expected state')
         return True
 
+    def needs_fetch(self, current_commit):
+        """
+        Return True if the check should fetch from the remote, according to
+        the fetch policy
+        """
+        policy = self.fetch
+        if policy is None:
+            policy = parse_fetch_policy(settings.sermin.git_fetch)
+        if policy == FETCH_ALWAYS:
+            return True
+
+        # Pinned commits and tags can be checked offline if present
+        if self.commit:
+            return current_commit != self.commit
+        if self.tag:
+            return self.repo.resolve_ref(
+                'refs/tags/{tag}'.format(tag=self.tag),
+            ) is None
+
+        # The branch may have changed on the remote
+        if policy == FETCH_NEEDED:
+            return True
+        last_fetched = self.repo.last_fetched()
+        return last_fetched is None or time.time() - last_fetched >= policy
+
     def apply(self):
         # If path does not exist, clone from remote
-        if not os.path.isdir(self.path):
+        if not system.get().isdir(self.path):
             self.report.info('Cloning')
             self.repo.clone()
-        # Otherwise self.check() has already `fetch`ed from remote
+        # Otherwise self.check() has already `fetch`ed from remote if needed
 
         # Check out revision/head
         if self.commit:
-            self.report.info('Checking out commit {}'.format(self.commit))
+            self.report.info('Checking out commit {}', self.commit)
         elif self.tag:
-            self.report.info('Checking out tag {}'.format(self.tag))
+            self.report.info('Checking out tag {}', self.tag)
         elif self.branch:
-            self.report.info('Checking out branch {}'.format(self.branch))
+            self.report.info('Checking out branch {}', self.branch)
 
         self.repo.checkout(
             commit=self.commit,
@@ -3,8 +3,57 @@ User group management
 """
 from future.utils import python_2_unicode_compatible
 
+from ... import system
+from ...facts import Fact
 from ...utils import shell
 from ..base import State
+from . import identity
+
+
+class GroupDatabase(Fact):
+    """
+    Fact of groups, parsed from the group database
+
+    The value is a dict of {name: [gid, [member, ...]]}
+
+    It is shared with the User state, and is checked for changes once per
+    run; states which change users or groups must call `invalidate()`.
+    """
+    name = 'group'
+    paths = ('/etc/group',)
+    per_run = True
+
+    def compute(self):
+        groups = {}
+        try:
+            file = self.open(self.paths[0])
+        except IOError:
+            return groups
+
+        with file:
+            for line in file:
+                parts = line.rstrip('\n').split(':')
+                if len(parts) != 4 or not parts[2].isdigit():
+                    # Comment, NIS entry or invalid
+                    continue
+                name, password, gid, members = parts
+                groups[name] = [
+                    int(gid),
+                    [member for member in members.split(',') if member],
+                ]
+        return groups
+
+    def get_gid(self, name):
+        """
+        Return the gid of the named group, or None if it does not exist
+
+        Groups which are not in the file, eg from LDAP, are looked up using
+        the system's name service, and remembered until the file changes.
+        """
+        group = self.get().get(name)
+        if group:
+            return group[0]
+        return self.lookup(name, system.get().getgrnam)
 
 
 @python_2_unicode_compatible
@@ -12,6 +61,11 @@ class Group(State):
     """
     Group state
     """
+    __slots__ = ('name', 'state', 'gid')
+
+    # Group database shared by all instances
+    database = GroupDatabase()
+
     # States
     EXISTS = 'exist'
     ABSENT = 'absent'
@@ -28,23 +82,32 @@ class Group(State):
             gid=self.gid or self.get_gid() or '-',
         )
 
+    @property
+    def batch(self):
+        """
+        Pending changes for the batch setting, shared with User states in the
+        current run
+        """
+        return identity.get_batch()
+
+    def get_resources(self):
+        # Changes to users and groups lock the same system databases
+        return set(), {('identity',)}
+
     def get_gid(self):
-        ent = shell('getent group {}'.format(self.name), expect_errors=True)
-        if not ent:
-            return None
-        return int(ent.split(':')[-2])
+        return self.database.get_gid(self.name)
 
     def check(self):
         self.report.debug('checking')
         gid = self.get_gid()
-        self.report.debug('gid {}'.format(gid))
+        self.report.debug('gid {}', gid)
         if gid:
             if self.state == self.EXISTS:
                 self.report.debug('Already exists')
                 if self.gid and self.gid != gid:
                     raise ValueError('Group gid does not match system')
                 return True
-            return False
+            return self.needs_change()
         else:
             if self.state == self.ABSENT:
                 self.report.debug('Does not exist')
@@ -53,14 +116,45 @@ class Group(State):
 
             # TODO: Check that the group is empty - can't delete without
 
-            return False
+            return self.needs_change()
+
+    def needs_change(self):
+        """
+        Add the group to the batch if changes are batched, and return False
+        """
+        if identity.use_batch():
+            self.batch.add(self)
+        return False
+
+    def invalidate(self):
+        """
+        Forget the groups read this run, after changing them
+        """
+        self.database.invalidate()
+
+    def get_batch_change(self):
+        """
+        Return the change to make in a batch - see `IdentityBatch`
+        """
+        if self.state == self.ABSENT:
+            return 'remove_groups', ('group', self.name), self.name
+        return 'add_groups', ('group', self.name), (self.name, self.gid)
 
     def apply(self):
+        if identity.use_batch():
+            self.batch.apply_state(self)
+            if self.state == self.ABSENT:
+                self.report.info('Removed')
+            else:
+                self.report.info('Created')
+            return
+
         gid = self.get_gid()
         if gid:
             if self.state == self.ABSENT:
                 self.report.info('Removing')
                 shell(['delgroup', self.name])
+                self.invalidate()
         else:
             if self.state == self.EXISTS:
                 self.report.info('Creating')
@@ -69,3 +163,4 @@ class Group(State):
                     cmd.extend(['--gid', self.gid])
                 cmd.append(self.name)
                 shell(cmd)
+                self.invalidate()
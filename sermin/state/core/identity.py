@@ -0,0 +1,102 @@
+"""
+Batched changes to users and groups
+"""
+import threading
+
+from ... import run, system
+from ...config import settings
+from ...exceptions import RunError
+
+
+def use_batch():
+    """
+    Batch changes unless each change needs confirmation
+    """
+    return settings.sermin.batch and not settings.sermin.confirm
+
+
+class IdentityBatch(object):
+    """
+    Collect User and Group states which need changes during a run, so they
+    can be applied in one locked edit of the user and group databases
+
+    States provide their change with `get_batch_change()`, which returns a
+    tuple of `(argument, key, value)`: the argument of
+    `System.update_identities` to add the value to, and the key of any error
+    it returns for this state.
+
+    One batch is kept for each run - see `get_batch`.
+    """
+    def __init__(self):
+        self.pending = []
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, state):
+        """
+        Add a state which needs to be changed in this run
+        """
+        with self._lock:
+            if state not in self.pending:
+                self.pending.append(state)
+
+    def is_applied(self, state):
+        """
+        Return True if the state has been applied in a batch in this run
+        """
+        with self._lock:
+            return state in self.errors
+
+    def apply(self):
+        """
+        Apply all pending changes, and record the result for each state
+        """
+        with self._lock:
+            pending = self.pending
+            self.pending = []
+
+        # Get each change once, as it may differ each time, eg by the salt
+        # of an encrypted password
+        batch_changes = [state.get_batch_change() for state in pending]
+        changes = {
+            'add_groups': [],
+            'add_users': [],
+            'remove_users': [],
+            'remove_groups': [],
+        }
+        for argument, key, value in batch_changes:
+            changes[argument].append(value)
+
+        errors = system.get().update_identities(**changes)
+
+        with self._lock:
+            for state, (argument, key, value) in zip(pending, batch_changes):
+                self.errors[state] = errors.get(key)
+        for state in pending:
+            state.invalidate()
+
+    def apply_state(self, state):
+        """
+        Apply the state, along with all pending changes if it has not been
+        applied yet
+
+        Raises a RunError if the state's change could not be made
+        """
+        if not self.is_applied(state):
+            state.report.info('Applying pending user and group changes')
+            self.add(state)
+            self.apply()
+
+        with self._lock:
+            error = self.errors.get(state)
+        if error:
+            raise RunError('{} {}: {}'.format(
+                type(state).__name__, state.name, error,
+            ))
+
+
+def get_batch():
+    """
+    Return the batch shared by all User and Group states in the current run
+    """
+    return run.current().get(IdentityBatch, IdentityBatch)
@@ -2,14 +2,145 @@
 Packages management
 """
 from future.utils import python_2_unicode_compatible
+import itertools
+import threading
 
-from ...utils import shell, ShellError
+from ... import run
+from ...config import settings
+from ...exceptions import RunError
+from ...facts import Fact
+from ...utils import shell
 from ..base import State
 
 
+class DpkgStatus(Fact):
+    """
+    Fact of installed packages, parsed from the dpkg status database
+
+    One instance is shared by all Package states, so the database is read once
+    rather than running `dpkg -s` for each package. The database is read again
+    if it changes, eg after a package is installed or removed.
+    """
+    name = 'dpkg'
+    paths = ('/var/lib/dpkg/status',)
+
+    # Fields used from each package stanza
+    fields = ('Package', 'Architecture', 'Status')
+
+    def get_fingerprint(self):
+        fingerprint = super(DpkgStatus, self).get_fingerprint()
+        if fingerprint[0] is None:
+            raise RunError(
+                'Cannot read dpkg status from {}'.format(self.paths[0]),
+            )
+        return fingerprint
+
+    def compute(self):
+        return self.parse(self.paths[0])
+
+    def encode(self, value):
+        return sorted(value)
+
+    def decode(self, value):
+        return set(value)
+
+    def parse(self, path):
+        """
+        Return a set of installed package names
+
+        Packages are listed by name and by name:architecture
+        """
+        installed = set()
+        fields = {}
+        with self.open(path) as file:
+            # Stanzas are separated by blank lines; ensure the last one ends
+            for line in itertools.chain(file, ['\n']):
+                if not line.strip():
+                    if fields.get('Status', '').endswith(' installed'):
+                        installed.add(fields['Package'])
+                        if 'Architecture' in fields:
+                            installed.add('{Package}:{Architecture}'.format(
+                                **fields
+                            ))
+                    fields = {}
+                elif not line[0].isspace() and ':' in line:
+                    key, value = line.split(':', 1)
+                    if key in self.fields:
+                        fields[key] = value.strip()
+        return installed
+
+    @property
+    def installed(self):
+        return self.get()
+
+    def is_installed(self, name):
+        return name in self.get()
+
+
+class AptBatch(object):
+    """
+    Collect Package states which need changes during a run, so they can be
+    applied in one `apt-get install` and one `apt-get remove` transaction
+
+    One batch is kept for each run - see `Package.batch`.
+    """
+    def __init__(self):
+        self.pending = []
+        self.applied = []
+        self._lock = threading.Lock()
+
+    def add(self, package):
+        """
+        Add a package which needs to be changed in this run
+        """
+        with self._lock:
+            if package not in self.pending:
+                self.pending.append(package)
+
+    def is_applied(self, package):
+        """
+        Return True if the package has been applied in a batch in this run
+        """
+        with self._lock:
+            return package in self.applied
+
+    def apply(self):
+        """
+        Install and remove all pending packages, and update their states
+        """
+        with self._lock:
+            pending = [
+                package for package in self.pending
+                if package.is_installed != package.want_installed
+            ]
+            self.pending = []
+            self.applied.extend(pending)
+
+        install = [package for package in pending if package.want_installed]
+        remove = [package for package in pending if not package.want_installed]
+        if install:
+            shell(
+                ['apt-get', 'install', '--yes'] +
+                [package.name for package in install],
+                stream=True,
+            )
+        if remove:
+            shell(
+                ['apt-get', 'remove', '--purge', '--yes'] +
+                [package.name for package in remove],
+                stream=True,
+            )
+
+        for package in pending:
+            package.is_installed = package.dpkg.is_installed(package.name)
+
+
 @python_2_unicode_compatible
 class Package(State):
-    apt_updated = False
+    __slots__ = ('name', 'state', 'want_installed', 'is_installed')
+
+    # Installed package snapshot shared by all instances
+    dpkg = DpkgStatus()
 
     # States
     INSTALLED = 'installed'
@@ -32,20 +163,23 @@ class Package(State):
         self.name = name
         self.state = state
         self.want_installed = (self.state == self.INSTALLED)
+        self.is_installed = None
         super(Package, self).__init__(**kwargs)
 
     def __str__(self):
         return self.name
 
+    @property
+    def batch(self):
+        """
+        Pending changes for the batch setting, shared by all instances in
+        the current run
+        """
+        return run.current().get(AptBatch, AptBatch)
+
     def check(self):
         # Find it it's installed
-        output = shell('dpkg -s {}'.format(self.name), expect_errors=True)
-        if 'Status: install ok installed' in output:
-            self.is_installed = True
-        elif "package '{}' is not installed".format(self.name) in output:
-            self.is_installed = False
-        else:
-            raise ShellError('Unexpected dpkg output:\n{}'.format(output))
+        self.is_installed = self.dpkg.is_installed(self.name)
 
         # Determine state
         if self.is_installed == self.want_installed:
@@ -62,13 +196,25 @@ class Package(State):
             self.report.debug('Installed but should not be')
         else:
             self.report.debug('Not installed but should be')
+
+        if self.use_batch():
+            self.batch.add(self)
         return False
 
+    def use_batch(self):
+        """
+        Batch changes unless each change needs confirmation
+        """
+        return settings.sermin.batch and not settings.sermin.confirm
+
     def apply(self):
         # Make sure apt is updated
         self.update_apt()
 
-        if self.is_installed and not self.want_installed:
+        if self.use_batch():
+            self.apply_batch()
+
+        elif self.is_installed and not self.want_installed:
             # Installed but not wanted
             self.report.info('Removing')
             self.remove()
@@ -80,17 +226,46 @@ class Package(State):
 
     def update_apt(self):
         """
-        Update apt once, regardless of how many Package instances there are
+        Update apt once per run, regardless of how many Package instances
+        there are
         """
-        if self.__class__.apt_updated:
-            return
-        shell('apt-get update')
-        self.__class__.apt_updated = True
+        run.current().get(
+            'apt-get update', lambda: shell('apt-get update', stream=True),
+        )
+
+    def apply_batch(self):
+        """
+        Apply all pending package changes for this run in one transaction
+
+        The first Package to be applied will install and remove the pending
+        packages for every Package state in the run; later states will find
+        their changes have already been made.
+        """
+        if (
+            self.is_installed != self.want_installed and
+            not self.batch.is_applied(self)
+        ):
+            self.report.info('Applying pending package changes')
+            self.batch.add(self)
+            self.batch.apply()
+
+        if self.is_installed != self.want_installed:
+            raise RunError('Package {} was not {}'.format(
+                self.name,
+                'installed' if self.want_installed else 'removed',
+            ))
+
+        if self.is_installed:
+            self.report.info('Installed')
+        else:
+            self.report.info('Removed')
 
     def install(self):
-        shell('apt-get install --yes {}'.format(self.name))
+        shell('apt-get install --yes {}'.format(self.name), stream=True)
         self.is_installed = True
 
     def remove(self):
-        shell('apt-get remove --purge --yes {}'.format(self.name))
+        shell(
+            'apt-get remove --purge --yes {}'.format(self.name), stream=True,
+        )
         self.is_installed = False
@@ -2,14 +2,66 @@
 Service management
 """
 from future.utils import python_2_unicode_compatible
-import psutil
+import os
+import threading
 
+from ... import run, system
 from ...utils import shell
 from ..base import State
 
 
+class ProcessSnapshot(object):
+    """
+    Snapshot of running processes, shared by all Service states
+
+    The process table is scanned on first use and indexed by process name and
+    executable path. Call `invalidate()` after changing a process, so the
+    next lookup scans again.
+
+    One snapshot is kept for each run - see `Service.processes`.
+    """
+    def __init__(self):
+        self.by_name = None
+        self.by_exe = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.by_name = None
+
+    def scan(self):
+        by_name = {}
+        by_exe = {}
+        for name, exe, proc in system.get().processes():
+            if name:
+                by_name.setdefault(name, proc)
+            if exe:
+                by_exe.setdefault(exe, proc)
+        self.by_name = by_name
+        self.by_exe = by_exe
+
+    def find(self, name):
+        """
+        Return a process matching the name, or None if not found
+
+        If the name is a path, it is matched against executable paths,
+        otherwise it is matched against process names.
+        """
+        with self._lock:
+            if self.by_name is None:
+                self.scan()
+
+            if os.sep in name:
+                return self.by_exe.get(name)
+            return self.by_name.get(name)
+
+
 @python_2_unicode_compatible
 class Service(State):
+    __slots__ = (
+        'name', 'state', 'action', 'command', 'process', 'running',
+    )
+
     # States
     RUNNING = 'running'
     STOPPED = 'stopped'
@@ -28,7 +80,8 @@ class Service(State):
         Define the service state
 
         Arguments:
-            name        The name of the package
+            name        The name of the service process, or the path to its
+                        executable
             state       The desired package state; one of:
                             Service.RUNNING
                                 Start if not running
@@ -54,16 +107,22 @@ class Service(State):
         self.state = state
         self.action = action
         self.command = command
+        self.process = None
+        self.running = None
         super(Service, self).__init__(**kwargs)
 
     def __str__(self):
         return self.name
 
+    @property
+    def processes(self):
+        """
+        Running processes, shared by all instances in the current run
+        """
+        return run.current().get(ProcessSnapshot, ProcessSnapshot)
+
     def check(self):
-        processes = {
-            proc.name(): proc for proc in psutil.process_iter()
-        }
-        self.process = processes.get(self.name)
+        self.process = self.processes.find(self.name)
         self.running = False
         if self.process:
             self.running = True
@@ -93,5 +152,8 @@ class Service(State):
                 shell(self.command.format(name=self.name, action='start'))
 
         if self.action:
-            self.report.info('Performing action: {}'.format(self.action))
+            self.report.info('Performing action: {}', self.action)
             shell(self.command.format(name=self.name, action=self.action))
+
+        # Processes have changed
+        self.processes.invalidate()
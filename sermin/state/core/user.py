@@ -3,12 +3,16 @@ User management
 """
 from future.utils import python_2_unicode_compatible
 import crypt
-import pwd
+import os
 import random
 
+from ... import system
 from ...constants import Undefined
+from ...facts import Fact
 from ...utils import shell
+from ...system.identities import UserSpec
 from ..base import State
+from . import identity
 from .group import Group
 
 
@@ -24,11 +28,75 @@ class UserData(object):
         self.comment = comment
 
 
+class PasswdDatabase(Fact):
+    """
+    Fact of users, parsed from the passwd database
+
+    The value is a dict of {name: [uid, gid, comment, home, shell]}
+
+    It is checked for changes once per run; states which change users must
+    call `invalidate()`.
+    """
+    name = 'passwd'
+    paths = ('/etc/passwd',)
+    per_run = True
+
+    def compute(self):
+        users = {}
+        try:
+            file = self.open(self.paths[0])
+        except IOError:
+            return users
+
+        with file:
+            for line in file:
+                parts = line.rstrip('\n').split(':')
+                if (
+                    len(parts) != 7 or
+                    not parts[2].isdigit() or
+                    not parts[3].isdigit()
+                ):
+                    # Comment, NIS entry or invalid
+                    continue
+                name, password, uid, gid, comment, home, shell = parts
+                users[name] = [int(uid), int(gid), comment, home, shell]
+        return users
+
+    def get_user(self, name):
+        """
+        Return a UserData object for the named user, or None if not found
+
+        Users which are not in the file, eg from LDAP, are looked up using the
+        system's name service, and remembered until the file changes.
+        """
+        user = self.get().get(name)
+        if not user:
+            user = self.lookup(name, system.get().getpwnam)
+            if user is None:
+                return None
+        uid, gid, comment, home, shell = user
+        return UserData(
+            shell=shell,
+            home=home,
+            uid=int(uid),
+            gid=int(gid),
+            comment=comment,
+        )
+
+
 @python_2_unicode_compatible
 class User(State):
     """
     User state
     """
+    __slots__ = (
+        'name', 'state', 'password', 'shell', 'home', 'uid', 'group',
+        'comment',
+    )
+
+    # User database shared by all instances
+    database = PasswdDatabase()
+
     # States
     EXISTS = 'exist'
     ABSENT = 'absent'
@@ -103,17 +171,7 @@ class User(State):
         """
         Returns a UserData object, or None if the user is not found
         """
-        try:
-            data = pwd.getpwnam(self.name)
-        except KeyError:
-            return None
-        return UserData(
-            shell=data.pw_shell,
-            home=data.pw_dir,
-            uid=int(data.pw_uid),
-            gid=int(data.pw_gid),
-            comment=data.pw_gecos,
-        )
+        return self.database.get_user(self.name)
 
     def __str__(self):
         uid = self.uid
@@ -126,6 +184,24 @@ class User(State):
 
         return '{name} ({uid})'.format(name=self.name, uid=uid)
 
+    @property
+    def batch(self):
+        """
+        Pending changes for the batch setting, shared with Group states in the
+        current run
+        """
+        return identity.get_batch()
+
+    def get_resources(self):
+        # Changes to users and groups lock the same system databases
+        reads = set()
+        writes = {('identity',)}
+        if self.home:
+            home = os.path.abspath(self.home.format(name=self.name))
+            reads.add(('path', os.path.dirname(home)))
+            writes.add(('path', home))
+        return reads, writes
+
     def check(self):
         user = self.get_user_status()
         if user:
@@ -136,38 +212,104 @@ class User(State):
 
                 return True
             self.report.debug('Does not exist but should')
-            return False
+            return self.needs_change()
         else:
             if self.state == self.ABSENT:
                 self.report.debug('Does not exist')
                 return True
             self.report.debug('Exists but should not')
-            return False
+            return self.needs_change()
+
+    def needs_change(self):
+        """
+        Add the user to the batch if changes are batched, and return False
+        """
+        if identity.use_batch():
+            self.batch.add(self)
+        return False
 
     def apply(self):
+        if identity.use_batch():
+            self.batch.apply_state(self)
+            if self.state == self.ABSENT:
+                self.report.info('Removed')
+            else:
+                self.report.info('Created')
+            return
+
         user = self.get_user_status()
         if user:
             if self.state == self.ABSENT:
                 self.report.info('Removing')
                 shell('userdel {}'.format(self.name))
+                self.invalidate()
         else:
             if self.state == self.EXISTS:
                 self.report.info('Creating')
                 shell(self.get_add_command())
+                self.invalidate()
 
                 # TODO: Check if other attributes need updating (usermod)
 
+    def invalidate(self):
+        """
+        Forget the users and groups read this run, after changing them
+
+        Adding a user can add a group, and removing one changes the members
+        of groups.
+        """
+        self.database.invalidate()
+        Group.database.invalidate()
+
+    def get_batch_change(self):
+        """
+        Return the change to make in a batch - see `IdentityBatch`
+        """
+        key = ('user', self.name)
+        if self.state == self.ABSENT:
+            return ('remove_users', key, self.name)
+
+        group = None
+        if self.group:
+            if isinstance(self.group, Group):
+                # The group may be created in the same batch
+                group = self.group.name
+            else:
+                group = self.group
+
+        return ('add_users', key, UserSpec(
+            self.name,
+            uid=self.uid,
+            group=group,
+            comment=self.comment,
+            home=self.home.format(name=self.name) if self.home else None,
+            shell=self.shell,
+            password=self.encrypt_password() if self.password else None,
+        ))
+
+    def encrypt_password(self):
+        ALPHABET = ''.join([
+            chr(c) for c in
+            list(range(48, 58)) + list(range(65, 91)) + list(range(97, 123))
+        ])
+        salt = ''.join(random.choice(ALPHABET) for i in range(16))
+        return crypt.crypt(self.password, salt)
+
+    def get_group_gid(self):
+        if isinstance(self.group, Group):
+            gid = self.group.get_gid()
+            if not gid:
+                raise ValueError(
+                    "Cannot add a user to a group which doesn't exist"
+                )
+            return gid
+        return self.group
+
     def get_add_command(self):
         cmd = ['useradd']
 
         if self.password:
-            ALPHABET = ''.join([
-                chr(c) for c in range(48, 58) + range(65, 91) + range(97, 123)
-            ])
-            salt = ''.join(random.choice(ALPHABET) for i in range(16))
-            cmd.extend([
-                '-p', crypt.crypt(self.password, salt)
-            ])
+            cmd.extend(['-p', self.encrypt_password()])
 
         if self.shell:
             cmd.extend(['-s', self.shell])
@@ -183,15 +325,7 @@ class User(State):
             cmd.extend(['-u', self.uid])
 
         if self.group:
-            if isinstance(self.group, Group):
-                gid = self.group.get_gid()
-                if not gid:
-                    raise ValueError(
-                        "Cannot add a user to a group which doesn't exist"
-                    )
-            else:
-                gid = self.group
-            cmd.extend(['-g', gid])
+            cmd.extend(['-g', self.get_group_gid()])
 
         if self.comment:
             cmd.extend(['-c', self.comment])
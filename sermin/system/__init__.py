@@ -0,0 +1,28 @@
+"""
+System backends
+
+States inspect and change the system through a system backend, chosen by the
+`system` setting:
+
+    local   The machine Sermin is running on (default)
+    memory  A simulated system held in memory, for tests and benchmarks
+
+Use `get()` to find the current backend.
+"""
+from ..config import settings
+from .base import System  # NOQA
+from .local import LocalSystem
+from .memory import MemorySystem
+
+
+systems = {
+    'local': LocalSystem(),
+    'memory': MemorySystem(),
+}
+
+
+def get():
+    """
+    Return the current system backend
+    """
+    return systems[settings.sermin.system]
@@ -0,0 +1,220 @@
+"""
+Base system backend
+"""
+from contextlib import contextmanager
+
+from .identities import (
+    CACHE_COMMANDS, LOGIN_DEFS, IdentityDatabase, IdentityError, LoginDefs,
+    PATHS,
+)
+
+
+class System(object):
+    """
+    Abstract base class for system backends
+
+    A system backend performs the operations states use to inspect and change
+    the system: running shell commands, reading and writing files, looking up
+    users and groups, and listing processes.
+
+    Paths are absolute or relative to the current working directory.
+    """
+    # True if this is the machine Sermin is running on. Data about other
+    # systems is not kept in the local cache.
+    local = False
+
+    def run(self, cmd, stdout, stderr, cd=None, stdin=None, env=None):
+        """
+        Run the command (a list of arguments), feed its output to the
+        stdout and stderr captures, and return the return code
+
+        See `sermin.utils.shell`
+        """
+        raise NotImplementedError('Subclasses must implement run')
+
+    def exists(self, path):
+        raise NotImplementedError('Subclasses must implement exists')
+
+    def isdir(self, path):
+        raise NotImplementedError('Subclasses must implement isdir')
+
+    def stat(self, path):
+        """
+        Return a list of the metadata used to detect changes to a file, as
+        `[size, mtime, inode]`
+
+        Raise OSError if the path does not exist
+        """
+        raise NotImplementedError('Subclasses must implement stat')
+
+    def open(self, path):
+        """
+        Return a binary file object to read the file
+
+        Raise IOError if the file does not exist
+        """
+        raise NotImplementedError('Subclasses must implement open')
+
+    def read(self, path):
+        """
+        Return the content of the file as bytes
+
+        Raise IOError if the file does not exist
+        """
+        raise NotImplementedError('Subclasses must implement read')
+
+    def hash(self, path):
+        """
+        Return the hex sha1 digest of the content of the file
+        """
+        raise NotImplementedError('Subclasses must implement hash')
+
+    def write(self, path, data):
+        """
+        Atomically replace the content of the file with the data bytes
+        """
+        raise NotImplementedError('Subclasses must implement write')
+
+    def copy(self, source, path):
+        """
+        Atomically replace the content of the file with the source file's
+        """
+        raise NotImplementedError('Subclasses must implement copy')
+
+    def remove(self, path):
+        raise NotImplementedError('Subclasses must implement remove')
+
+    def makedirs(self, path):
+        raise NotImplementedError('Subclasses must implement makedirs')
+
+    def rmdir(self, path):
+        raise NotImplementedError('Subclasses must implement rmdir')
+
+    def getpwnam(self, name):
+        """
+        Return a tuple of `(uid, gid, comment, home, shell)` for the named
+        user from the system's name service, or None if not found
+        """
+        raise NotImplementedError('Subclasses must implement getpwnam')
+
+    def getgrnam(self, name):
+        """
+        Return the gid of the named group from the system's name service, or
+        None if not found
+        """
+        raise NotImplementedError('Subclasses must implement getgrnam')
+
+    def update_identities(
+        self, add_groups=(), add_users=(), remove_users=(), remove_groups=(),
+    ):
+        """
+        Add and remove users and groups in one locked edit of the passwd,
+        shadow, group and gshadow databases
+
+        Arguments:
+            add_groups      List of `(name, gid)` tuples; gid can be None
+            add_users       List of `sermin.system.identities.UserSpec`
+            remove_users    List of user names
+            remove_groups   List of group names
+
+        Groups are added before users, and users are removed before groups.
+        New ids, password aging and the mode of home directories follow
+        `/etc/login.defs`, as they do for `useradd`.
+
+        Each changed database is backed up to its `-` file, eg
+        `/etc/passwd-`, before it is written. Afterwards the nscd and sssd
+        caches are invalidated, and home directories are created for new
+        users.
+
+        Returns a dict of `{(kind, name): error}`, where kind is `user` or
+        `group`, for changes which could not be made; other changes are made
+        regardless.
+        """
+        errors = {}
+        homes = []
+
+        def attempt(key, fn, *args):
+            try:
+                return fn(*args)
+            except IdentityError as e:
+                errors[key] = str(e)
+
+        try:
+            login_defs = LoginDefs(self.read(LOGIN_DEFS).decode('utf-8'))
+        except (IOError, OSError):
+            login_defs = LoginDefs()
+
+        with self.lock_identities():
+            contents = {}
+            for path in PATHS:
+                try:
+                    contents[path] = self.read(path).decode('utf-8')
+                except (IOError, OSError):
+                    pass
+
+            database = IdentityDatabase(contents, login_defs)
+            for name, gid in add_groups:
+                attempt(('group', name), database.add_group, name, gid)
+            for user in add_users:
+                ids = attempt(('user', user.name), database.add_user, user)
+                if ids and user.home:
+                    homes.append((user.home, ids))
+            for name in remove_users:
+                attempt(('user', name), database.remove_user, name)
+            for name in remove_groups:
+                attempt(('group', name), database.remove_group, name)
+
+            changed = False
+            for path, content in database.render().items():
+                if content != contents[path]:
+                    self.backup(path)
+                    self.write(path, content.encode('utf-8'))
+                    changed = True
+
+        if changed:
+            self.invalidate_identity_caches()
+        for path, (uid, gid) in homes:
+            if not self.exists(path):
+                self.create_home(path, uid, gid, login_defs.home_mode)
+        return errors
+
+    @contextmanager
+    def lock_identities(self):
+        """
+        Hold the lock on the user and group databases until the block ends
+        """
+        yield
+
+    def backup(self, path):
+        """
+        Copy the file to its backup, at the path followed by `-`
+        """
+        self.copy(path, '{}-'.format(path))
+
+    def invalidate_identity_caches(self):
+        """
+        Tell name service caches that the user and group databases have
+        changed, if they are installed
+        """
+        # Local import to avoid circular import
+        from ..utils import shell
+
+        for cmd in CACHE_COMMANDS:
+            if self.exists(cmd[0]):
+                shell(cmd, expect_errors=True)
+
+    def create_home(self, path, uid, gid, mode=0o755):
+        """
+        Create a home directory for a new user
+        """
+        self.makedirs(path)
+
+    def processes(self):
+        """
+        Return an iterable of running processes, as tuples of
+        `(name, exe, process)`
+
+        The name and exe may be None if they are not available. The process
+        object is returned by `Service.processes.find()`.
+        """
+        raise NotImplementedError('Subclasses must implement processes')
@@ -0,0 +1,303 @@
+"""
+Edit the user and group databases directly
+
+Used by `System.update_identities` to add and remove many users and groups in
+a single locked edit, rather than running `useradd` or `addgroup` for each.
+"""
+from builtins import str
+import time
+
+
+PASSWD = '/etc/passwd'
+SHADOW = '/etc/shadow'
+GROUP = '/etc/group'
+GSHADOW = '/etc/gshadow'
+
+PATHS = (PASSWD, SHADOW, GROUP, GSHADOW)
+
+# Number of fields in a valid line of each database
+FIELDS = {PASSWD: 7, SHADOW: 9, GROUP: 4, GSHADOW: 4}
+
+LOGIN_DEFS = '/etc/login.defs'
+
+# Commands to run after editing the databases, if their executable exists,
+# so name service caches don't return stale entries
+CACHE_COMMANDS = (
+    ['/usr/sbin/nscd', '-i', 'passwd'],
+    ['/usr/sbin/nscd', '-i', 'group'],
+    ['/usr/sbin/sss_cache', '-E'],
+)
+
+
+class IdentityError(ValueError):
+    """
+    Raised when a user or group cannot be added or removed
+    """
+    pass
+
+
+class UserSpec(object):
+    """
+    A user to add
+
+    Arguments:
+        name        Name of the user
+        uid         Numeric user ID, or None to use the next free ID
+        group       Name or gid of the primary group, or None to add a group
+                    with the same name as the user
+        comment     Comment, eg the user's full name
+        home        Home directory, or None for no home directory
+        shell       Login shell, or None for no shell
+        password    Encrypted password, or None to lock the password
+    """
+    def __init__(
+        self, name, uid=None, group=None, comment=None, home=None,
+        shell=None, password=None,
+    ):
+        self.name = name
+        self.uid = uid
+        self.group = group
+        self.comment = comment
+        self.home = home
+        self.shell = shell
+        self.password = password
+
+
+class Table(object):
+    """
+    The lines of a database, split into fields
+
+    Lines which are not valid entries, such as comments and NIS entries, are
+    kept as they are.
+    """
+    def __init__(self, content, fields):
+        self.fields = fields
+        self.rows = [
+            line.split(':') for line in content.splitlines() if line
+        ]
+
+    def entries(self):
+        return [row for row in self.rows if len(row) == self.fields]
+
+    def find(self, name):
+        for row in self.entries():
+            if row[0] == name:
+                return row
+        return None
+
+    def add(self, row):
+        self.rows.append([str(field) for field in row])
+
+    def remove(self, name):
+        self.rows = [
+            row for row in self.rows
+            if len(row) != self.fields or row[0] != name
+        ]
+
+    def render(self):
+        return ''.join('{}\n'.format(':'.join(row)) for row in self.rows)
+
+
+class LoginDefs(object):
+    """
+    Settings for new users and groups, parsed from the content of
+    login.defs(5)
+
+    Settings which are missing or invalid use the defaults of `useradd`.
+    """
+    defaults = {
+        'UID_MIN': 1000,
+        'UID_MAX': 60000,
+        'GID_MIN': 1000,
+        'GID_MAX': 60000,
+        'PASS_MIN_DAYS': 0,
+        'PASS_MAX_DAYS': 99999,
+        'PASS_WARN_AGE': 7,
+        'UMASK': 0o022,
+        'HOME_MODE': None,
+    }
+
+    # Settings which are octal modes
+    octal = ('UMASK', 'HOME_MODE')
+
+    def __init__(self, content=''):
+        self.values = dict(self.defaults)
+        for line in content.splitlines():
+            fields = line.split()
+            if len(fields) < 2 or fields[0] not in self.defaults:
+                continue
+            try:
+                self.values[fields[0]] = int(
+                    fields[1], 8 if fields[0] in self.octal else 10,
+                )
+            except ValueError:
+                pass
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    @property
+    def home_mode(self):
+        """
+        Mode for new home directories: HOME_MODE, or the mode allowed by
+        UMASK if it is not set
+        """
+        if self['HOME_MODE'] is not None:
+            return self['HOME_MODE']
+        return 0o777 & ~self['UMASK']
+
+
+class IdentityDatabase(object):
+    """
+    The passwd, shadow, group and gshadow databases, parsed for editing
+
+    Takes a dict of {path: content}; missing databases are treated as empty,
+    and are only written if they existed. New ids and password aging are
+    taken from the LoginDefs.
+    """
+    def __init__(self, contents, login_defs=None):
+        self.login_defs = login_defs or LoginDefs()
+        self.exists = set(contents)
+        self.tables = dict(
+            (path, Table(contents.get(path, ''), FIELDS[path]))
+            for path in PATHS
+        )
+        self.passwd = self.tables[PASSWD]
+        self.shadow = self.tables[SHADOW]
+        self.group = self.tables[GROUP]
+        self.gshadow = self.tables[GSHADOW]
+
+    def next_id(self, table, index, kind):
+        """
+        Return the first id from `<kind>_MIN` to `<kind>_MAX` which is not
+        used in the table
+        """
+        used = set(
+            int(row[index]) for row in table.entries()
+            if row[index].isdigit()
+        )
+        first = self.login_defs['{}_MIN'.format(kind)]
+        last = self.login_defs['{}_MAX'.format(kind)]
+        for candidate in range(first, last + 1):
+            if candidate not in used:
+                return candidate
+        raise IdentityError('No free ids')
+
+    def get_gid(self, group):
+        """
+        Return the gid of a group, by name or gid, or None if not found
+        """
+        if str(group).isdigit():
+            for row in self.group.entries():
+                if row[2] == str(group):
+                    return int(group)
+            return None
+        row = self.group.find(group)
+        return int(row[2]) if row else None
+
+    def add_group(self, name, gid=None):
+        """
+        Add a group, and return its gid
+        """
+        if self.group.find(name):
+            raise IdentityError('Group {} already exists'.format(name))
+        if gid is None:
+            gid = self.next_id(self.group, 2, 'GID')
+        elif self.get_gid(gid) is not None:
+            raise IdentityError('Gid {} is already in use'.format(gid))
+
+        self.group.add([name, 'x', gid, ''])
+        if GSHADOW in self.exists:
+            self.gshadow.add([name, '!', '', ''])
+        return int(gid)
+
+    def add_user(self, user):
+        """
+        Add a user from a UserSpec, and return its `(uid, gid)`
+        """
+        if self.passwd.find(user.name):
+            raise IdentityError('User {} already exists'.format(user.name))
+
+        uid = user.uid
+        if uid is None:
+            uid = self.next_id(self.passwd, 2, 'UID')
+        elif any(row[2] == str(uid) for row in self.passwd.entries()):
+            raise IdentityError('Uid {} is already in use'.format(uid))
+
+        if user.group is None:
+            # Add a group for the user, with the same id if it is free
+            gid = self.add_group(
+                user.name, None if self.get_gid(uid) is not None else uid,
+            )
+        else:
+            gid = self.get_gid(user.group)
+            if gid is None:
+                raise IdentityError(
+                    'Group {} does not exist'.format(user.group),
+                )
+
+        self.passwd.add([
+            user.name, 'x', uid, gid, user.comment or '',
+            user.home or '/nonexistent', user.shell or '',
+        ])
+        if SHADOW in self.exists:
+            self.shadow.add([
+                user.name, user.password or '!', int(time.time() // 86400),
+                self.login_defs['PASS_MIN_DAYS'],
+                self.login_defs['PASS_MAX_DAYS'],
+                self.login_defs['PASS_WARN_AGE'],
+                '', '', '',
+            ])
+        return int(uid), gid
+
+    def remove_user(self, name):
+        """
+        Remove a user, their group memberships, and their own group if no
+        other user uses it
+        """
+        row = self.passwd.find(name)
+        if not row:
+            raise IdentityError('User {} does not exist'.format(name))
+
+        self.passwd.remove(name)
+        self.shadow.remove(name)
+        for table, index in ((self.group, 3), (self.gshadow, 3)):
+            for entry in table.entries():
+                members = [
+                    member for member in entry[index].split(',')
+                    if member and member != name
+                ]
+                entry[index] = ','.join(members)
+
+        group = self.group.find(name)
+        if (
+            group and group[2] == row[3] and not group[3] and
+            not any(entry[3] == row[3] for entry in self.passwd.entries())
+        ):
+            self.remove_group(name)
+
+    def remove_group(self, name):
+        """
+        Remove a group which is not the primary group of any user
+        """
+        row = self.group.find(name)
+        if not row:
+            raise IdentityError('Group {} does not exist'.format(name))
+        for entry in self.passwd.entries():
+            if entry[3] == row[2]:
+                raise IdentityError(
+                    'Group {} is the primary group of {}'.format(
+                        name, entry[0],
+                    ),
+                )
+        self.group.remove(name)
+        self.gshadow.remove(name)
+
+    def render(self):
+        """
+        Return a dict of {path: content} for the databases which exist
+        """
+        return dict(
+            (path, self.tables[path].render()) for path in PATHS
+            if path in self.exists
+        )
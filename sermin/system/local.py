@@ -0,0 +1,224 @@
+"""
+System backend for the machine Sermin is running on
+"""
+from contextlib import contextmanager
+import fcntl
+import grp
+import hashlib
+import io
+import os
+import pwd
+import shutil
+from stat import S_IMODE
+import tempfile
+
+import psutil
+
+from ..config import settings
+from .base import System
+
+
+def hash_file(path, block_size=65536):
+    """
+    Return the hex digest of a file's content, reading it in blocks
+    """
+    digest = hashlib.sha1()
+    with io.open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Read the umask once, as changing it to read it is not thread safe
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def copy_file_data(source, target, block_size=65536):
+    """
+    Copy the content of the open source file object to the open target
+
+    Uses `os.copy_file_range` or `os.sendfile` to copy within the kernel
+    where available, otherwise copies in blocks.
+    """
+    size = os.fstat(source.fileno()).st_size
+    for name in ('copy_file_range', 'sendfile'):
+        fn = getattr(os, name, None)
+        if fn is None:
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if name == 'sendfile':
+                    sent = fn(target.fileno(), source.fileno(), offset, size)
+                else:
+                    sent = fn(source.fileno(), target.fileno(), size, offset)
+                if not sent:
+                    break
+                offset += sent
+        except OSError:
+            # Not supported for these files; start again
+            os.lseek(target.fileno(), 0, os.SEEK_SET)
+            os.ftruncate(target.fileno(), 0)
+            continue
+        if offset >= size:
+            return
+
+    source.seek(0)
+    target.seek(0)
+    target.truncate()
+    shutil.copyfileobj(source, target, block_size)
+
+
+def write_file(path, data=None, source=None, like=None):
+    """
+    Atomically replace the file at path with the data bytes, or with the
+    content of the source path
+
+    The content is written to a temporary file in the same directory, synced
+    to disk, and renamed over the target. The mode and ownership of any
+    existing file are kept, or taken from the `like` path if given.
+
+    If the path is a symlink, the file it points to is replaced, and the
+    link is kept.
+    """
+    path = os.path.realpath(path)
+    dirname = os.path.dirname(path)
+    handle, temp_path = tempfile.mkstemp(dir=dirname, prefix='.sermin-')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            if source is not None:
+                with io.open(source, 'rb') as source_file:
+                    copy_file_data(source_file, file)
+            else:
+                file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+        try:
+            stat = os.stat(like or path)
+        except OSError:
+            os.chmod(temp_path, 0o666 & ~_umask)
+        else:
+            os.chmod(temp_path, S_IMODE(stat.st_mode))
+            try:
+                os.chown(temp_path, stat.st_uid, stat.st_gid)
+            except OSError:
+                # Not permitted - the file will be owned by the current user
+                pass
+
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+class LocalSystem(System):
+    """
+    The machine Sermin is running on
+
+    Shell commands are run using the backend named in the `shell_backend`
+    setting.
+    """
+    local = True
+
+    def run(self, cmd, stdout, stderr, cd=None, stdin=None, env=None):
+        # Local import to avoid circular import
+        from ..utils import backends
+
+        backend = backends[settings.sermin.shell_backend]
+        return backend.run(cmd, stdout, stderr, cd=cd, stdin=stdin, env=env)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def stat(self, path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime, stat.st_ino]
+
+    def open(self, path):
+        return io.open(path, 'rb')
+
+    def read(self, path):
+        with io.open(path, 'rb') as file:
+            return file.read()
+
+    def hash(self, path):
+        return hash_file(path)
+
+    def write(self, path, data):
+        write_file(path, data=data)
+
+    def copy(self, source, path):
+        write_file(path, source=source)
+
+    def backup(self, path):
+        # Keep the mode of the original, so shadow backups stay private
+        write_file('{}-'.format(path), source=path, like=path)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def makedirs(self, path):
+        os.makedirs(path)
+
+    def rmdir(self, path):
+        os.rmdir(path)
+
+    def getpwnam(self, name):
+        try:
+            data = pwd.getpwnam(name)
+        except KeyError:
+            return None
+        return (
+            data.pw_uid, data.pw_gid, data.pw_gecos, data.pw_dir,
+            data.pw_shell,
+        )
+
+    def getgrnam(self, name):
+        try:
+            return grp.getgrnam(name).gr_gid
+        except KeyError:
+            return None
+
+    @contextmanager
+    def lock_identities(self):
+        # The lock taken by lckpwdf(3), and so by useradd and friends
+        handle = os.open('/etc/.pwd.lock', os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(handle, fcntl.LOCK_EX)
+            yield
+        finally:
+            # Closing the file releases the lock
+            os.close(handle)
+
+    def create_home(self, path, uid, gid, mode=0o755, skel='/etc/skel'):
+        """
+        Create the home directory from the skeleton directory, as
+        `useradd -m` does
+        """
+        os.makedirs(path)
+        os.chmod(path, mode)
+        if os.path.isdir(skel):
+            for name in os.listdir(skel):
+                source = os.path.join(skel, name)
+                target = os.path.join(path, name)
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), target)
+                elif os.path.isdir(source):
+                    shutil.copytree(source, target, symlinks=True)
+                else:
+                    shutil.copy2(source, target)
+
+        os.lchown(path, uid, gid)
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                os.lchown(os.path.join(root, name), uid, gid)
+
+    def processes(self):
+        for proc in psutil.process_iter(attrs=['name', 'exe']):
+            # Values we can't access are None
+            yield proc.info['name'], proc.info['exe'], proc
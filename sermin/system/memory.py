@@ -0,0 +1,693 @@
+"""
+In-memory system backend, for tests and benchmarks
+"""
+import errno
+import hashlib
+import io
+import itertools
+import os
+import threading
+import time
+
+from .base import System
+
+
+class CommandFailed(Exception):
+    """
+    Raised by a simulated command to return an error
+    """
+    def __init__(self, msg, return_code=1):
+        super(CommandFailed, self).__init__(msg)
+        self.return_code = return_code
+
+
+class MemoryProcess(object):
+    """
+    A simulated process, with the methods of `psutil.Process` used by Sermin
+    """
+    def __init__(self, pid, name, exe=None):
+        self.pid = pid
+        self._name = name
+        self._exe = exe
+
+    def name(self):
+        return self._name
+
+    def exe(self):
+        return self._exe
+
+
+class MemoryRepository(object):
+    """
+    A simulated git repository
+    """
+    def __init__(self, remote, bare=False):
+        self.remote = remote
+        self.bare = bare
+        self.reference = None
+        self.head = None
+        self.branch = None
+        self.remote_branches = {}
+        self.tags = {}
+
+    def fetch(self, refs):
+        self.remote_branches = dict(refs['branches'])
+        self.tags = dict(refs['tags'])
+
+
+def parse_options(args, with_values):
+    """
+    Split command arguments into a dict of options and a list of positional
+    arguments
+
+    Options in `with_values` take the next argument as their value; other
+    options have the value True.
+    """
+    options = {}
+    positional = []
+    args = iter(args)
+    for arg in args:
+        if arg.startswith('-'):
+            options[arg] = next(args) if arg in with_values else True
+        else:
+            positional.append(arg)
+    return options, positional
+
+
+class MemorySystem(System):
+    """
+    A simulated system held in memory
+
+    Files and directories are held in memory. Users, groups and installed
+    packages are written to simulated `/etc/passwd`, `/etc/group` and
+    `/var/lib/dpkg/status` files, so they are read by the same facts as on a
+    real system. Git repositories write their HEAD, refs and config to their
+    `.git` dirs in the same way.
+
+    Shell commands are simulated for `apt-get`, `dpkg -s`, `getent`,
+    `useradd`, `userdel`, `addgroup`, `delgroup`, scripts in `/etc/init.d`,
+    `git`, `true`, `false` and `echo`. Other commands fail with return code
+    127. Each command is recorded in `commands`.
+
+    Use the `add_*` methods, `start`, `makedirs` and `write` to set up the
+    system before a run.
+    """
+    dpkg_path = '/var/lib/dpkg/status'
+    passwd_path = '/etc/passwd'
+    group_path = '/etc/group'
+
+    # First id given to users and groups added without one
+    first_id = 1000
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._inodes = itertools.count(1)
+        self._pids = itertools.count(100)
+
+        # {path: [data, mtime, inode]}
+        self.files = {}
+        self.dirs = {'/'}
+        self.commands = []
+
+        # {name: MemoryProcess}
+        self.procs = {}
+
+        # Git remotes as {url: {'branches': {name: commit}, 'tags': {..}}},
+        # and local repositories as {path: MemoryRepository}
+        self.remotes = {}
+        self.repos = {}
+
+        self.packages = set()
+
+        # {name: [uid, gid, comment, home, shell]}
+        self.users = {}
+
+        # {name: [gid, [member, ...]]}
+        self.groups = {}
+
+        for path in [self.dpkg_path, self.passwd_path, self.group_path]:
+            self.makedirs(os.path.dirname(path), exist_ok=True)
+        self.add_group('root', 0)
+        self.add_user('root', 0, 0, 'root', '/root', '/bin/sh')
+        self.save_packages()
+
+    #
+    # Files
+    #
+
+    def error(self, cls, code, path):
+        return cls(code, os.strerror(code), path)
+
+    def exists(self, path):
+        path = os.path.abspath(path)
+        return path in self.files or path in self.dirs
+
+    def isdir(self, path):
+        return os.path.abspath(path) in self.dirs
+
+    def stat(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self.dirs:
+                return [0, 0, 0]
+            if path not in self.files:
+                raise self.error(OSError, errno.ENOENT, path)
+            data, mtime, inode = self.files[path]
+            return [len(data), mtime, inode]
+
+    def open(self, path):
+        return io.BytesIO(self.read(path))
+
+    def read(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self.files:
+                raise self.error(IOError, errno.ENOENT, path)
+            return self.files[path][0]
+
+    def hash(self, path):
+        return hashlib.sha1(self.read(path)).hexdigest()
+
+    def write(self, path, data):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self.dirs:
+                raise self.error(IOError, errno.EISDIR, path)
+            if os.path.dirname(path) not in self.dirs:
+                raise self.error(IOError, errno.ENOENT, path)
+            self.files[path] = [data, time.time(), next(self._inodes)]
+
+    def copy(self, source, path):
+        with self._lock:
+            self.write(path, self.read(source))
+
+    def remove(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self.files:
+                raise self.error(OSError, errno.ENOENT, path)
+            del self.files[path]
+
+    def makedirs(self, path, exist_ok=False):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self.files:
+                raise self.error(OSError, errno.EEXIST, path)
+            if path in self.dirs:
+                if exist_ok:
+                    return
+                raise self.error(OSError, errno.EEXIST, path)
+            while path not in self.dirs:
+                if path in self.files:
+                    raise self.error(OSError, errno.ENOTDIR, path)
+                self.dirs.add(path)
+                path = os.path.dirname(path)
+
+    def rmdir(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self.dirs:
+                raise self.error(OSError, errno.ENOENT, path)
+            prefix = path.rstrip('/') + '/'
+            for child in itertools.chain(self.files, self.dirs):
+                if child.startswith(prefix):
+                    raise self.error(OSError, errno.ENOTEMPTY, path)
+            self.dirs.remove(path)
+
+    #
+    # Users, groups and packages
+    #
+
+    def next_id(self, used):
+        used = set(used)
+        for candidate in itertools.count(self.first_id):
+            if candidate not in used:
+                return candidate
+
+    def add_user(
+        self, name, uid=None, gid=None, comment='', home=None,
+        shell='/bin/sh',
+    ):
+        with self._lock:
+            if uid is None:
+                uid = self.next_id(user[0] for user in self.users.values())
+            if gid is None:
+                gid = uid
+            self.users[name] = [
+                int(uid), int(gid), comment, home or '/nonexistent', shell,
+            ]
+            self.save_users()
+
+    def add_group(self, name, gid=None, members=()):
+        with self._lock:
+            if gid is None:
+                gid = self.next_id(group[0] for group in self.groups.values())
+            self.groups[name] = [int(gid), list(members)]
+            self.save_groups()
+
+    def add_package(self, *names):
+        with self._lock:
+            self.packages.update(names)
+            self.save_packages()
+
+    def save_users(self):
+        self.write(self.passwd_path, ''.join(
+            '{}:x:{}:{}:{}:{}:{}\n'.format(name, *user)
+            for name, user in sorted(self.users.items())
+        ).encode('utf-8'))
+
+    def save_groups(self):
+        self.write(self.group_path, ''.join(
+            '{}:x:{}:{}\n'.format(name, gid, ','.join(members))
+            for name, (gid, members) in sorted(self.groups.items())
+        ).encode('utf-8'))
+
+    def save_packages(self):
+        self.write(self.dpkg_path, ''.join(
+            'Package: {}\nStatus: install ok installed\n'
+            'Architecture: all\n\n'.format(name)
+            for name in sorted(self.packages)
+        ).encode('utf-8'))
+
+    def update_identities(self, *args, **kwargs):
+        with self._lock:
+            errors = super(MemorySystem, self).update_identities(
+                *args, **kwargs
+            )
+            self.load_identities()
+            return errors
+
+    def lock_identities(self):
+        return self._lock
+
+    def create_home(self, path, uid, gid, mode=0o755):
+        self.makedirs(path, exist_ok=True)
+
+    def load_identities(self):
+        """
+        Update users and groups from the passwd and group files, after they
+        have been edited directly
+        """
+        self.users = {}
+        for line in self.read(self.passwd_path).decode('utf-8').splitlines():
+            name, password, uid, gid, comment, home, shell = line.split(':')
+            self.users[name] = [int(uid), int(gid), comment, home, shell]
+
+        self.groups = {}
+        for line in self.read(self.group_path).decode('utf-8').splitlines():
+            name, password, gid, members = line.split(':')
+            self.groups[name] = [
+                int(gid), [member for member in members.split(',') if member],
+            ]
+
+    def getpwnam(self, name):
+        # All users are in the passwd file
+        return None
+
+    def getgrnam(self, name):
+        # All groups are in the group file
+        return None
+
+    #
+    # Processes
+    #
+
+    def start(self, name, exe=None):
+        """
+        Start a process, and return it
+        """
+        with self._lock:
+            proc = MemoryProcess(next(self._pids), name, exe)
+            self.procs[name] = proc
+            return proc
+
+    def stop(self, name):
+        with self._lock:
+            self.procs.pop(name, None)
+
+    def processes(self):
+        with self._lock:
+            procs = list(self.procs.values())
+        return [(proc.name(), proc.exe(), proc) for proc in procs]
+
+    #
+    # Git
+    #
+
+    def add_remote(self, url, branches=None, tags=None):
+        """
+        Add a remote git repository
+
+        If no branches are given, it has a `master` branch with a commit
+        derived from the url.
+        """
+        if branches is None:
+            branches = {
+                'master': hashlib.sha1(url.encode('utf-8')).hexdigest(),
+            }
+        with self._lock:
+            self.remotes[url] = {'branches': branches, 'tags': tags or {}}
+
+    def add_repo(self, path, remote, branch='master', bare=False):
+        """
+        Add a local clone of a remote git repository
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self.makedirs(path if bare else os.path.join(path, '.git'))
+            repo = self.repos[path] = MemoryRepository(remote, bare=bare)
+            repo.fetch(self.remotes[remote])
+            repo.branch = branch
+            repo.head = repo.remote_branches[branch]
+            self.save_repo(path)
+            return repo
+
+    def save_repo(self, path):
+        """
+        Write the HEAD, refs and config of a repository to its `.git` dir
+        """
+        repo = self.repos[path]
+        git_dir = path if repo.bare else os.path.join(path, '.git')
+        with self._lock:
+            if repo.branch:
+                ref = 'refs/heads/{}'.format(repo.branch)
+                self.makedirs(
+                    os.path.dirname(os.path.join(git_dir, ref)), exist_ok=True,
+                )
+                self.write(
+                    os.path.join(git_dir, ref),
+                    '{}\n'.format(repo.head).encode('utf-8'),
+                )
+                head = 'ref: {}\n'.format(ref)
+            else:
+                head = '{}\n'.format(repo.head)
+            self.write(os.path.join(git_dir, 'HEAD'), head.encode('utf-8'))
+
+            packed = [
+                ('refs/remotes/origin/{}'.format(name), commit)
+                for name, commit in repo.remote_branches.items()
+            ] + [
+                ('refs/tags/{}'.format(name), commit)
+                for name, commit in repo.tags.items()
+            ]
+            self.write(os.path.join(git_dir, 'packed-refs'), ''.join(
+                ['# pack-refs with: peeled fully-peeled sorted \n'] + [
+                    '{} {}\n'.format(commit, name)
+                    for name, commit in sorted(packed)
+                ]
+            ).encode('utf-8'))
+
+            self.write(os.path.join(git_dir, 'config'), (
+                '[remote "origin"]\n'
+                '\turl = {}\n'
+                '\tfetch = +refs/heads/*:refs/remotes/origin/*\n'
+            ).format(repo.remote).encode('utf-8'))
+
+    #
+    # Commands
+    #
+
+    def run(self, cmd, stdout, stderr, cd=None, stdin=None, env=None):
+        with self._lock:
+            self.commands.append(list(cmd))
+            if cmd[0].startswith('/etc/init.d/'):
+                handler = self.cmd_service
+            else:
+                name = cmd[0].replace('-', '_')
+                handler = getattr(self, 'cmd_{}'.format(name), None)
+
+            try:
+                if handler is None:
+                    raise CommandFailed(
+                        '{}: command not found'.format(cmd[0]), 127,
+                    )
+                out = handler(cmd, cd or os.getcwd())
+            except CommandFailed as e:
+                stderr.feed('{}\n'.format(e).encode('utf-8'))
+                return e.return_code
+
+        if out:
+            stdout.feed(out.encode('utf-8'))
+        return 0
+
+    def cmd_true(self, cmd, cd):
+        return ''
+
+    def cmd_false(self, cmd, cd):
+        raise CommandFailed('', 1)
+
+    def cmd_echo(self, cmd, cd):
+        return '{}\n'.format(' '.join(cmd[1:]))
+
+    def cmd_apt_get(self, cmd, cd):
+        options, args = parse_options(cmd[1:], [])
+        action, names = args[0], args[1:]
+        if action == 'install':
+            self.packages.update(names)
+        elif action in ('remove', 'purge'):
+            self.packages.difference_update(names)
+        elif action != 'update':
+            raise CommandFailed('E: Invalid operation {}'.format(action), 100)
+        self.save_packages()
+        return ''
+
+    def cmd_dpkg(self, cmd, cd):
+        name = cmd[-1]
+        if cmd[1] != '-s' or name not in self.packages:
+            raise CommandFailed(
+                "dpkg-query: package '{}' is not installed".format(name),
+            )
+        return 'Package: {}\nStatus: install ok installed\n'.format(name)
+
+    def cmd_getent(self, cmd, cd):
+        database, names = cmd[1], cmd[2:]
+        if database == 'passwd':
+            entries = dict(
+                (name, '{}:x:{}:{}:{}:{}:{}'.format(name, *user))
+                for name, user in self.users.items()
+            )
+        elif database == 'group':
+            entries = dict(
+                (name, '{}:x:{}:{}'.format(name, gid, ','.join(members)))
+                for name, (gid, members) in self.groups.items()
+            )
+        else:
+            raise CommandFailed('Unknown database: {}'.format(database))
+
+        if names:
+            missing = [name for name in names if name not in entries]
+            if missing:
+                raise CommandFailed('', 2)
+        else:
+            names = sorted(entries)
+        return ''.join('{}\n'.format(entries[name]) for name in names)
+
+    def cmd_useradd(self, cmd, cd):
+        options, args = parse_options(
+            cmd[1:], ['-u', '-g', '-d', '-s', '-c', '-p'],
+        )
+        name = args[0]
+        if name in self.users:
+            raise CommandFailed(
+                "useradd: user '{}' already exists".format(name), 9,
+            )
+
+        uid = options.get('-u')
+        if uid is None:
+            uid = self.next_id(user[0] for user in self.users.values())
+
+        gid = options.get('-g')
+        if gid is None:
+            used = [group[0] for group in self.groups.values()]
+            gid = self.next_id(used) if int(uid) in used else uid
+            self.add_group(name, gid)
+        elif not str(gid).isdigit():
+            if gid not in self.groups:
+                raise CommandFailed(
+                    "useradd: group '{}' does not exist".format(gid), 6,
+                )
+            gid = self.groups[gid][0]
+
+        home = options.get('-d', '/home/{}'.format(name))
+        if '-m' in options:
+            self.makedirs(home, exist_ok=True)
+
+        self.add_user(
+            name, uid, gid, options.get('-c', ''), home,
+            options.get('-s', '/bin/sh'),
+        )
+        return ''
+
+    def cmd_userdel(self, cmd, cd):
+        name = cmd[-1]
+        if name not in self.users:
+            raise CommandFailed(
+                "userdel: user '{}' does not exist".format(name), 6,
+            )
+        del self.users[name]
+        for gid, members in self.groups.values():
+            if name in members:
+                members.remove(name)
+        self.save_users()
+        self.save_groups()
+        return ''
+
+    cmd_deluser = cmd_userdel
+
+    def cmd_addgroup(self, cmd, cd):
+        options, args = parse_options(cmd[1:], ['--gid', '-g'])
+        name = args[0]
+        if name in self.groups:
+            raise CommandFailed(
+                "addgroup: The group `{}' already exists.".format(name),
+            )
+        gid = options.get('--gid', options.get('-g'))
+        if gid is not None and any(
+            group[0] == int(gid) for group in self.groups.values()
+        ):
+            raise CommandFailed(
+                'addgroup: The GID `{}\' is already in use.'.format(gid),
+            )
+        self.add_group(name, gid)
+        return ''
+
+    cmd_groupadd = cmd_addgroup
+
+    def cmd_delgroup(self, cmd, cd):
+        name = cmd[-1]
+        if name not in self.groups:
+            raise CommandFailed(
+                "delgroup: The group `{}' does not exist.".format(name),
+            )
+        del self.groups[name]
+        self.save_groups()
+        return ''
+
+    cmd_groupdel = cmd_delgroup
+
+    def cmd_service(self, cmd, cd):
+        name = os.path.basename(cmd[0])
+        action = cmd[1]
+        running = name in self.procs
+        if action == 'start':
+            if not running:
+                self.start(name)
+        elif action == 'stop':
+            self.stop(name)
+        elif action in ('restart', 'force-reload'):
+            self.start(name)
+        elif action == 'status':
+            if not running:
+                raise CommandFailed('{} is not running'.format(name), 3)
+        elif action != 'reload':
+            raise CommandFailed(
+                'Usage: {} {{start|stop|restart|reload|force-reload|status}}'
+                .format(cmd[0]),
+            )
+        return ''
+
+    def cmd_git(self, cmd, cd):
+        action, args = cmd[1].rstrip(';'), cmd[2:]
+        if action == 'clone':
+            return self.git_clone(args, cd)
+
+        path = os.path.abspath(cd)
+        if path not in self.repos:
+            raise CommandFailed(
+                'fatal: not a git repository: {}'.format(cd), 128,
+            )
+        output = self.git_action(self.repos[path], action, args)
+        self.save_repo(path)
+        if action == 'fetch':
+            self.write(os.path.join(path, '.git', 'FETCH_HEAD'), b'')
+        return output
+
+    def git_action(self, repo, action, args):
+        if action == 'remote':
+            if args[0] == '--verbose':
+                return 'origin\t{0} (fetch)\norigin\t{0} (push)\n'.format(
+                    repo.remote,
+                )
+            if args[0] == 'set-url':
+                repo.remote = args[2]
+                return ''
+            if args[0] == 'update':
+                return self.git_action(repo, 'fetch', args[1:])
+
+        elif action == 'fetch':
+            if repo.remote not in self.remotes:
+                raise CommandFailed(
+                    "fatal: repository '{}' not found".format(repo.remote),
+                    128,
+                )
+            repo.fetch(self.remotes[repo.remote])
+            return ''
+
+        elif action == 'rev-parse':
+            return '{}\n'.format(repo.head)
+
+        elif action in ('show-ref', 'rev-list'):
+            ref = args[-1]
+            refs = {}
+            refs.update(
+                ('refs/remotes/origin/{}'.format(name), commit)
+                for name, commit in repo.remote_branches.items()
+            )
+            refs.update(
+                ('refs/tags/{}'.format(name), commit)
+                for name, commit in repo.tags.items()
+            )
+            if repo.branch:
+                refs['refs/heads/{}'.format(repo.branch)] = repo.head
+            if ref not in refs:
+                raise CommandFailed(
+                    "fatal: '{}' - not a valid ref".format(ref), 128,
+                )
+            return '{}\n'.format(refs[ref])
+
+        elif action == 'checkout':
+            target = args[0]
+            if target in repo.remote_branches:
+                repo.branch = target
+                repo.head = repo.remote_branches[target]
+            else:
+                repo.branch = None
+                repo.head = target
+            return ''
+
+        elif action == 'pull':
+            if repo.branch:
+                repo.head = repo.remote_branches[repo.branch]
+            return ''
+
+        elif action == 'status':
+            return 'On branch {}\nnothing to commit\n'.format(
+                repo.branch or '(detached)',
+            )
+
+        raise CommandFailed(
+            "git: '{}' is not simulated".format(action), 1,
+        )
+
+    def git_clone(self, args, cd):
+        options, args = parse_options(args, ['--reference'])
+        remote, path = args[0], os.path.join(cd, args[1])
+        if remote not in self.remotes:
+            raise CommandFailed(
+                "fatal: repository '{}' not found".format(remote), 128,
+            )
+        if self.exists(path):
+            raise CommandFailed(
+                "fatal: destination path '{}' already exists".format(args[1]),
+                128,
+            )
+        reference = options.get('--reference')
+        if reference and os.path.abspath(reference) not in self.repos:
+            raise CommandFailed(
+                "fatal: reference repository '{}' is not a local repository"
+                .format(reference), 128,
+            )
+        repo = self.add_repo(path, remote, bare='--mirror' in options)
+        if '--dissociate' not in options:
+            repo.reference = reference
+        return "Cloning into '{}'...\ndone.\n".format(args[1])
@@ -0,0 +1,95 @@
+"""
+Shared Jinja environment for rendering templates
+"""
+import hashlib
+import os
+import threading
+
+from jinja2 import (
+    BaseLoader, Environment, FileSystemBytecodeCache, TemplateNotFound,
+)
+
+from .config import settings
+
+
+class DigestLoader(BaseLoader):
+    """
+    Loader for template sources named by the digest of their content
+
+    Because the name is the digest, identical sources share one compiled
+    template, and a source can never change under its name.
+
+    A source is only held while it is being compiled, so memory is bounded
+    by the environment's `cache_size` of compiled templates.
+    """
+    def __init__(self):
+        # Source being loaded by the current thread, as {name: source}
+        self._loading = threading.local()
+
+    def load_source(self, environment, source):
+        """
+        Return the compiled template for the source
+        """
+        raw = source if isinstance(source, bytes) else source.encode('utf-8')
+        name = hashlib.sha1(raw).hexdigest()
+        self._loading.sources = {name: source}
+        try:
+            return environment.get_template(name)
+        finally:
+            self._loading.sources = None
+
+    def get_source(self, environment, template):
+        sources = getattr(self._loading, 'sources', None) or {}
+        if template not in sources:
+            raise TemplateNotFound(template)
+        return sources[template], None, lambda: True
+
+
+_environment = None
+_environment_key = None
+_lock = threading.Lock()
+
+
+def get_environment():
+    """
+    Return the shared Jinja environment, creating it if the template cache
+    settings have changed
+    """
+    global _environment, _environment_key
+
+    key = (
+        settings.sermin.template_cache_size,
+        settings.sermin.template_cache,
+    )
+    with _lock:
+        if _environment is None or key != _environment_key:
+            cache_size, cache_path = key
+            bytecode_cache = None
+            if cache_path:
+                cache_path = os.path.expanduser(cache_path)
+                if not os.path.isdir(cache_path):
+                    os.makedirs(cache_path)
+                bytecode_cache = FileSystemBytecodeCache(cache_path)
+
+            _environment = Environment(
+                loader=DigestLoader(),
+                cache_size=cache_size,
+                bytecode_cache=bytecode_cache,
+            )
+            _environment_key = key
+        return _environment
+
+
+def get_template(source):
+    """
+    Return a compiled template for the source string
+    """
+    environment = get_environment()
+    return environment.loader.load_source(environment, source)
+
+
+def render(source, context):
+    """
+    Render the source string as a template with the context dict
+    """
+    return get_template(source).render(**context)
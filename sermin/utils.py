@@ -1,21 +1,44 @@
 """
 Util functions
 """
+import atexit
+from collections import deque
+import io
 import os
+import select
 import shlex
+import shutil
 from subprocess import Popen, PIPE
+import tempfile
+import threading
+import uuid
 
 from six import string_types
+from six.moves import shlex_quote
 
+from .config import settings
 from .exceptions import ShellError
-from . import report
+from . import aio, profile, report, system
 
 
 class ShellOutput(str):
+    """
+    Output of a shell command
+
+    The value is the stripped stdout and stderr, joined by a newline. The
+    `stdout` and `stderr` attributes are slices of the value, so only one
+    copy of the output is kept.
+
+    If the output was streamed, the value is the last lines of each, and
+    `stdout_file` and `stderr_file` are file objects with the full output.
+    """
+    stdout_file = None
+    stderr_file = None
+
     def __new__(cls, stdout, stderr):
-        # Store raw
-        stdout = stdout.strip() if stdout else ''
-        stderr = stderr.strip() if stderr else ''
+        # Store raw, decoded from the bytes returned on Python 3
+        stdout = cls.decode(stdout).strip() if stdout else ''
+        stderr = cls.decode(stderr).strip() if stderr else ''
 
         # Join stdout and stderr
         value = stdout
@@ -25,17 +48,329 @@ class ShellOutput(str):
             value += stderr
 
         self = super(ShellOutput, cls).__new__(cls, value)
-        self.stdout = stdout
-        self.stderr = stderr
+        self._stdout_len = len(stdout)
         return self
 
+    @staticmethod
+    def decode(value):
+        if not isinstance(value, str):
+            value = value.decode('utf-8', 'replace')
+        return value
+
+    @property
+    def stdout(self):
+        return str(self[:self._stdout_len])
+
+    @property
+    def stderr(self):
+        # Skip the joining newline
+        start = self._stdout_len
+        if start:
+            start += 1
+        return str(self[start:])
+
+
+class OutputCapture(object):
+    """
+    Collect a stream of command output in memory
+    """
+    # If True, the backend should feed output as it arrives
+    stream = False
+
+    # File containing the full output, if kept
+    file = None
+
+    def __init__(self):
+        self.chunks = []
+
+    def feed(self, data):
+        self.chunks.append(data)
+
+    def close(self):
+        pass
+
+    @property
+    def value(self):
+        return b''.join(self.chunks)
+
+
+class StreamCapture(OutputCapture):
+    """
+    Capture a stream of command output as it arrives, with bounded memory
+
+    Each line is reported as it arrives. The last `tail` lines are kept in
+    memory for the value, and the full output is written to a spooled
+    temporary file, which moves from memory to disk once it is larger than
+    `spool_size` bytes.
+    """
+    stream = True
+
+    def __init__(self, tail, spool_size):
+        self.lines = deque(maxlen=tail)
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self._partial = b''
+
+    def feed(self, data):
+        self.file.write(data)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self.add_line(line)
+
+    def close(self):
+        if self._partial:
+            self.add_line(self._partial)
+            self._partial = b''
+        self.file.seek(0)
+
+    def add_line(self, line):
+        self.lines.append(line)
+        if not isinstance(line, str):
+            line = line.decode('utf-8', 'replace')
+        report.info(line, label='shell')
+
+    @property
+    def value(self):
+        return b'\n'.join(self.lines)
+
 
-def shell(cmd, cd=None, stdin=None, expect_errors=False):
+class PopenBackend(object):
+    """
+    Shell backend which starts a new process for each command
+    """
+    def run(self, cmd, stdout, stderr, cd=None, stdin=None, env=None):
+        """
+        Run the command (a list of arguments), feed its output to the
+        stdout and stderr captures, and return the return code
+        """
+        if env:
+            env = dict(os.environ, **env)
+        process = Popen(
+            cmd, shell=False, stdout=PIPE, stderr=PIPE, stdin=PIPE,
+            cwd=cd, env=env,
+        )
+
+        if not (stdout.stream or stderr.stream):
+            out, err = process.communicate(stdin)
+            stdout.feed(out)
+            stderr.feed(err)
+            return process.returncode
+
+        # Read each pipe in its own thread so neither can fill and block
+        def read(pipe, capture):
+            for data in iter(lambda: os.read(pipe.fileno(), 65536), b''):
+                capture.feed(data)
+            pipe.close()
+
+        readers = [
+            threading.Thread(target=read, args=(process.stdout, stdout)),
+            threading.Thread(target=read, args=(process.stderr, stderr)),
+        ]
+        for reader in readers:
+            reader.start()
+        if stdin:
+            process.stdin.write(stdin)
+        process.stdin.close()
+        for reader in readers:
+            reader.join()
+        return process.wait()
+
+
+class Coprocess(object):
+    """
+    A long-lived `/bin/sh` which runs one command at a time
+
+    The shell is started on first use, and each command is written to it as
+    a line which runs the command in a subshell with its input and output
+    redirected to temporary files, then writes a unique marker line with the
+    exit code.
+    """
+    # Seconds between checks for new output when streaming
+    poll_interval = 0.1
+
+    def __init__(self, shell='/bin/sh'):
+        self.shell = shell
+        self.process = None
+        self.temp_dir = None
+
+    def start(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='sermin-shell-')
+        self.process = Popen(
+            [self.shell], shell=False, stdin=PIPE, stdout=PIPE,
+        )
+
+    def stop(self):
+        if self.process:
+            try:
+                self.process.stdin.close()
+                self.process.wait()
+            except (IOError, OSError):
+                pass
+            self.process = None
+        if self.temp_dir:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+
+    def run(self, cmd, stdout, stderr, cd=None, stdin=None, env=None):
+        """
+        Run the command (a list of arguments), feed its output to the
+        stdout and stderr captures, and return the return code
+
+        Must not be called again until the command has finished.
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.stop()
+            self.start()
+
+        paths = {
+            name: os.path.join(self.temp_dir, name)
+            for name in ('stdin', 'stdout', 'stderr')
+        }
+        with io.open(paths['stdin'], 'wb') as file:
+            if stdin:
+                file.write(stdin)
+
+        # Create the output files now so they can be read while streaming
+        for name in ('stdout', 'stderr'):
+            io.open(paths[name], 'wb').close()
+
+        marker = 'sermin-{}'.format(uuid.uuid4().hex)
+        line = '({cd}{env}exec {cmd}) <{stdin} >{stdout} 2>{stderr}; ' \
+            'echo "{marker} $?"\n'.format(
+                cd='cd {} && '.format(shlex_quote(cd)) if cd else '',
+                env=''.join(
+                    'export {}={} && '.format(key, shlex_quote(value))
+                    for key, value in (env or {}).items()
+                ),
+                cmd=' '.join(shlex_quote(arg) for arg in cmd),
+                marker=marker,
+                **{
+                    name: shlex_quote(path)
+                    for name, path in paths.items()
+                }
+            )
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        self.process.stdin.write(line)
+        self.process.stdin.flush()
+
+        # Wait for the marker, streaming output from the files if needed
+        marker = marker.encode('ascii')
+        captures = [(paths['stdout'], stdout), (paths['stderr'], stderr)]
+        files = [
+            (io.open(path, 'rb'), capture)
+            for path, capture in captures
+        ]
+        try:
+            while True:
+                if stdout.stream or stderr.stream:
+                    ready, _, _ = select.select(
+                        [self.process.stdout], [], [], self.poll_interval,
+                    )
+                    for file, capture in files:
+                        if capture.stream:
+                            self.feed(file, capture)
+                    if not ready:
+                        continue
+
+                response = self.process.stdout.readline()
+                if not response:
+                    self.stop()
+                    raise ShellError(
+                        'Shell coprocess exited unexpectedly',
+                    )
+                if response.startswith(marker):
+                    return_code = int(response.split()[1])
+                    break
+
+            for file, capture in files:
+                self.feed(file, capture)
+        finally:
+            for file, capture in files:
+                file.close()
+        return return_code
+
+    def feed(self, file, capture):
+        """
+        Feed any new output in the file to the capture
+        """
+        for data in iter(lambda: file.read(65536), b''):
+            capture.feed(data)
+
+
+class CoprocessBackend(object):
+    """
+    Shell backend which runs commands through long-lived `/bin/sh`
+    coprocesses
+
+    This means the Sermin process is only forked once for each coprocess,
+    however many commands are run. Each coprocess runs one command at a
+    time; commands which run at the same time, such as from parallel checks,
+    take an idle coprocess from the pool or start a new one, so the pool
+    grows to the number of commands which have run at once.
+    """
+    def __init__(self, shell='/bin/sh'):
+        self.shell = shell
+        self.coprocesses = []
+        self.idle = []
+        self._lock = threading.Lock()
+
+    def run(self, cmd, stdout, stderr, cd=None, stdin=None, env=None):
+        """
+        Run the command on an idle coprocess - see `Coprocess.run`
+        """
+        with self._lock:
+            if self.idle:
+                coprocess = self.idle.pop()
+            else:
+                coprocess = Coprocess(self.shell)
+                self.coprocesses.append(coprocess)
+        try:
+            return coprocess.run(
+                cmd, stdout, stderr, cd=cd, stdin=stdin, env=env,
+            )
+        finally:
+            with self._lock:
+                self.idle.append(coprocess)
+
+    def stop(self):
+        """
+        Stop all coprocesses
+        """
+        with self._lock:
+            for coprocess in self.coprocesses:
+                coprocess.stop()
+
+
+backends = {
+    'popen': PopenBackend(),
+    'coprocess': CoprocessBackend(),
+}
+atexit.register(backends['coprocess'].stop)
+
+
+def shell(
+    cmd, cd=None, stdin=None, expect_errors=False, env=None, stream=False,
+):
     """
     Perform a shell command
 
+    The command is run on the system named in the `system` setting; on the
+    local system it uses the backend named in the `shell_backend` setting.
+    The working directory of the Sermin process is not changed, so
+    this is safe to call from multiple threads.
+
     Arguments:
         cmd     Shell command to execute
+        cd      Optional working directory for the command
+        stdin   Optional input for the command
+        expect_errors
+                If False, raise a ShellError if the command returns non-zero
+        env     Optional dict of environment variables to add to the
+                environment for the command
+        stream  If True, report output as it arrives, and only keep the last
+                lines in memory - see `ShellOutput`. Use for commands which
+                produce a lot of output, or take a long time.
 
     Returns
         out     Output string
@@ -43,32 +378,100 @@ def shell(cmd, cd=None, stdin=None, expect_errors=False):
         out.stderr      The stderr
         out.return_code The return code
     """
+    cmd, cmd_display = prepare_cmd(cmd, cd)
+    if stream:
+        stdout, stderr = [
+            StreamCapture(
+                tail=settings.sermin.shell_tail,
+                spool_size=settings.sermin.shell_spool,
+            ) for i in range(2)
+        ]
+    else:
+        stdout, stderr = OutputCapture(), OutputCapture()
+
+    return_code = system.get().run(
+        cmd, stdout, stderr, cd=cd, stdin=stdin, env=env,
+    )
+    stdout.close()
+    stderr.close()
+
+    out = ShellOutput(stdout.value, stderr.value)
+    out.stdout_file = stdout.file
+    out.stderr_file = stderr.file
+    return finish_cmd(
+        out, cmd, cmd_display, return_code, expect_errors,
+        report_out=not stream,
+    )
+
+
+def ashell(cmd, cd=None, stdin=None, expect_errors=False, env=None):
+    """
+    Perform a shell command using an asyncio subprocess
+
+    Takes the same arguments as `shell`, except for `stream`, and returns a
+    future for its output. On the local system the command is always run as
+    a new process, whatever the `shell_backend` setting; on other systems it
+    is passed to `shell` in a worker thread.
+
+    Must be called while the asyncio event loop is running.
+    """
+    aio.require()
+    if not system.get().local:
+        return aio.to_thread(shell, cmd, cd, stdin, expect_errors, env)
+
+    cmd, cmd_display = prepare_cmd(cmd, cd)
+    if env:
+        env = dict(os.environ, **env)
+
+    process = aio.asyncio.create_subprocess_exec(
+        *cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE, cwd=cd, env=env
+    )
+
+    def started(process):
+        return aio.then(
+            process.communicate(stdin),
+            lambda output: finish_cmd(
+                ShellOutput(*output), cmd, cmd_display, process.returncode,
+                expect_errors,
+            ),
+        )
+
+    return aio.then(process, started)
+
+
+def prepare_cmd(cmd, cd):
+    """
+    Report the command and convert it to a list of arguments
+
+    Returns a tuple of `(cmd, cmd_display)`
+    """
     cmd_display = cmd
     if not isinstance(cmd, string_types):
-        cmd = map(str, cmd)
+        cmd = [str(arg) for arg in cmd]
         cmd_display = ' '.join(cmd)
 
     if isinstance(cmd, string_types):
         cmd = shlex.split(cmd)
 
-    old_dir = os.getcwd()
     if cd:
-        report.info('$ cd {}'.format(cd))
-        os.chdir(cd)
+        report.info('$ cd {}', cd)
 
-    report.info('$ {}'.format(cmd_display), label='shell')
-    process = Popen(cmd, shell=False, stdout=PIPE, stderr=PIPE, stdin=PIPE)
-    if stdin:
-        process.stdin.write(stdin)
-    stdout, stderr = process.communicate()
+    report.info('$ {}', cmd_display, label='shell')
+    profile.count_shell()
+    return cmd, cmd_display
 
-    out = ShellOutput(stdout, stderr)
-    out.cmd = cmd
-    out.return_code = process.returncode
-    report.info(out, label='shell')
 
-    if cd:
-        os.chdir(old_dir)
+def finish_cmd(
+    out, cmd, cmd_display, return_code, expect_errors, report_out=True,
+):
+    """
+    Report the output of a command, and raise a ShellError if it failed
+    unexpectedly
+    """
+    out.cmd = cmd
+    out.return_code = return_code
+    if report_out:
+        report.info(out, label='shell')
 
     if not expect_errors and out.return_code != 0:
         msg = 'Unexpected return code {code} from {cmd}: {out}'
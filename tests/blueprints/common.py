@@ -0,0 +1,7 @@
+"""
+Definitions shared by test blueprints
+"""
+from sermin import Command
+
+
+Command('echo common')
@@ -0,0 +1,9 @@
+"""
+Blueprint used to test loading blueprints which import other modules
+"""
+from sermin import Command
+
+from . import common  # NOQA
+
+
+Command('echo host')
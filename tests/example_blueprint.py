@@ -0,0 +1,8 @@
+"""
+Blueprint used to test loading blueprints
+"""
+from sermin import Command
+from sermin.config import settings
+
+
+Command('echo {}'.format(settings.sermin.source))
@@ -1,7 +1,11 @@
 """
 Test Sermin config module
 """
-from sermin.config.module import Registry, Namespace, Setting, settings
+import threading
+
+from sermin.config.module import (
+    Registry, Namespace, Scope, Setting, settings,
+)
 from sermin.config.utils import parse_args
 
 from .utils import SafeTestCase
@@ -61,6 +65,73 @@ class SettingsTest(SafeTestCase):
         self.assertFalse(settings.test.setting)
 
 
+class ScopeTest(SafeTestCase):
+    def setUp(self):
+        self.old_settings = settings._namespaces
+        settings._clear()
+        settings.test = 'Test settings'
+        settings.test.setting = Setting('Test setting', default='global')
+
+    def tearDown(self):
+        settings.__dict__['_namespaces'] = self.old_settings
+
+    def test_scope_overrides_global(self):
+        scope = Scope()
+        with scope.activate():
+            self.assertEqual(settings.test.setting, 'global')
+            settings.test.setting = 'scoped'
+            self.assertEqual(settings.test.setting, 'scoped')
+        self.assertEqual(settings.test.setting, 'global')
+
+        with scope.activate():
+            self.assertEqual(settings.test.setting, 'scoped')
+
+    def test_scope_is_local_to_thread(self):
+        seen = []
+
+        def read():
+            seen.append(settings.test.setting)
+
+        with Scope().activate():
+            settings.test.setting = 'scoped'
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, ['global'])
+
+    def test_watchers_not_called_in_scope(self):
+        values = []
+        settings.test._watch('setting', values.append)
+        with Scope().activate():
+            settings.test.setting = 'scoped'
+        self.assertEqual(settings.test.setting, 'global')
+        settings.test.setting = 'changed'
+        self.assertEqual(values, ['global', 'changed'])
+
+    def test_derived_cached_until_set(self):
+        calls = []
+
+        def derive(value):
+            calls.append(value)
+            return value.upper()
+
+        setting = settings.test._setting('setting')
+        self.assertEqual(setting.derive('upper', derive), 'GLOBAL')
+        self.assertEqual(setting.derive('upper', derive), 'GLOBAL')
+        scope = Scope()
+        with scope.activate():
+            # Uses the global value until set in the scope
+            self.assertEqual(setting.derive('upper', derive), 'GLOBAL')
+            settings.test.setting = 'scoped'
+            self.assertEqual(setting.derive('upper', derive), 'SCOPED')
+            self.assertEqual(setting.derive('upper', derive), 'SCOPED')
+        settings.test.setting = 'changed'
+        self.assertEqual(setting.derive('upper', derive), 'CHANGED')
+        with scope.activate():
+            self.assertEqual(setting.derive('upper', derive), 'SCOPED')
+        self.assertEqual(calls, ['global', 'scoped', 'changed'])
+
+
 class ParseArgsTest(SafeTestCase):
     def test_empty(self):
         unnamed, named = parse_args('')
@@ -68,3 +139,8 @@ class ParseArgsTest(SafeTestCase):
         self.assertIsInstance(named, dict)
         self.assertEqual(len(unnamed), 0)
         self.assertEqual(len(named), 0)
+
+    def test_dashes_converted(self):
+        unnamed, named = parse_args(['--no-fact-cache', '--myapp:my-arg=1'])
+        self.assertEqual(named['sermin'], {'fact_cache': False})
+        self.assertEqual(named['myapp'], {'my_arg': '1'})
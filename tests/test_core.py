@@ -0,0 +1,128 @@
+"""
+Test Sermin core module
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+from sermin import report, run, state
+from sermin.config import settings
+from sermin.core import Sermin
+from sermin.state.base.registry import registry
+from sermin.state.core import identity
+
+from .utils import SafeTestCase
+
+
+class MeetingState(state.State):
+    """
+    State which waits in its check until the other instance's state has
+    started checking, so both runs are in progress at once
+    """
+    def __init__(self, name, arrived, other):
+        super(MeetingState, self).__init__()
+        self.name = name
+        self.arrived = arrived
+        self.other = other
+        self.seen = None
+
+    def __str__(self):
+        return self.name
+
+    def check(self):
+        self.arrived.set()
+        self.other.wait(10)
+        self.seen = (run.current(), identity.get_batch())
+        self.report.warning('warning from {}', self.name)
+        self.report.error('error from {}', self.name)
+        return True
+
+
+class SerminTest(SafeTestCase):
+    def test_blueprint_loaded_into_own_registry(self):
+        sermin = Sermin('tests.example_blueprint')
+        self.assertEqual(len(sermin.registry), 1)
+        self.assertEqual(len(registry), 0)
+
+    def test_settings_scoped_to_instance(self):
+        sermin = Sermin('tests.example_blueprint', sermin={'source': 'one'})
+        self.assertEqual(settings.sermin.source, None)
+        self.assertEqual(sermin.registry.states[0].command, 'echo one')
+
+    def test_imported_modules_run_for_each_instance(self):
+        for i in range(2):
+            sermin = Sermin('tests.blueprints.host')
+            self.assertEqual(
+                [state.command for state in sermin.registry.states],
+                ['echo common', 'echo host'],
+            )
+
+    def test_concurrent_blueprints(self):
+        instances = {}
+
+        def load(name):
+            instances[name] = Sermin(
+                'tests.example_blueprint', sermin={'source': name},
+            )
+            instances[name].run()
+
+        threads = [
+            threading.Thread(target=load, args=(name,))
+            for name in ['one', 'two', 'three']
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for name, sermin in instances.items():
+            states = sermin.registry.states
+            self.assertEqual(len(states), 1)
+            self.assertEqual(states[0].command, 'echo {}'.format(name))
+            self.assertTrue(states[0]._is)
+
+    def test_concurrent_runs_separate(self):
+        dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir)
+        self.addCleanup(report.pipeline.reset_sinks)
+        events = {'one': threading.Event(), 'two': threading.Event()}
+        verbosity = {'one': 'warning', 'two': 'error'}
+        instances = {}
+        for name, other in [('one', 'two'), ('two', 'one')]:
+            instances[name] = Sermin('tests.example_blueprint', sermin={
+                'verbosity': verbosity[name],
+                'report_log': os.path.join(dir, name),
+            })
+            with instances[name].context():
+                MeetingState(name, events[name], events[other])
+
+        threads = [
+            threading.Thread(target=sermin.run)
+            for sermin in instances.values()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Each run has its own run values
+        one, two = [
+            instances[name].registry.states[1].seen for name in ['one', 'two']
+        ]
+        self.assertNotEqual(one[0].id, two[0].id)
+        self.assertIsNot(one[1], two[1])
+
+        # Each run reports with its own settings
+        report.flush()
+        logs = {}
+        for name in ['one', 'two']:
+            with open(os.path.join(dir, name)) as file:
+                logs[name] = [line.split(' ', 2)[2] for line in file]
+        self.assertEqual(logs, {
+            'one': [
+                'WARNING [MeetingState: one] warning from one\n',
+                'ERROR [MeetingState: one] error from one\n',
+            ],
+            'two': ['ERROR [MeetingState: two] error from two\n'],
+        })
@@ -0,0 +1,96 @@
+"""
+Test Sermin facts module
+"""
+import os
+import tempfile
+
+from sermin import run
+from sermin.facts import Fact
+
+from .utils import SafeTestCase, with_settings
+
+
+class LineCountFact(Fact):
+    """
+    Count lines in a file, and how many times the fact is computed
+    """
+    name = 'test-line-count'
+    computed = 0
+
+    def compute(self):
+        LineCountFact.computed += 1
+        with open(self.paths[0]) as file:
+            return len(file.readlines())
+
+
+class FactTest(SafeTestCase):
+    def setUp(self):
+        super(FactTest, self).setUp()
+        LineCountFact.computed = 0
+        handle, self.path = tempfile.mkstemp()
+        os.write(handle, b'one\n')
+        os.close(handle)
+
+    def tearDown(self):
+        super(FactTest, self).tearDown()
+        os.remove(self.path)
+
+    def test_computed_once(self):
+        fact = LineCountFact(self.path)
+        self.assertEqual(fact.get(), 1)
+        self.assertEqual(fact.get(), 1)
+        self.assertEqual(LineCountFact.computed, 1)
+
+    def test_recomputed_on_change(self):
+        fact = LineCountFact(self.path)
+        self.assertEqual(fact.get(), 1)
+        with open(self.path, 'a') as file:
+            file.write('two\n')
+        self.assertEqual(fact.get(), 2)
+        self.assertEqual(LineCountFact.computed, 2)
+
+    def test_loaded_from_cache(self):
+        # A new instance is the same as a new run
+        self.assertEqual(LineCountFact(self.path).get(), 1)
+        self.assertEqual(LineCountFact(self.path).get(), 1)
+        self.assertEqual(LineCountFact.computed, 1)
+
+    @with_settings(sermin__fact_cache=False)
+    def test_cache_disabled(self):
+        self.assertEqual(LineCountFact(self.path).get(), 1)
+        self.assertEqual(LineCountFact(self.path).get(), 1)
+        self.assertEqual(LineCountFact.computed, 2)
+
+    def test_per_run__checked_once_per_run(self):
+        fact = LineCountFact(self.path)
+        fact.per_run = True
+        with run.start():
+            self.assertEqual(fact.get(), 1)
+            with open(self.path, 'a') as file:
+                file.write('two\n')
+            self.assertEqual(fact.get(), 1)
+
+            # Seen after invalidating, or in the next run
+            fact.invalidate()
+            self.assertEqual(fact.get(), 2)
+            with open(self.path, 'a') as file:
+                file.write('three\n')
+        with run.start():
+            self.assertEqual(fact.get(), 3)
+
+    def test_lookup__remembered_until_changed(self):
+        fact = LineCountFact(self.path)
+        looked_up = []
+
+        def lookup(key):
+            looked_up.append(key)
+            return None
+
+        self.assertEqual(fact.lookup('missing', lookup), None)
+        self.assertEqual(fact.lookup('missing', lookup), None)
+        self.assertEqual(looked_up, ['missing'])
+
+        with open(self.path, 'a') as file:
+            file.write('two\n')
+        fact.lookup('missing', lookup)
+        self.assertEqual(looked_up, ['missing', 'missing'])
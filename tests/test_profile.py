@@ -0,0 +1,113 @@
+"""
+Test Sermin profile module
+"""
+import json
+import os
+
+from sermin import profile, run, state
+from sermin.config import settings
+from sermin.state.base.registry import registry
+from sermin.utils import shell
+
+from .utils import SafeTestCase, with_settings
+
+
+class ShellState(state.State):
+    """
+    State which runs shell commands in its check
+    """
+    def __init__(self, name, commands=1):
+        super(ShellState, self).__init__()
+        self.name = name
+        self.commands = commands
+
+    def __str__(self):
+        return self.name
+
+    def check(self):
+        for i in range(self.commands):
+            shell('true')
+        return True
+
+
+class ParentState(ShellState):
+    child = ShellState('child', commands=2)
+
+
+class DisabledProfileTest(SafeTestCase):
+    def test_no_profiler(self):
+        ShellState('first')
+        registry.run()
+        self.assertNotIn(profile.Profiler, run.current().values)
+
+
+class ProfileTest(SafeTestCase):
+    def setUp(self):
+        super(ProfileTest, self).setUp()
+        self.path = os.path.join(self.cache, 'profile.json')
+        self.old_profile = settings.sermin.profile
+        settings.sermin.profile = self.path
+
+    def tearDown(self):
+        super(ProfileTest, self).tearDown()
+        settings.sermin.profile = self.old_profile
+
+    def load(self):
+        with open(self.path) as file:
+            return json.load(file)
+
+    def test_summary(self):
+        ShellState('first', commands=1)
+        ShellState('second', commands=3)
+        registry.run()
+
+        profile = self.load()
+        checks = profile['classes']['ShellState']['check']
+        self.assertEqual(checks['count'], 2)
+        self.assertEqual(checks['shells'], 4)
+        self.assertEqual(
+            sorted(
+                (obj['state'], obj['shells']) for obj in profile['states']
+            ),
+            [('first', 1), ('second', 3)],
+        )
+
+    def test_children_counted_separately(self):
+        ParentState('parent', commands=1)
+        registry.run()
+
+        states = {obj['state']: obj for obj in self.load()['states']}
+        self.assertEqual(states['parent']['shells'], 1)
+        self.assertEqual(states['child']['shells'], 2)
+        self.assertLessEqual(
+            states['parent']['self'], states['parent']['duration'],
+        )
+
+    def test_shared_child_counted_once(self):
+        class SharedParentState(ShellState):
+            child = ShellState('shared', commands=2)
+
+        SharedParentState('one')
+        SharedParentState('two')
+        registry.run()
+
+        profile = self.load()
+        self.assertEqual(profile['classes']['ShellState']['check']['count'], 1)
+        states = {obj['state']: obj for obj in profile['states']}
+        self.assertEqual(states['shared']['shells'], 2)
+
+    def test_met_states_not_applied(self):
+        ShellState('first')
+        registry.run()
+        self.assertNotIn('apply', self.load()['classes']['ShellState'])
+
+    @with_settings(sermin__profile_format='trace')
+    def test_trace(self):
+        ShellState('first')
+        registry.run()
+
+        events = self.load()['traceEvents']
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['cat'], 'check')
+        self.assertEqual(events[0]['ph'], 'X')
+        self.assertEqual(events[0]['name'], 'ShellState: first')
@@ -0,0 +1,149 @@
+"""
+Test Sermin report module
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from six import StringIO
+
+from sermin import report
+from sermin.config import Scope, settings
+
+from .utils import with_settings
+
+
+class FormatCounter(object):
+    """
+    Count how many times this is formatted
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __format__(self, spec):
+        self.count += 1
+        return 'counted'
+
+
+class ReportTestMixin(object):
+    sink_class = report.TextSink
+
+    def setUp(self):
+        super(ReportTestMixin, self).setUp()
+        self.stream = StringIO()
+        self.sink = self.sink_class(self.stream)
+        report.pipeline.add_sink(self.sink)
+
+    def tearDown(self):
+        super(ReportTestMixin, self).tearDown()
+        report.pipeline.remove_sink(self.sink)
+
+    def get_output(self):
+        report.flush()
+        return self.stream.getvalue()
+
+
+class ReportTest(ReportTestMixin, unittest.TestCase):
+    def test_lines_labelled(self):
+        report.Report('test').info('one\ntwo')
+        self.assertEqual(self.get_output(), '[test] one\n[test] two\n')
+
+    def test_args_formatted(self):
+        report.info('{} and {name}', 'one', name='two', label='test')
+        self.assertEqual(self.get_output(), '[test] one and two\n')
+
+    @with_settings(sermin__verbosity='info')
+    def test_args_not_formatted_below_threshold(self):
+        counter = FormatCounter()
+        report.debug('{}', counter)
+        report.info('{}', counter)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(self.get_output(), '[-] counted\n')
+
+    def test_threshold_follows_setting(self):
+        settings.sermin.verbosity = 'error'
+        try:
+            report.warning('hidden')
+            report.error('shown')
+        finally:
+            settings.sermin.verbosity = 'debug'
+        report.debug('shown')
+        self.assertEqual(self.get_output(), '[-] shown\n[-] shown\n')
+
+    def test_threshold_follows_scope(self):
+        with Scope().activate():
+            settings.sermin.verbosity = 'error'
+            report.warning('hidden')
+            report.error('shown')
+        report.debug('shown')
+        self.assertEqual(self.get_output(), '[-] shown\n[-] shown\n')
+
+    def test_lazy_label(self):
+        calls = []
+
+        def label():
+            calls.append(True)
+            return 'lazy'
+
+        reporter = report.Report(label)
+        self.assertEqual(calls, [])
+        reporter.info('one')
+        reporter.info('two')
+        self.assertEqual(calls, [True])
+        self.assertEqual(self.get_output(), '[lazy] one\n[lazy] two\n')
+
+    def test_buffered(self):
+        self.sink.flush_interval = 60
+        self.sink.flush()
+        report.info('buffered')
+        self.assertEqual(self.stream.getvalue(), '')
+        self.assertEqual(self.get_output(), '[-] buffered\n')
+
+    def test_flushed_without_further_messages(self):
+        self.sink.flush()
+        report.info('waiting')
+        for i in range(100):
+            if self.stream.getvalue():
+                break
+            time.sleep(self.sink.flush_interval)
+        self.assertEqual(self.stream.getvalue(), '[-] waiting\n')
+
+
+class JsonReportTest(ReportTestMixin, unittest.TestCase):
+    sink_class = report.JsonSink
+
+    def test_json_lines(self):
+        report.info('one\ntwo', label='test')
+        report.error('three')
+        records = [
+            json.loads(line) for line in self.get_output().splitlines()
+        ]
+        self.assertEqual(
+            [
+                (record['level'], record['label'], record['msg'])
+                for record in records
+            ],
+            [('info', 'test', 'one\ntwo'), ('error', None, 'three')],
+        )
+
+
+class LogReportTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sermin.log')
+        settings.sermin.report_log = self.path
+
+    def tearDown(self):
+        settings.sermin.report_log = None
+        shutil.rmtree(self.dir)
+
+    def test_log_file(self):
+        report.warning('logged', label='test')
+        report.flush()
+        with open(self.path) as file:
+            self.assertTrue(
+                file.read().endswith(' WARNING [test] logged\n'),
+            )
@@ -1,12 +1,24 @@
 """
 Test Sermin state module
 """
+import os
+import tempfile
+import textwrap
+import unittest
+
 import sermin
-from sermin import state
-from sermin.state.base.registry import registry
+from sermin import aio, state
+from sermin.state.base.parallel import in_worker
+from sermin.state.base.registry import registry, StateRegistry, use
+from sermin.state.base.scheduler import build_levels
+from sermin.utils import shell
 
 from .utils import SafeTestCase, with_settings
 
+if aio.asyncio is not None:
+    import asyncio
+    import concurrent.futures
+
 
 class StateTest(SafeTestCase):
     def test_class_does_not_register(self):
@@ -89,6 +101,361 @@ class StateTest(SafeTestCase):
         self.assertEqual(mocked.applied, True)
 
 
+class RegistryTest(SafeTestCase):
+    def test_states_in_definition_order(self):
+        class MockState(state.State):
+            pass
+
+        first = MockState()
+        second = MockState()
+        other = StateRegistry()
+        other.add(first)
+        other.add(second)
+
+        # Re-adding an earlier state puts it back in definition order
+        registry.add(first)
+        self.assertEqual(registry.states, [first])
+        self.assertEqual(other.states, [second])
+        other.add(first)
+        self.assertEqual(other.states, [first, second])
+
+    def test_extended_registry_changes_seen(self):
+        class MockState(state.State):
+            pass
+
+        first = MockState()
+        second = MockState()
+        third = MockState()
+        parent = StateRegistry()
+        child = StateRegistry()
+        parent.extend(child)
+        parent.add(first)
+        child.add(third)
+        self.assertEqual(parent.states, [first, third])
+
+        # Changes to the extended registry invalidate the parent
+        child.add(second)
+        self.assertEqual(parent.states, [first, second, third])
+        child.remove(third)
+        self.assertEqual(parent.states, [first, second])
+        child.clear()
+        self.assertEqual(parent.states, [first])
+        self.assertEqual(len(parent), 1)
+
+    @with_settings(sermin__parallel=2)
+    def test_use_registry_in_context(self):
+        seen = []
+
+        class MockState(state.State):
+            def check(self):
+                # Checked in a worker thread, which sees the same registry
+                seen.append(registry._get())
+                return True
+
+        other = StateRegistry()
+        with use(other):
+            first = MockState()
+            second = MockState()
+            self.assertIs(registry._get(), other)
+            registry.check()
+
+        self.assertEqual(len(registry), 0)
+        self.assertEqual(other.states, [first, second])
+        self.assertEqual(seen, [other, other])
+
+
+class ParallelCheckTest(SafeTestCase):
+    @with_settings(sermin__parallel=4, sermin__dryrun=True)
+    def test_all_states_checked(self):
+        class MockState(state.State):
+            checked = False
+
+            def check(self):
+                self.checked = True
+                return True
+
+        mocked = [MockState() for i in range(10)]
+        self.assertTrue(registry.check())
+        self.assertTrue(all(obj.checked for obj in mocked))
+
+    @with_settings(sermin__parallel=4, sermin__dryrun=True)
+    def test_failure_returned(self):
+        class MockState(state.State):
+            def check(self):
+                return self.creation_counter % 2 == 0
+
+        [MockState() for i in range(4)]
+        self.assertFalse(registry.check())
+
+    @with_settings(sermin__parallel=4, sermin__dryrun=True)
+    def test_children_checked_first(self):
+        order = []
+
+        class ChildState(state.State):
+            def check(self):
+                order.append(self)
+                return True
+
+        class ParentState(state.State):
+            child = ChildState()
+
+            def check(self):
+                order.append(self)
+                return True
+
+        parents = [ParentState() for i in range(4)]
+        registry.check()
+
+        # Class children are shared, so are only checked once
+        self.assertEqual(len(order), 5)
+        self.assertEqual(order[0], ParentState.child)
+        self.assertEqual(set(order[1:]), set(parents))
+
+    @with_settings(sermin__parallel=4, sermin__dryrun=True)
+    def test_shell_cd_isolated(self):
+        # Commands run in their own working directory without changing the
+        # process's, so parallel checks can't see each other's directory
+        class MockState(state.State):
+            def __init__(self, path):
+                self.path = path
+                super(MockState, self).__init__()
+
+            def check(self):
+                return shell('pwd', cd=self.path) == self.path
+
+        cwd = os.getcwd()
+        paths = [tempfile.mkdtemp() for i in range(8)]
+        try:
+            [MockState(os.path.realpath(path)) for path in paths]
+            self.assertTrue(registry.check())
+        finally:
+            for path in paths:
+                os.rmdir(path)
+        self.assertEqual(os.getcwd(), cwd)
+
+
+class ResourceState(state.State):
+    """
+    State with known resources, for testing the apply scheduler
+    """
+    def __init__(self, reads=(), writes=()):
+        super(ResourceState, self).__init__()
+        self.reads = set(reads)
+        self.writes = set(writes)
+        self.applied = False
+
+    def get_resources(self):
+        return self.reads, self.writes
+
+    def check(self):
+        return False
+
+    def apply(self):
+        self.applied = True
+
+
+class ParallelApplyTest(SafeTestCase):
+    def test_independent_states_share_level(self):
+        first = ResourceState(writes=['a'])
+        second = ResourceState(writes=['b'])
+        self.assertEqual(build_levels(registry.states), [[first, second]])
+
+    def test_conflicting_states_ordered(self):
+        writer = ResourceState(writes=['a'])
+        reader = ResourceState(reads=['a'])
+        other = ResourceState(writes=['b'])
+        rewriter = ResourceState(writes=['a'])
+        self.assertEqual(
+            build_levels(registry.states),
+            [[writer, other], [reader], [rewriter]],
+        )
+
+    def test_unknown_resources_are_barrier(self):
+        class UnknownState(state.State):
+            pass
+
+        first = ResourceState(writes=['a'])
+        barrier = UnknownState()
+        second = ResourceState(writes=['b'])
+        self.assertEqual(
+            build_levels(registry.states),
+            [[first], [barrier], [second]],
+        )
+
+    def test_listeners_ordered(self):
+        source = ResourceState(writes=['a'])
+        listener = ResourceState(writes=['b'])
+        listener.listen(source)
+        self.assertEqual(
+            build_levels(registry.states),
+            [[source], [listener]],
+        )
+
+    def test_shared_child_listeners_ordered(self):
+        class ParentState(ResourceState):
+            child = ResourceState()
+
+        source = ResourceState(writes=['a'])
+        ParentState.child.listen(source)
+        first = ParentState(writes=['b'])
+        second = ParentState(writes=['c'])
+        self.assertEqual(
+            build_levels(registry.states),
+            [[source], [first, second]],
+        )
+
+    def test_child_resources_merged(self):
+        class ParentState(ResourceState):
+            child = ResourceState(writes=['a'])
+
+        first = ResourceState(reads=['a'])
+        parent = ParentState(writes=['b'])
+        self.assertEqual(
+            build_levels(registry.states),
+            [[first], [parent]],
+        )
+
+    @with_settings(sermin__parallel=4, sermin__dryrun=False)
+    def test_apply_parallel(self):
+        class ListenerState(ResourceState):
+            heard = None
+
+            def handle_changed(self, source):
+                self.heard = source
+
+        source = ResourceState(writes=['a'])
+        others = [ResourceState(writes=[i]) for i in range(5)]
+        listener = ListenerState(writes=['b'])
+        listener.listen(source)
+        registry.run()
+
+        self.assertTrue(source.applied)
+        self.assertTrue(all(obj.applied for obj in others))
+        self.assertTrue(listener.applied)
+        self.assertEqual(listener.heard, source)
+
+
+class AsyncState(ResourceState):
+    """
+    State which checks and applies using coroutines
+    """
+    delay = 0.05
+
+    def is_async(self):
+        return True
+
+    def check(self):
+        return asyncio.sleep(self.delay, result=False)
+
+    def apply(self):
+        self.applied = True
+        return asyncio.sleep(self.delay)
+
+
+@unittest.skipIf(aio.asyncio is None, 'asyncio not available')
+class AsyncRunTest(SafeTestCase):
+    def setUp(self):
+        super(AsyncRunTest, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        super(AsyncRunTest, self).tearDown()
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def arun(self):
+        # arun must be called with the loop running
+        future = self.loop.create_future()
+        self.loop.call_soon(
+            lambda: aio.then(registry.arun(), future.set_result),
+        )
+        return self.loop.run_until_complete(future)
+
+    @with_settings(sermin__dryrun=False)
+    def test_checks_overlap(self):
+        events = []
+
+        class OverlapState(AsyncState):
+            def check(self):
+                events.append('start')
+                return aio.then(
+                    asyncio.sleep(self.delay, result=False), self.finished,
+                )
+
+            def finished(self, result):
+                events.append('end')
+                return result
+
+        states = [OverlapState(writes=[i]) for i in range(20)]
+        self.arun()
+
+        # Every check starts before any of them finishes
+        self.assertEqual(events, ['start'] * 20 + ['end'] * 20)
+        self.assertTrue(all(obj.applied for obj in states))
+
+    def define_adhoc_async(self, calls):
+        # Defined from source, as Python 2 can't parse async def
+        namespace = {'asyncio': asyncio, 'calls': calls}
+        exec(textwrap.dedent("""
+            async def async_check():
+                await asyncio.sleep(0)
+                calls.append('check')
+                return False
+
+            async def async_apply():
+                await asyncio.sleep(0)
+                calls.append('apply')
+        """), namespace)
+        return (
+            sermin.check(namespace['async_check']),
+            sermin.apply(namespace['async_apply']),
+        )
+
+    @with_settings(sermin__dryrun=False)
+    def test_adhoc_async_functions(self):
+        calls = []
+        check_state, apply_state = self.define_adhoc_async(calls)
+        self.assertTrue(check_state.is_async())
+        self.assertTrue(apply_state.is_async())
+        self.arun()
+        self.assertEqual(sorted(calls), ['apply', 'check'])
+
+    @with_settings(sermin__dryrun=False)
+    def test_adhoc_async_functions__sync_run(self):
+        calls = []
+        self.define_adhoc_async(calls)
+        registry.run()
+        self.assertEqual(sorted(calls), ['apply', 'check'])
+
+    @with_settings(sermin__dryrun=False)
+    def test_sync_states_adapted(self):
+        async_state = AsyncState(writes=['a'])
+        sync_state = ResourceState(reads=['a'])
+        self.arun()
+        self.assertTrue(async_state.applied)
+        self.assertTrue(sync_state.applied)
+
+    @with_settings(sermin__dryrun=False)
+    def test_sync_run_resolves_async(self):
+        async_state = AsyncState()
+        registry.run()
+        self.assertTrue(async_state.applied)
+
+    def test_to_thread_worker_flag_restored(self):
+        # One thread, so both calls run in it
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.loop.set_default_executor(executor)
+        self.assertTrue(
+            self.loop.run_until_complete(aio.to_thread(in_worker)),
+        )
+        self.assertFalse(
+            self.loop.run_until_complete(
+                self.loop.run_in_executor(None, in_worker),
+            ),
+        )
+
+
 class AdHocStateTest(SafeTestCase):
     def test_check_registers(self):
         self.assertFalse('MockCheckState' in registry.states)
@@ -241,6 +608,39 @@ class StateNotificationTest(SafeTestCase):
         self.assertEqual(test_listener.heard, test_source)
 
 
+class FootprintTest(SafeTestCase):
+    def test_core_states_have_no_dict(self):
+        command = sermin.Command('true')
+        self.assertFalse(hasattr(command, '__dict__'))
+
+    def test_children_and_listeners_allocated_when_added(self):
+        class MockState(state.State):
+            pass
+
+        first = MockState()
+        second = MockState()
+        self.assertIs(first.child_states, second.child_states)
+        self.assertEqual(first.listeners, ())
+
+        child = MockState()
+        first.children.add(child)
+        second.listen(first)
+        self.assertEqual(first.child_states.states, [child])
+        self.assertEqual(len(second.child_states), 0)
+        self.assertEqual(first.listeners, [second])
+
+    def test_class_registry(self):
+        other = StateRegistry()
+
+        class MockState(state.State):
+            registry = other
+
+        mocked = MockState()
+        self.assertIs(MockState.registry, other)
+        self.assertIs(mocked.registry, other)
+        self.assertEqual(len(registry), 0)
+
+
 class ChildTest(SafeTestCase):
     def test_child_states__not_in_registry_root(self):
         class ChildState(state.State):
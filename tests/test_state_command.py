@@ -29,3 +29,11 @@ class CommandTest(FullTestCase):
         Command('mkdir test', cwd=self.path)
         self.registry_run()
         self.assertTrue(os.path.isdir(os.path.join(self.path, 'test')))
+
+    def test_command_env(self):
+        shell('mkdir {}'.format(self.path))
+        Command('sh -c "mkdir $SERMIN_TEST"', cwd=self.path, env={
+            'SERMIN_TEST': 'test',
+        })
+        self.registry_run()
+        self.assertTrue(os.path.isdir(os.path.join(self.path, 'test')))
@@ -4,6 +4,7 @@ Test the Command state
 import os
 
 from sermin import File, AppendParser, IniParser
+from sermin.system.local import write_file
 from sermin.utils import shell
 
 from .utils import FullTestCase
@@ -108,6 +109,98 @@ class FileTest(FileMixin, FullTestCase):
             File(self.path, context={})
 
 
+class CountingFile(File):
+    """
+    File which counts how many times it renders and reads its target
+    """
+    renders = 0
+    reads = 0
+
+    def render(self, raw):
+        CountingFile.renders += 1
+        return super(CountingFile, self).render(raw)
+
+    def read(self, path):
+        if path == self.path:
+            CountingFile.reads += 1
+        return super(CountingFile, self).read(path)
+
+
+class FileDigestTest(FileMixin, FullTestCase):
+    def setUp(self):
+        super(FileDigestTest, self).setUp()
+        CountingFile.renders = 0
+        CountingFile.reads = 0
+
+    def rerun(self):
+        self.registry.clear()
+        state = CountingFile(self.path, content='Test {{ arg }}', context={
+            'arg': 'digest',
+        })
+        self.registry_run()
+        return state
+
+    def test_unchanged__not_read(self):
+        self.rerun()
+        self.assertEqual(CountingFile.renders, 1)
+        self.rerun()
+        self.assertEqual(CountingFile.renders, 1)
+        self.assertEqual(CountingFile.reads, 0)
+
+    def test_touched__not_rendered(self):
+        self.rerun()
+        os.utime(self.path, (0, 0))
+        self.rerun()
+        self.assertEqual(CountingFile.renders, 1)
+        self.assertEqual(CountingFile.reads, 0)
+
+    def test_content_changed__rendered(self):
+        self.rerun()
+        with open(self.path, 'w') as file:
+            file.write('Changed')
+        self.rerun()
+        self.assertEqual(self.read(), ['Test digest'])
+
+    def test_definition_changed__rendered(self):
+        self.rerun()
+        self.registry.clear()
+        CountingFile(self.path, content='Test {{ arg }}', context={
+            'arg': 'changed',
+        })
+        self.registry_run()
+        self.assertEqual(self.read(), ['Test changed'])
+
+
+class FileWriteTest(FileMixin, FullTestCase):
+    def test_write_file__keeps_mode(self):
+        write_file(self.path, data=b'Test content 1')
+        os.chmod(self.path, 0o640)
+        write_file(self.path, data=b'Test content 2')
+        self.assertEqual(self.read(), ['Test content 2'])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+
+    def test_write_file__copies_source(self):
+        with open(self.path_src, 'w') as file:
+            file.write('Test content\n' * 10000)
+        write_file(self.path, source=self.path_src)
+        self.assertEqual(self.read(), ['Test content\n'] * 10000)
+
+    def test_write_file__through_symlink(self):
+        write_file(self.path, data=b'Test content 1')
+        os.symlink(self.path, self.path_src)
+        write_file(self.path_src, data=b'Test content 2')
+        self.assertTrue(os.path.islink(self.path_src))
+        self.assertEqual(self.read(), ['Test content 2'])
+
+    def test_content_matches__not_written(self):
+        write_file(self.path, data=b'Test content')
+        inode = os.stat(self.path).st_ino
+        File(self.path, content='Test {{ arg }}', context={'arg': 'content'})
+        self.registry_run()
+        self.assertEqual(self.read(), ['Test content'])
+        self.assertEqual(os.stat(self.path).st_ino, inode)
+
+
 class FileAppendTest(FileMixin, FullTestCase):
     def test_set__new_line__new_file(self):
         File(self.path, parser=AppendParser, set=['Test content'])
@@ -1,10 +1,122 @@
 """
 Test the Package state
 """
+import os
+import tempfile
+
 from sermin import Package
+from sermin.state.core import package
+from sermin.state.core.package import DpkgStatus
 from sermin.utils import shell
 
-from .utils import FullTestCase
+from .utils import FullTestCase, SafeTestCase, with_settings
+
+
+DPKG_STATUS = """Package: sl
+Status: install ok installed
+Priority: optional
+Architecture: amd64
+Description: Steam Locomotive
+ Multi-line description
+
+Package: removed
+Status: deinstall ok config-files
+Architecture: all
+
+Package: held
+Status: hold ok installed
+Architecture: all"""
+
+
+class DpkgStatusMixin(object):
+    def setUp(self):
+        super(DpkgStatusMixin, self).setUp()
+        handle, self.path = tempfile.mkstemp()
+        os.write(handle, DPKG_STATUS.encode('utf-8'))
+        os.close(handle)
+
+    def tearDown(self):
+        super(DpkgStatusMixin, self).tearDown()
+        os.remove(self.path)
+
+
+class DpkgStatusTest(DpkgStatusMixin, SafeTestCase):
+    def test_installed(self):
+        dpkg = DpkgStatus(self.path)
+        self.assertEqual(
+            dpkg.installed,
+            {'sl', 'sl:amd64', 'held', 'held:all'},
+        )
+        self.assertTrue(dpkg.is_installed('sl'))
+        self.assertFalse(dpkg.is_installed('removed'))
+        self.assertFalse(dpkg.is_installed('missing'))
+
+    def test_reads_once(self):
+        dpkg = DpkgStatus(self.path)
+        self.assertIs(dpkg.installed, dpkg.installed)
+
+    def test_rereads_on_change(self):
+        dpkg = DpkgStatus(self.path)
+        self.assertFalse(dpkg.is_installed('new'))
+        with open(self.path, 'a') as file:
+            file.write('\n\nPackage: new\nStatus: install ok installed\n')
+        self.assertTrue(dpkg.is_installed('new'))
+
+
+class PackageBatchTest(DpkgStatusMixin, SafeTestCase):
+    """
+    Test batched changes against a fake dpkg status and apt-get
+    """
+    def setUp(self):
+        super(PackageBatchTest, self).setUp()
+        self.commands = []
+        self.old_shell = package.shell
+        self.old_dpkg = Package.dpkg
+        package.shell = self.fake_shell
+        Package.dpkg = DpkgStatus(self.path)
+
+    def tearDown(self):
+        super(PackageBatchTest, self).tearDown()
+        package.shell = self.old_shell
+        Package.dpkg = self.old_dpkg
+
+    def fake_shell(self, cmd, **kwargs):
+        if cmd == 'apt-get update':
+            return
+        self.commands.append(cmd)
+        if cmd[:2] == ['apt-get', 'install']:
+            with open(self.path, 'a') as file:
+                for name in cmd[3:]:
+                    file.write(
+                        '\n\nPackage: {}\nStatus: install ok installed'
+                        .format(name)
+                    )
+
+    @with_settings(sermin__batch=True, sermin__dryrun=False)
+    def test_single_transaction(self):
+        first = Package('first')
+        second = Package('second')
+        Package('sl')
+        self.registry_run()
+        self.assertEqual(
+            self.commands,
+            [['apt-get', 'install', '--yes', 'first', 'second']],
+        )
+        self.assertTrue(first.is_installed)
+        self.assertTrue(second.is_installed)
+
+    @with_settings(sermin__batch=True, sermin__dryrun=False)
+    def test_install_and_remove(self):
+        Package('first')
+        Package('sl', state=Package.ABSENT)
+        self.assertRaisesRegexp(
+            package.RunError, '^Package sl was not removed$',
+            self.registry_run,
+        )
+        self.assertEqual(self.commands, [
+            ['apt-get', 'install', '--yes', 'first'],
+            ['apt-get', 'remove', '--purge', '--yes', 'sl'],
+        ])
 
 
 class PackageTest(FullTestCase):
@@ -1,10 +1,48 @@
 """
 Test the Service state
 """
+import os
+
+import psutil
+
 from sermin import Service
+from sermin.state.core.service import ProcessSnapshot
 from sermin.utils import shell, ShellError
 
-from .utils import FullTestCase
+from .utils import FullTestCase, SafeTestCase
+
+
+class ProcessSnapshotTest(SafeTestCase):
+    def setUp(self):
+        super(ProcessSnapshotTest, self).setUp()
+        self.current = psutil.Process(os.getpid())
+
+    def test_find_by_name(self):
+        processes = ProcessSnapshot()
+        proc = processes.find(self.current.name())
+        self.assertIsNotNone(proc)
+        self.assertEqual(proc.name(), self.current.name())
+
+    def test_find_by_exe(self):
+        processes = ProcessSnapshot()
+        proc = processes.find(self.current.exe())
+        self.assertIsNotNone(proc)
+        self.assertEqual(proc.exe(), self.current.exe())
+
+    def test_missing(self):
+        processes = ProcessSnapshot()
+        self.assertIsNone(processes.find('sermin-missing-process'))
+
+    def test_scans_once(self):
+        processes = ProcessSnapshot()
+        processes.find(self.current.name())
+        by_name = processes.by_name
+        processes.find(self.current.name())
+        self.assertIs(processes.by_name, by_name)
+
+        processes.invalidate()
+        processes.find(self.current.name())
+        self.assertIsNot(processes.by_name, by_name)
 
 
 class ServiceTest(FullTestCase):
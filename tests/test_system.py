@@ -0,0 +1,389 @@
+"""
+Test system backends
+"""
+import os
+import unittest
+
+from sermin import Command, Dir, File, Git, Group, Package, Service, User
+from sermin import system
+from sermin.config import settings
+from sermin.exceptions import RunError
+from sermin.state.core.git import mirrors
+from sermin.system.identities import (
+    GROUP, GSHADOW, PASSWD, SHADOW, IdentityDatabase, IdentityError, LoginDefs,
+    UserSpec,
+)
+from sermin.system.memory import MemorySystem
+from sermin.utils import shell, ShellError
+
+from .utils import SafeTestCase, with_settings
+
+
+class MemorySystemTestCase(SafeTestCase):
+    """
+    Run states against a new in-memory system
+    """
+    def setUp(self):
+        super(MemorySystemTestCase, self).setUp()
+        self.old_system = settings.sermin.system
+        self.system = system.systems['memory'] = MemorySystem()
+        settings.sermin.system = 'memory'
+
+    def tearDown(self):
+        settings.sermin.system = self.old_system
+        super(MemorySystemTestCase, self).tearDown()
+
+
+class MemorySystemTest(unittest.TestCase):
+    def setUp(self):
+        self.system = MemorySystem()
+
+    def test_write_read(self):
+        self.system.makedirs('/srv')
+        self.system.write('/srv/test', b'content')
+        self.assertTrue(self.system.exists('/srv/test'))
+        self.assertFalse(self.system.isdir('/srv/test'))
+        self.assertEqual(self.system.read('/srv/test'), b'content')
+        self.assertEqual(self.system.stat('/srv/test')[0], 7)
+
+    def test_write__missing_dir(self):
+        with self.assertRaises(IOError):
+            self.system.write('/missing/test', b'content')
+
+    def test_rmdir__not_empty(self):
+        self.system.makedirs('/srv/test')
+        with self.assertRaises(OSError):
+            self.system.rmdir('/srv')
+
+    def test_databases(self):
+        self.system.add_user('alice', 1001)
+        self.system.add_group('staff', 50, ['alice'])
+        self.system.add_package('nginx')
+        passwd = self.system.read('/etc/passwd').decode('utf-8')
+        group = self.system.read('/etc/group').decode('utf-8')
+        dpkg = self.system.read('/var/lib/dpkg/status').decode('utf-8')
+        self.assertIn('alice:x:1001:1001::/nonexistent:/bin/sh', passwd)
+        self.assertIn('staff:x:50:alice', group)
+        self.assertIn('Package: nginx\n', dpkg)
+
+
+class IdentityDatabaseTest(unittest.TestCase):
+    def test_login_defs(self):
+        login_defs = LoginDefs(
+            'PASS_MAX_DAYS 90\nUMASK 077\nUID_MIN invalid\n',
+        )
+        self.assertEqual(login_defs['PASS_MAX_DAYS'], 90)
+        self.assertEqual(login_defs['UID_MIN'], 1000)
+        self.assertEqual(login_defs.home_mode, 0o700)
+        self.assertEqual(LoginDefs('HOME_MODE 0750\n').home_mode, 0o750)
+        self.assertEqual(LoginDefs().home_mode, 0o755)
+
+    def test_shadow_aging(self):
+        database = IdentityDatabase(
+            {PASSWD: '', SHADOW: '', GROUP: '', GSHADOW: ''},
+            LoginDefs('PASS_MIN_DAYS 1\nPASS_MAX_DAYS 90\nPASS_WARN_AGE 14'),
+        )
+        database.add_user(UserSpec('alice'))
+        self.assertEqual(database.shadow.find('alice')[3:6], ['1', '90', '14'])
+
+    def test_no_free_ids(self):
+        database = IdentityDatabase(
+            {PASSWD: 'alice:x:1000:1000::/:\n', GROUP: ''},
+            LoginDefs('UID_MIN 1000\nUID_MAX 1000\n'),
+        )
+        with self.assertRaisesRegexp(IdentityError, 'No free ids'):
+            database.add_user(UserSpec('bob'))
+
+
+class MemoryShellTest(MemorySystemTestCase):
+    def test_records_commands(self):
+        self.assertEqual(shell('echo hello'), 'hello')
+        self.assertEqual(self.system.commands, [['echo', 'hello']])
+
+    def test_unknown_command(self):
+        with self.assertRaises(ShellError):
+            shell('rm -rf /')
+        self.assertEqual(
+            shell('rm -rf /', expect_errors=True).return_code, 127,
+        )
+
+    def test_local_cache_not_used(self):
+        File('/test', content='content')
+        self.registry_run()
+        self.assertEqual(self.system.read('/test'), b'content')
+        self.assertEqual(os.listdir(self.cache), [])
+
+
+class MemoryStatesTest(MemorySystemTestCase):
+    def test_file(self):
+        self.system.makedirs('/srv')
+        File('/srv/test', content='content')
+        self.registry_run()
+        self.assertEqual(self.system.read('/srv/test'), b'content')
+
+    def test_dir(self):
+        Dir('/srv/test')
+        self.registry_run()
+        self.assertTrue(self.system.isdir('/srv/test'))
+
+    def test_package(self):
+        Package('nginx')
+        self.registry_run()
+        self.assertIn('nginx', self.system.packages)
+        self.assertIn(['apt-get', 'install', '--yes', 'nginx'], [
+            cmd for cmd in self.system.commands if cmd[0] == 'apt-get'
+        ])
+
+    def test_package__already_installed(self):
+        self.system.add_package('nginx')
+        Package('nginx')
+        self.registry_run()
+        self.assertEqual(self.system.commands, [])
+
+    def test_user(self):
+        User('alice', uid=1001, home='/home/alice')
+        self.registry_run()
+        self.assertEqual(self.system.users['alice'][0], 1001)
+        self.assertTrue(self.system.isdir('/home/alice'))
+
+    def test_group(self):
+        Group('staff', gid=50)
+        self.registry_run()
+        self.assertEqual(self.system.groups['staff'][0], 50)
+
+    def test_identity_labels_run_no_commands(self):
+        group = Group('staff')
+        user = User('alice', home=None, group=group)
+        self.registry_run()
+        self.assertEqual(
+            [cmd[0] for cmd in self.system.commands], ['addgroup', 'useradd'],
+        )
+        self.assertEqual(str(group), 'staff (1000)')
+        self.assertEqual(str(user), 'alice (1000)')
+        self.assertEqual(len(self.system.commands), 2)
+
+    @with_settings(sermin__batch=True)
+    def test_identities__batch(self):
+        staff = Group('staff', gid=50)
+        User('alice', uid=1001, group=staff, home='/home/{name}')
+        User('bob', home=None)
+        self.registry_run()
+        self.assertEqual(self.system.commands, [])
+        self.assertEqual(self.system.groups['staff'][0], 50)
+        self.assertEqual(self.system.users['alice'][:2], [1001, 50])
+        self.assertEqual(self.system.users['bob'][:2], [1000, 1000])
+        self.assertEqual(self.system.groups['bob'][0], 1000)
+        self.assertTrue(self.system.isdir('/home/alice'))
+
+    @with_settings(sermin__batch=True)
+    def test_identities__batch_login_defs(self):
+        self.system.write('/etc/login.defs', (
+            '# Comment\n'
+            'UID_MIN\t\t2000\n'
+            'GID_MIN 3000\n'
+        ).encode('utf-8'))
+        Group('staff')
+        User('alice', group='staff', home=None)
+        self.registry_run()
+        self.assertEqual(self.system.groups['staff'][0], 3000)
+        self.assertEqual(self.system.users['alice'][:2], [2000, 3000])
+
+    @with_settings(sermin__batch=True)
+    def test_identities__batch_backups(self):
+        passwd = self.system.read('/etc/passwd')
+        group = self.system.read('/etc/group')
+        User('alice', home=None)
+        self.registry_run()
+        self.assertEqual(self.system.read('/etc/passwd-'), passwd)
+        self.assertEqual(self.system.read('/etc/group-'), group)
+
+    @with_settings(sermin__batch=True)
+    def test_identities__batch_caches_invalidated(self):
+        self.system.makedirs('/usr/sbin')
+        self.system.write('/usr/sbin/nscd', b'')
+        User('alice', home=None)
+        self.registry_run()
+        self.assertEqual(self.system.commands, [
+            ['/usr/sbin/nscd', '-i', 'passwd'],
+            ['/usr/sbin/nscd', '-i', 'group'],
+        ])
+
+    @with_settings(sermin__batch=True)
+    def test_identities__batch_change_made_once(self):
+        calls = []
+
+        class CountingUser(User):
+            __slots__ = ()
+
+            def get_batch_change(self):
+                calls.append(self.name)
+                return super(CountingUser, self).get_batch_change()
+
+        CountingUser('alice', home=None)
+        self.registry_run()
+        self.assertEqual(calls, ['alice'])
+
+    @with_settings(sermin__batch=True)
+    def test_identities__batch_error(self):
+        User('alice', uid=0)
+        User('bob')
+        with self.assertRaises(RunError) as cm:
+            self.registry_run()
+        self.assertIn('Uid 0 is already in use', str(cm.exception))
+        self.assertIn('bob', self.system.users)
+        self.assertNotIn('alice', self.system.users)
+
+    def test_service(self):
+        Service('nginx')
+        self.registry_run()
+        self.assertIn('nginx', self.system.procs)
+
+    def test_git(self):
+        remote = 'https://example.com/repo.git'
+        self.system.add_remote(remote)
+        self.system.makedirs('/srv')
+        Git('/srv/repo', remote=remote, branch='master')
+        self.registry_run()
+        self.assertIn('/srv/repo', self.system.repos)
+        self.assertEqual(self.system.repos['/srv/repo'].branch, 'master')
+
+    def test_git__no_change(self):
+        remote = 'https://example.com/repo.git'
+        self.system.add_remote(remote, tags={'v1': 'a' * 40})
+        self.system.add_repo('/srv/repo', remote)
+        Git('/srv/repo', remote=remote, branch='master')
+        self.registry_run()
+        # Refs are read from the .git dir; only the fetch runs git
+        self.assertEqual(
+            self.system.commands, [['git', 'fetch', '--tags', 'origin']],
+        )
+
+    def test_git__mirror(self):
+        remote = 'https://example.com/repo.git'
+        self.system.add_remote(remote)
+        self.system.makedirs('/srv')
+        Git('/srv/one', remote=remote)
+        Git('/srv/two', remote=remote)
+        self.registry_run()
+
+        mirror = mirrors.get_path(remote)
+        self.assertTrue(self.system.repos[mirror].bare)
+        clones = [cmd for cmd in self.system.commands if cmd[1] == 'clone']
+        self.assertEqual(clones, [
+            ['git', 'clone', '--mirror', remote, mirror],
+            [
+                'git', 'clone', '--reference', mirror, '--dissociate', remote,
+                'one',
+            ],
+            [
+                'git', 'clone', '--reference', mirror, '--dissociate', remote,
+                'two',
+            ],
+        ])
+
+        # Clones don't depend on the mirror
+        self.assertIsNone(self.system.repos['/srv/one'].reference)
+        self.assertIsNone(self.system.repos['/srv/two'].reference)
+
+        # Updated once in the next run
+        self.system.commands = []
+        Git('/srv/three', remote=remote)
+        Git('/srv/four', remote=remote)
+        self.registry_run()
+        self.assertEqual(
+            [cmd[1:3] for cmd in self.system.commands].count(
+                ['remote', 'update'],
+            ),
+            1,
+        )
+
+    def test_git__mirror_failed(self):
+        remote = 'https://example.com/repo.git'
+        self.system.add_remote(remote)
+        self.system.makedirs('/srv')
+
+        # Not a repository, so can't be updated
+        self.system.makedirs(mirrors.get_path(remote))
+        Git('/srv/one', remote=remote)
+        Git('/srv/two', remote=remote)
+        self.registry_run()
+
+        self.assertIsNone(self.system.repos['/srv/one'].reference)
+        self.assertIn(['git', 'clone', remote, 'one'], self.system.commands)
+        self.assertIn(['git', 'clone', remote, 'two'], self.system.commands)
+        self.assertEqual(
+            [cmd[1:3] for cmd in self.system.commands].count(
+                ['remote', 'update'],
+            ),
+            1,
+        )
+
+    @with_settings(sermin__git_mirrors='')
+    def test_git__no_mirror(self):
+        remote = 'https://example.com/repo.git'
+        self.system.add_remote(remote)
+        self.system.makedirs('/srv')
+        Git('/srv/one', remote=remote)
+        self.registry_run()
+        self.assertIn(
+            ['git', 'clone', remote, 'one'], self.system.commands,
+        )
+
+    @with_settings(sermin__git_fetch='needed')
+    def test_git__fetch_needed(self):
+        remote = 'https://example.com/repo.git'
+        self.system.add_remote(remote, tags={'v1': 'a' * 40})
+        repo = self.system.add_repo('/srv/repo', remote)
+        Git('/srv/repo', remote=remote, commit=repo.head)
+        Git('/srv/other', remote=remote, tag='v1')
+        self.system.add_repo('/srv/other', remote)
+        self.registry_run()
+        # The tag is checked out without fetching
+        self.assertEqual(
+            self.system.commands, [['git', 'checkout', 'a' * 40]],
+        )
+
+    def test_git__fetch_interval(self):
+        remote = 'https://example.com/repo.git'
+        fetch_head = '/srv/repo/.git/FETCH_HEAD'
+        self.system.add_remote(remote)
+        self.system.add_repo('/srv/repo', remote)
+        git = Git('/srv/repo', remote=remote, fetch=3600)
+        self.assertTrue(git.needs_fetch(git.repo.current_commit))
+
+        self.registry_run()
+        self.assertEqual(
+            self.system.commands, [['git', 'fetch', '--tags', 'origin']],
+        )
+        self.assertFalse(git.needs_fetch(git.repo.current_commit))
+
+        self.system.files[fetch_head][1] -= 3600
+        self.assertTrue(git.needs_fetch(git.repo.current_commit))
+
+    def test_git__fetch_invalid(self):
+        with self.assertRaises(ValueError):
+            Git('/srv/repo', remote='https://example.com/repo.git', fetch='x')
+
+    def test_git__reads_refs(self):
+        remote = 'https://example.com/repo.git'
+        self.system.add_remote(remote, tags={'v1': 'a' * 40})
+        repo = self.system.add_repo('/srv/repo', remote)
+        git = Git('/srv/repo', remote=remote)
+        self.assertEqual(git.repo.current_commit, repo.head)
+        self.assertEqual(git.repo.current_branch, 'master')
+        self.assertEqual(git.repo.branch_head('master'), repo.head)
+        self.assertEqual(git.repo.tag_commit('v1'), 'a' * 40)
+        self.assertEqual(git.repo.remotes['origin']['fetch'], remote)
+
+        # Loose refs take precedence over packed refs
+        self.system.makedirs('/srv/repo/.git/refs/tags')
+        self.system.write('/srv/repo/.git/refs/tags/v1', b'b' * 40)
+        self.system.write('/srv/repo/.git/HEAD', b'c' * 40)
+        self.assertEqual(git.repo.current_commit, 'c' * 40)
+        self.assertEqual(git.repo.current_branch, '')
+        self.assertEqual(self.system.commands, [])
+
+    def test_command(self):
+        Command('true')
+        self.registry_run()
+        self.assertEqual(self.system.commands, [['true']])
@@ -0,0 +1,45 @@
+"""
+Test Sermin templates module
+"""
+import os
+
+from sermin import templates
+
+from .utils import SafeTestCase, with_settings
+
+
+class TemplatesTest(SafeTestCase):
+    def test_render(self):
+        self.assertEqual(
+            templates.render('Test {{ arg }}', {'arg': 'render'}),
+            'Test render',
+        )
+
+    def test_same_source_compiled_once(self):
+        first = templates.get_template('Test {{ arg }} shared')
+        second = templates.get_template('Test {{ arg }} shared')
+        self.assertIs(first, second)
+
+    @with_settings(sermin__template_cache_size=2)
+    def test_sources_not_kept(self):
+        for i in range(5):
+            templates.render('Test {{ arg }} %d' % i, {'arg': i})
+        environment = templates.get_environment()
+        self.assertEqual(len(environment.cache), 2)
+        self.assertIsNone(environment.loader._loading.sources)
+
+        # Evicted templates are compiled again from their source
+        self.assertEqual(
+            templates.render('Test {{ arg }} 0', {'arg': 'again'}),
+            'Test again 0',
+        )
+
+    def test_bytecode_cache(self):
+        path = os.path.join(self.cache, 'templates')
+
+        @with_settings(sermin__template_cache=path)
+        def render():
+            return templates.render('Test {{ arg }}', {'arg': 'cached'})
+
+        self.assertEqual(render(), 'Test cached')
+        self.assertEqual(len(os.listdir(path)), 1)
@@ -0,0 +1,168 @@
+"""
+Test Sermin utils module
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+from sermin.config import settings
+from sermin.utils import shell, ShellError
+
+from .utils import SafeTestCase
+
+
+class ShellTestMixin(object):
+    backend = None
+
+    def setUp(self):
+        super(ShellTestMixin, self).setUp()
+        self.old_backend = settings.sermin.shell_backend
+        settings.sermin.shell_backend = self.backend
+
+    def tearDown(self):
+        super(ShellTestMixin, self).tearDown()
+        settings.sermin.shell_backend = self.old_backend
+
+    def test_stdout(self):
+        out = shell(['echo', 'hello world'])
+        self.assertEqual(out, 'hello world')
+        self.assertEqual(out.stdout, 'hello world')
+        self.assertEqual(out.return_code, 0)
+
+    def test_stderr(self):
+        out = shell(['ls', '/sermin-missing'], expect_errors=True)
+        self.assertEqual(out.stdout, '')
+        self.assertIn('sermin-missing', out.stderr)
+        self.assertNotEqual(out.return_code, 0)
+
+    def test_error_raises(self):
+        with self.assertRaisesRegexp(ShellError, r'^Unexpected return code'):
+            shell('false')
+
+    def test_cd(self):
+        cwd = os.getcwd()
+        self.assertEqual(shell('pwd', cd='/tmp'), '/tmp')
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_env(self):
+        self.assertEqual(
+            shell(['sh', '-c', 'echo $SERMIN_TEST'], env={
+                'SERMIN_TEST': "it's set",
+            }),
+            "it's set",
+        )
+        self.assertNotIn('SERMIN_TEST', os.environ)
+
+    def test_threads(self):
+        results = {}
+
+        def run(path):
+            results[path] = shell('pwd', cd=path)
+
+        threads = [
+            threading.Thread(target=run, args=(path,))
+            for path in ['/', '/tmp', '/usr', '/etc'] * 5
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(
+            path == result for path, result in results.items()
+        ))
+
+    def test_stdin(self):
+        self.assertEqual(shell('cat', stdin=b'from stdin'), 'from stdin')
+
+    def test_quoting(self):
+        self.assertEqual(shell(['echo', "it's $HOME;"]), "it's $HOME;")
+
+
+class PopenShellTest(ShellTestMixin, SafeTestCase):
+    backend = 'popen'
+
+
+class CoprocessShellTest(ShellTestMixin, SafeTestCase):
+    backend = 'coprocess'
+
+    def test_commands_overlap(self):
+        # Each command waits for the other to start, so they only both
+        # succeed if they run at the same time
+        path = tempfile.mkdtemp()
+        script = (
+            'touch {0}/$0; i=0; '
+            'while [ ! -e {0}/$1 ] && [ $i -lt 500 ]; do '
+            'sleep 0.01; i=$((i + 1)); done; '
+            '[ -e {0}/$1 ]'
+        ).format(path)
+        results = []
+
+        def run(mine, other):
+            results.append(shell(
+                ['sh', '-c', script, mine, other], expect_errors=True,
+            ).return_code)
+
+        threads = [
+            threading.Thread(target=run, args=('a', 'b')),
+            threading.Thread(target=run, args=('b', 'a')),
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            shutil.rmtree(path)
+        self.assertEqual(results, [0, 0])
+
+
+class ShellStreamTestMixin(object):
+    def setUp(self):
+        super(ShellStreamTestMixin, self).setUp()
+        self.old_tail = settings.sermin.shell_tail
+        settings.sermin.shell_tail = 3
+
+    def tearDown(self):
+        super(ShellStreamTestMixin, self).tearDown()
+        settings.sermin.shell_tail = self.old_tail
+
+    def test_stream_tail(self):
+        out = shell(['seq', '1', '10'], stream=True)
+        self.assertEqual(out, '8\n9\n10')
+        self.assertEqual(out.stdout, '8\n9\n10')
+        self.assertEqual(out.return_code, 0)
+
+    def test_stream_file(self):
+        out = shell(['seq', '1', '10'], stream=True)
+        self.assertEqual(
+            out.stdout_file.read(),
+            ''.join('{}\n'.format(i) for i in range(1, 11)).encode('ascii'),
+        )
+
+    def test_stream_stderr(self):
+        out = shell(
+            ['sh', '-c', 'echo out; echo err >&2; exit 1'],
+            stream=True, expect_errors=True,
+        )
+        self.assertEqual(out, 'out\nerr')
+        self.assertEqual(out.stdout, 'out')
+        self.assertEqual(out.stderr, 'err')
+        self.assertEqual(out.stderr_file.read(), b'err\n')
+        self.assertEqual(out.return_code, 1)
+
+    def test_stream_partial_line(self):
+        out = shell(['printf', 'one\ntwo'], stream=True)
+        self.assertEqual(out, 'one\ntwo')
+
+
+class PopenShellStreamTest(
+    ShellStreamTestMixin, ShellTestMixin, SafeTestCase,
+):
+    backend = 'popen'
+
+
+class CoprocessShellStreamTest(
+    ShellStreamTestMixin, ShellTestMixin, SafeTestCase,
+):
+    backend = 'coprocess'
@@ -3,6 +3,8 @@ Test utils
 """
 from collections import defaultdict
 import os
+import shutil
+import tempfile
 
 import unittest
 
@@ -15,10 +17,21 @@ class RegistryTestMixin(object):
 
     def setUp(self):
         self.registry.clear()
+
+        # Keep the local cache out of the home dir
+        self.old_cache = settings.sermin.cache
+        self.cache = tempfile.mkdtemp()
+        settings.sermin.cache = self.cache
+        self.old_git_mirrors = settings.sermin.git_mirrors
+        settings.sermin.git_mirrors = os.path.join(self.cache, 'git-mirrors')
+
         self.clean()
 
     def tearDown(self):
         self.registry.clear()
+        settings.sermin.cache = self.old_cache
+        settings.sermin.git_mirrors = self.old_git_mirrors
+        shutil.rmtree(self.cache)
         self.clean()
 
     def clean(self):